@@ -22,7 +22,9 @@ import re
 from typing import Optional, Callable, List, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
-from openai import OpenAI
+
+import llm_cache
+import prompt_builder
 
 
 # ============================================================
@@ -36,6 +38,7 @@ class ThinkingStep:
     status: str         # "running", "success", "warning", "error"
     message: str        # 主要信息
     detail: Optional[str] = None  # 补充细节
+    cache_hit: bool = False       # LLM 响应来自 llm_cache
 
 
 class NodeType(Enum):
@@ -282,10 +285,14 @@ def _node_respond(state: AgentState) -> AgentState:
 """
     
     try:
-        response = _call_llm(state.api_key, full_prompt, state.user_query)
+        response, cache_hit = _call_llm(
+            state.api_key, full_prompt, state.user_query,
+            fingerprint=state.ctx.get("fingerprint"),
+        )
         state.final_response = response
         state.thinking_steps[-1].status = "success"
-        state.thinking_steps[-1].message = "Response ready"
+        state.thinking_steps[-1].message = "Response ready (cached)" if cache_hit else "Response ready"
+        state.thinking_steps[-1].cache_hit = cache_hit
     except Exception as e:
         state.final_response = f"I apologize, but I encountered an error: {str(e)}"
         state.thinking_steps[-1].status = "error"
@@ -419,21 +426,13 @@ def _calculate_stress(ctx: dict, params: dict) -> dict:
     }
 
 
-def _call_llm(api_key: str, system_prompt: str, user_query: str) -> str:
-    """调用 LLM (无头版)"""
-    client = OpenAI(api_key=api_key)
-    
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_query},
-        ],
-        max_tokens=400,
-        temperature=0.3,
+def _call_llm(api_key: str, system_prompt: str, user_query: str,
+              fingerprint: Optional[str] = None) -> Tuple[str, bool]:
+    """调用 LLM (无头版)，经 llm_cache 缓存，返回 (response, cache_hit)"""
+    return llm_cache.cached_chat(
+        api_key, system_prompt, user_query,
+        fingerprint=fingerprint, max_tokens=400, temperature=0.3,
     )
-    
-    return response.choices[0].message.content
 
 
 # ============================================================
@@ -444,22 +443,10 @@ def build_system_prompt(ctx: dict) -> str:
     """
     构建标准的 System Prompt
     
-    这个函数也可以被 UI 层调用，保持一致性
+    这个函数也可以被 UI 层调用，保持一致性。
+    组合快照来自 prompt_builder（紧凑编码、按 ctx 指纹缓存、受 token 预算约束）
     """
-    funded_status = ctx['funded_status']
-    total_assets = ctx['total_assets']
-    total_liabilities = ctx['total_liabilities']
-    surplus = ctx['surplus']
-    asset_dur = ctx['asset_dur']
-    liability_dur = ctx['liability_dur']
-    duration_gap = asset_dur - liability_dur
-    fx_pct = ctx['fx_pct']
-
-    comp_df = ctx['comp_df']
-    allocation_str = comp_df[['asset_class', 'current_weight', 'policy_target']].to_string(index=False)
-
-    limits_df = ctx['limits_df']
-    limits_str = limits_df[['asset_class', 'current_weight', 'range_min', 'range_max', 'Status']].to_string(index=False)
+    snapshot = prompt_builder.build_prompt_context(ctx).text
 
     return f"""You are a Risk Advisor for HOOPP (Healthcare of Ontario Pension Plan), a $125B Canadian defined benefit pension fund.
 
@@ -468,24 +455,11 @@ IMPORTANT: You are part of an Agentic System with AUDIT capabilities.
 - If a suggestion exceeds limits, the system auto-adjusts to a compliant alternative
 - Always acknowledge when the system has auto-corrected your initial suggestion
 
-=== PORTFOLIO SNAPSHOT ===
-
-Key Metrics:
-- Funded Status: {funded_status:.1%} (Target: 111%)
-- Total Assets: ${total_assets/1000:.1f}B | Liabilities: ${total_liabilities/1000:.1f}B
-- Surplus: ${surplus/1000:.1f}B
-- Duration Gap: {duration_gap:.1f} years (Asset: {asset_dur:.1f} | Liab: {liability_dur:.1f})
-- FX Exposure: {fx_pct:.1%} (Limit: 15%)
-
 === COMPLIANCE LIMITS ===
 - Max Hedge Ratio: 80%
 - Max FX Exposure: 15%
 - Min Equity Exposure: 20%
 - Single Issuer Limit: 5%
 
-Asset Allocation:
-{allocation_str}
-
-Limit Status:
-{limits_str}
+{snapshot}
 """
\ No newline at end of file
@@ -13,15 +13,47 @@ agent_logic_gov.py — Governance Engine with Tool Calling & Human-in-the-loop
     - agent_logic.py: 手动 while 循环
     - agent_logic_lg.py: LangGraph 基础版
     - agent_logic_gov.py: LangGraph + Tool Calling + Interrupt (本文件)
+
+运行方式:
+    run_agent / run_agent_stream     — 同步图，Streamlit tab 使用
+    arun_agent / arun_agent_stream   — 异步图，LLM 走 AsyncOpenAI，供 API / 压测并发调用
+
+审批 (Human-in-the-loop):
+    check_hedge_compliance 由 audit_engine 对操作后的组合做全部限额审计，并解析求出
+    最大合规比例，建议值一步到位（保证合规）；
+    超限操作在 wait_approval 节点 interrupt() 暂停，状态由 graph_checkpoint 的 checkpointer
+    按 thread_id 保存（ctx 只存指纹）；process_approval(status, thread_id) 用
+    Command(resume=...) 从断点继续，pending_approval(thread_id) 在 rerun / 重启后取回审批上下文
+
+可观测性:
+    每个节点产生的 ThinkingStep 带开始 / 结束时间、LLM token 用量和缓存命中；
+    step_records / append_metrics_log 导出为扁平记录，供跨 session 汇总
 """
 
+import asyncio
+import functools
 import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, List, Tuple, TypedDict, Literal, Any
-from dataclasses import dataclass
-from openai import OpenAI
+from dataclasses import dataclass, asdict
+
+import llm_client
+import llm_cache
+import intent_router
+import graph_checkpoint
+import audit_engine
+import cov_service
+import tool_cache
+import var_engine
+import risk_attribution
 
 # LangGraph imports
 from langgraph.graph import StateGraph, END
+from langgraph.config import get_stream_writer
+from langgraph.types import Command, interrupt
 
 # 从 skills_v2.py 导入工具
 from skills_v2 import (
@@ -32,6 +64,8 @@ from skills_v2 import (
     check_hedge_compliance,
     get_limit_status,
     get_asset_allocation,
+    get_surplus_var,
+    get_risk_attribution,
     COMPLIANCE_LIMITS,
 )
 
@@ -52,6 +86,17 @@ class ThinkingStep:
     tool_result: Optional[str] = None
     is_warning: bool = False
     requires_approval: bool = False  # 新增: 是否需要审批
+    cache_hit: bool = False          # LLM 响应来自 llm_cache；Execute 步骤: 工具输出来自 tool_cache
+    started_at: Optional[float] = None   # 节点开始 / 结束时间 (epoch 秒)，由 _timed_node 填写
+    ended_at: Optional[float] = None
+    prompt_tokens: int = 0               # 本步骤 LLM 调用的 token 用量（未调用 / 命中缓存为 0）
+    completion_tokens: int = 0
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.started_at is None or self.ended_at is None:
+            return None
+        return (self.ended_at - self.started_at) * 1000
 
 
 class AgentState(TypedDict):
@@ -59,12 +104,15 @@ class AgentState(TypedDict):
     user_query: str
     ctx: dict
     api_key: str
+    thread_id: str              # checkpointer 的线程 id，审批时用它恢复
     
     # 思考过程
     thinking_steps: List[ThinkingStep]
     
     # Tool Calling 结果
-    selected_tool: str
+    tool_calls: List[dict]      # [{"tool": name, "params": {...}}]，一轮可以有多个
+    tool_results: List[dict]    # [{"tool", "params", "output"}]，与 tool_calls 一一对应
+    selected_tool: str          # 主工具（有对冲检查时优先），单工具字段保留给审批流程
     tool_input: dict
     tool_output: dict
     
@@ -87,15 +135,61 @@ TOOL_MAP = {
     "check_hedge_compliance": check_hedge_compliance,
     "get_limit_status": get_limit_status,
     "get_asset_allocation": get_asset_allocation,
+    "get_surplus_var": get_surplus_var,
+    "get_risk_attribution": get_risk_attribution,
 }
 
 TOOL_DESCRIPTIONS = get_tool_descriptions()
 
+# 一轮对话最多执行的工具数；多个工具在共享线程池里并发执行（工具只读 ctx）
+MAX_TOOL_CALLS = 4
+_tool_executor = ThreadPoolExecutor(max_workers=MAX_TOOL_CALLS, thread_name_prefix="gov-tool")
+
+# run_agent_stream 中 respond 节点 token 增量事件的 node_name
+TOKEN_EVENT = "token"
+
+# 设置后每轮对话的步骤指标追加写入这个 JSONL 文件（跨 session 汇总用）
+AGENT_METRICS_LOG = os.environ.get("AGENT_METRICS_LOG") or None
+
+
+# ============================================================
+# 节点计时
+# ============================================================
+
+def _stamp_steps(state: AgentState, result: AgentState, started: float, ended: float) -> AgentState:
+    """给本节点新追加的 ThinkingStep 填上节点的开始 / 结束时间"""
+    n_before = len(state.get("thinking_steps", []))
+    for step in result.get("thinking_steps", [])[n_before:]:
+        if step.started_at is None:
+            step.started_at = started
+        if step.ended_at is None:
+            step.ended_at = ended
+    return result
+
+
+def _timed_node(fn):
+    """节点装饰器: 记录节点耗时到它产生的 ThinkingStep 上（同步 / 异步节点都适用）"""
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def _async_wrapper(state: AgentState) -> AgentState:
+            started = time.time()
+            result = await fn(state)
+            return _stamp_steps(state, result, started, time.time())
+        return _async_wrapper
+
+    @functools.wraps(fn)
+    def _wrapper(state: AgentState) -> AgentState:
+        started = time.time()
+        result = fn(state)
+        return _stamp_steps(state, result, started, time.time())
+    return _wrapper
+
 
 # ============================================================
 # 工具执行辅助函数 (绕过 @tool 装饰器直接执行)
 # ============================================================
 
+@tool_cache.memoize()
 def _execute_get_risk_metrics(ctx: dict) -> dict:
     """执行 get_risk_metrics"""
     return {
@@ -110,6 +204,7 @@ def _execute_get_risk_metrics(ctx: dict) -> dict:
     }
 
 
+@tool_cache.memoize()
 def _execute_run_stress_test(
     ctx: dict,
     rate_shock_bp: int = 100,
@@ -155,44 +250,24 @@ def _execute_run_stress_test(
             "stressed_surplus": stressed_surplus,
             "delta_surplus": stressed_surplus - (base_assets - base_liabilities),
         },
+        # 情景严重度: 1 年期 EWMA 协方差下的标准差倍数（无协方差估计时为 None）
+        "scenario_sigma_1y": cov_service.scenario_sigma(
+            ctx, (rate_shock_bp, equity_shock_pct * 100, inflation_shock_pct * 100)),
     }
 
 
+@tool_cache.memoize()
 def _execute_check_hedge_compliance(
     ctx: dict,
     ratio: float,
     hedge_type: str = "duration",
 ) -> dict:
-    """执行 check_hedge_compliance"""
+    """执行 check_hedge_compliance: 操作后的组合对全部限额审计，解析求最大合规比例"""
     limit_config = COMPLIANCE_LIMITS.get(hedge_type, COMPLIANCE_LIMITS.get("duration", {}))
-    max_ratio = limit_config.get("max_hedge_ratio", 0.80)
-    
-    is_compliant = ratio <= max_ratio
-    
-    if is_compliant:
-        return {
-            "status": "PASS",
-            "proposed_ratio": ratio,
-            "max_allowed": max_ratio,
-            "hedge_type": hedge_type,
-            "message": f"Hedge ratio {ratio:.0%} is within limit ({max_ratio:.0%})",
-            "recommendation": None,
-            "requires_approval": False,
-        }
-    else:
-        compliant_ratio = max_ratio * 0.95
-        return {
-            "status": "FAIL",
-            "proposed_ratio": ratio,
-            "max_allowed": max_ratio,
-            "hedge_type": hedge_type,
-            "message": f"Hedge ratio {ratio:.0%} exceeds limit ({max_ratio:.0%}), approval required",
-            "recommendation": compliant_ratio,
-            "recommendation_message": f"Recommended adjustment: {compliant_ratio:.0%} (95% of limit)",
-            "requires_approval": True,
-        }
+    return audit_engine.audit_hedge(ctx, ratio, hedge_type, limit_config).to_tool_output()
 
 
+@tool_cache.memoize()
 def _execute_get_limit_status(ctx: dict) -> dict:
     """执行 get_limit_status"""
     limits_df = ctx['limits_df']
@@ -211,6 +286,7 @@ def _execute_get_limit_status(ctx: dict) -> dict:
     }
 
 
+@tool_cache.memoize()
 def _execute_get_asset_allocation(ctx: dict) -> dict:
     """执行 get_asset_allocation"""
     comp_df = ctx['comp_df']
@@ -230,198 +306,361 @@ def _execute_get_asset_allocation(ctx: dict) -> dict:
     }
 
 
+@tool_cache.memoize()
+def _execute_get_surplus_var(ctx: dict) -> dict:
+    """执行 get_surplus_var: engine 已按历史情景算好 VaR / ES，这里只整理输出"""
+    return var_engine.tool_output(ctx, cov_service.cov_from_ctx(ctx))
+
+
+@tool_cache.memoize()
+def _execute_get_risk_attribution(ctx: dict, by: str = "asset_class") -> dict:
+    """执行 get_risk_attribution: Euler 分解已在 engine 里算好，这里按维度取出"""
+    return risk_attribution.tool_output(ctx, by)
+
+
 # ============================================================
 # 节点 1: 意图分析 + 工具选择 (Tool Calling)
 # ============================================================
 
-def node_analyze_with_tools(state: AgentState) -> AgentState:
-    """
-    使用 LLM Tool Calling 分析用户意图并选择工具
-    
-    这是核心升级点：废弃正则表达式，让 LLM 自主决策
-    """
-    steps = list(state.get("thinking_steps", []))
-    
-    # Build tool selection prompt
-    tools_description = """
+_TOOLS_DESCRIPTION = """
 Available Tools:
 1. get_risk_metrics - Get core risk metrics (funded status, surplus, duration gap)
 2. run_stress_test - Run stress test (rate shock, equity shock)
 3. check_hedge_compliance - Check hedge compliance (important: exceeding limit requires approval)
 4. get_limit_status - Query limit status (breaches, warnings)
 5. get_asset_allocation - Get asset allocation details
+6. get_surplus_var - Get historical-simulation surplus VaR / expected shortfall (tail risk)
+7. get_risk_attribution - Decompose surplus volatility into contributions (by: asset_class, sector, or currency)
 
 Rules:
 - If user mentions hedge/hedging, use check_hedge_compliance
 - If user mentions stress/scenario/shock/what-if, use run_stress_test
 - If user mentions limit/breach/warning, use get_limit_status
 - If user mentions allocation/portfolio, use get_asset_allocation
+- If user mentions VaR/expected shortfall/tail risk/surplus at risk, use get_surplus_var
+- If user asks what drives risk / risk contribution / attribution, use get_risk_attribution
 - For general risk questions, use get_risk_metrics
 """
-    
-    system_prompt = f"""You are a tool selector for a pension fund risk system.
 
-{tools_description}
+# 工具选择 prompt 与 query 无关，模块加载时构建一次
+_TOOL_SELECTION_PROMPT = f"""You are a tool selector for a pension fund risk system.
+
+{_TOOLS_DESCRIPTION}
 
-Analyze the user's query and respond with a JSON object:
+Analyze the user's query and respond with a JSON object.
+If the query asks several independent things, list one call per tool (at most {MAX_TOOL_CALLS}):
 {{
-    "selected_tool": "tool_name",
-    "tool_params": {{ ... }},
-    "reasoning": "why this tool"
+    "tool_calls": [
+        {{"tool": "tool_name", "params": {{ ... }}}}
+    ],
+    "reasoning": "why these tools"
 }}
 
 For check_hedge_compliance, extract the ratio as a decimal (e.g., 85% -> 0.85).
 For run_stress_test, extract rate_shock_bp and equity_shock_pct.
+For get_risk_attribution, set "by" to sector or currency when the user asks for that grouping.
 
 Respond ONLY with valid JSON, no other text."""
 
+
+@_timed_node
+def node_analyze_with_tools(state: AgentState) -> AgentState:
+    """
+    使用 LLM Tool Calling 分析用户意图并选择工具
+    
+    分层路由: 先走 intent_router 本地规则，高置信度直接返回（零网络调用），
+    只有模糊 / 复合问题才交给 LLM 选择
+    """
+    steps = list(state.get("thinking_steps", []))
+    
+    decision = intent_router.route(state["user_query"])
+    if decision.is_confident:
+        return _analyze_local(state, steps, decision)
+    
+    cache_key = _tool_selection_cache_key(state)
     try:
-        client = OpenAI(api_key=state["api_key"])
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": state["user_query"]},
-            ],
-            max_tokens=300,
-            temperature=0,
+        usage = {}
+        cached_text = llm_cache.get_cache().get(cache_key)
+        cache_hit = cached_text is not None
+        raw_text = cached_text if cache_hit else llm_client.chat(
+            state["api_key"], _TOOL_SELECTION_PROMPT, state["user_query"],
+            max_tokens=300, temperature=0, on_usage=usage.update,
         )
-        
-        result_text = response.choices[0].message.content.strip()
-        
-        # 清理可能的 markdown 包装
-        if result_text.startswith("```"):
-            result_text = result_text.split("```")[1]
-            if result_text.startswith("json"):
-                result_text = result_text[4:]
-        result_text = result_text.strip()
-        
-        result = json.loads(result_text)
-        
-        selected_tool = result.get("selected_tool", "get_risk_metrics")
-        tool_params = result.get("tool_params", {})
-        reasoning = result.get("reasoning", "")
-        
-        steps.append(ThinkingStep(
-            node="🤖 Tool Selection",
-            status="success",
-            message=f"AI selected tool: {selected_tool}",
-            detail=reasoning,
-            tool_call=f"{selected_tool}()",
-            tool_params=json.dumps(tool_params, ensure_ascii=False) if tool_params else None,
-        ))
-        
-        return {
-            **state,
-            "thinking_steps": steps,
-            "selected_tool": selected_tool,
-            "tool_input": tool_params,
-        }
-        
+        return _analyze_from_llm(state, steps, raw_text, cache_hit, cache_key, usage)
     except Exception as e:
-        # Fallback: 使用简单规则
-        steps.append(ThinkingStep(
-            node="🤖 Tool Selection",
-            status="warning",
-            message=f"AI selection failed, using fallback: {str(e)}",
-        ))
-        
-        # 简单 fallback 逻辑
-        query_lower = state["user_query"].lower()
-        if "hedge" in query_lower:
-            selected_tool = "check_hedge_compliance"
-            # 尝试提取比例
-            import re
-            match = re.search(r'(\d+)\s*%', query_lower)
-            ratio = int(match.group(1)) / 100 if match else 0.70
-            tool_params = {"ratio": ratio}
-        elif "stress" in query_lower or "shock" in query_lower:
-            selected_tool = "run_stress_test"
-            tool_params = {"rate_shock_bp": 100, "equity_shock_pct": -0.15}
-        elif "limit" in query_lower or "breach" in query_lower:
-            selected_tool = "get_limit_status"
-            tool_params = {}
-        else:
-            selected_tool = "get_risk_metrics"
-            tool_params = {}
-        
-        return {
-            **state,
-            "thinking_steps": steps,
-            "selected_tool": selected_tool,
-            "tool_input": tool_params,
-        }
+        return _analyze_fallback(state, steps, decision, e)
+
+
+@_timed_node
+async def anode_analyze_with_tools(state: AgentState) -> AgentState:
+    """node_analyze_with_tools 的异步版本（LLM 调用不阻塞 event loop）"""
+    steps = list(state.get("thinking_steps", []))
+    
+    decision = intent_router.route(state["user_query"])
+    if decision.is_confident:
+        return _analyze_local(state, steps, decision)
+    
+    cache_key = _tool_selection_cache_key(state)
+    try:
+        usage = {}
+        cached_text = llm_cache.get_cache().get(cache_key)
+        cache_hit = cached_text is not None
+        raw_text = cached_text if cache_hit else await llm_client.achat(
+            state["api_key"], _TOOL_SELECTION_PROMPT, state["user_query"],
+            max_tokens=300, temperature=0, on_usage=usage.update,
+        )
+        return _analyze_from_llm(state, steps, raw_text, cache_hit, cache_key, usage)
+    except Exception as e:
+        return _analyze_fallback(state, steps, decision, e)
+
+
+def _analyze_local(state: AgentState, steps: list, decision) -> AgentState:
+    """本地路由高置信度: 直接采用路由结果"""
+    steps.append(ThinkingStep(
+        node="🤖 Tool Selection",
+        status="success",
+        message=f"Local router selected tool: {decision.tool}",
+        detail=f"confidence {decision.confidence:.0%} · matched {', '.join(decision.matched)}",
+        tool_call=f"{decision.tool}()",
+        tool_params=json.dumps(decision.params, ensure_ascii=False) if decision.params else None,
+    ))
+    return {
+        **state,
+        "thinking_steps": steps,
+        "tool_calls": [{"tool": decision.tool, "params": decision.params}],
+        "selected_tool": decision.tool,
+        "tool_input": decision.params,
+    }
+
+
+def _tool_selection_cache_key(state: AgentState) -> str:
+    return llm_cache.make_key(
+        llm_client.DEFAULT_MODEL, _TOOL_SELECTION_PROMPT, state["user_query"],
+        fingerprint=state["ctx"].get("fingerprint"), max_tokens=300, temperature=0,
+    )
+
+
+def _analyze_from_llm(state: AgentState, steps: list, raw_text: str,
+                      cache_hit: bool, cache_key: str, usage: dict) -> AgentState:
+    """解析 LLM 的工具选择 JSON；解析失败时抛异常（由调用方走 fallback）"""
+    result_text = raw_text.strip()
+    
+    # 清理可能的 markdown 包装
+    if result_text.startswith("```"):
+        result_text = result_text.split("```")[1]
+        if result_text.startswith("json"):
+            result_text = result_text[4:]
+    result_text = result_text.strip()
+    
+    result = json.loads(result_text)
+    # 工具选择结果只有在 JSON 解析成功后才写入缓存，避免把坏响应缓存住
+    if not cache_hit:
+        llm_cache.get_cache().put(cache_key, raw_text)
+    
+    tool_calls = _parse_tool_calls(result)
+    reasoning = result.get("reasoning", "")
+    tool_names = ", ".join(call["tool"] for call in tool_calls)
+    if len(tool_calls) == 1:
+        params_display = tool_calls[0]["params"]
+    else:
+        params_display = [call["params"] for call in tool_calls] if any(c["params"] for c in tool_calls) else None
+    
+    steps.append(ThinkingStep(
+        node="🤖 Tool Selection",
+        status="success",
+        message=f"AI selected tool{'s' if len(tool_calls) > 1 else ''}: {tool_names}"
+                + (" (cached)" if cache_hit else ""),
+        detail=reasoning,
+        tool_call=", ".join(f"{call['tool']}()" for call in tool_calls),
+        tool_params=json.dumps(params_display, ensure_ascii=False) if params_display else None,
+        cache_hit=cache_hit,
+        prompt_tokens=usage.get("prompt_tokens", 0),
+        completion_tokens=usage.get("completion_tokens", 0),
+    ))
+    
+    return {
+        **state,
+        "thinking_steps": steps,
+        "tool_calls": tool_calls,
+        "selected_tool": tool_calls[0]["tool"],
+        "tool_input": tool_calls[0]["params"],
+    }
+
+
+def _analyze_fallback(state: AgentState, steps: list, decision, error: Exception) -> AgentState:
+    """LLM 失败 / 返回非法 JSON: 用本地路由的 top-1 结果"""
+    steps.append(ThinkingStep(
+        node="🤖 Tool Selection",
+        status="warning",
+        message=f"AI selection failed, using fallback: {str(error)}",
+    ))
+    return {
+        **state,
+        "thinking_steps": steps,
+        "tool_calls": [{"tool": decision.tool, "params": decision.params}],
+        "selected_tool": decision.tool,
+        "tool_input": decision.params,
+    }
+
+
+def _parse_tool_calls(result: dict) -> List[dict]:
+    """
+    解析 LLM 的工具选择 JSON → [{"tool", "params"}]
+    兼容旧的单工具格式 {"selected_tool", "tool_params"}；未知工具丢弃，重复调用去重
+    """
+    if "tool_calls" in result:
+        raw_calls = [
+            {"tool": call.get("tool", ""), "params": call.get("params") or {}}
+            for call in result.get("tool_calls") or []
+            if isinstance(call, dict)
+        ]
+    else:
+        raw_calls = [{"tool": result.get("selected_tool", "get_risk_metrics"),
+                      "params": result.get("tool_params") or {}}]
+    
+    calls, seen = [], set()
+    for call in raw_calls:
+        signature = (call["tool"], json.dumps(call["params"], sort_keys=True, default=str))
+        if call["tool"] in TOOL_MAP and signature not in seen:
+            seen.add(signature)
+            calls.append(call)
+    
+    return calls[:MAX_TOOL_CALLS] or [{"tool": "get_risk_metrics", "params": {}}]
 
 
 # ============================================================
 # 节点 2: 执行工具
 # ============================================================
 
+def _run_tool(tool_name: str, tool_params: dict, ctx: dict) -> Tuple[dict, bool]:
+    """
+    直接调用底层函数（不使用 .invoke()，因为需要注入 ctx）
+
+    Returns: (output, cache_hit)，_execute_* 按 (工具, 参数, ctx 指纹) 缓存
+    """
+    if tool_name == "check_hedge_compliance":
+        # 支持两种参数名: ratio 或 hedge_ratio（0.0 是合法比例，不能用 or 回退）
+        ratio = tool_params.get("ratio")
+        if ratio is None:
+            ratio = tool_params.get("hedge_ratio", 0.70)
+        return _execute_check_hedge_compliance.lookup(
+            ctx=ctx,
+            ratio=ratio,
+            hedge_type=tool_params.get("hedge_type", "duration"),
+        )
+    elif tool_name == "run_stress_test":
+        return _execute_run_stress_test.lookup(
+            ctx=ctx,
+            rate_shock_bp=tool_params.get("rate_shock_bp", 100),
+            equity_shock_pct=tool_params.get("equity_shock_pct", -0.15),
+            inflation_shock_pct=tool_params.get("inflation_shock_pct", 0.0),
+            scenario_name=tool_params.get("scenario_name", "Custom"),
+        )
+    elif tool_name == "get_limit_status":
+        return _execute_get_limit_status.lookup(ctx)
+    elif tool_name == "get_asset_allocation":
+        return _execute_get_asset_allocation.lookup(ctx)
+    elif tool_name == "get_surplus_var":
+        return _execute_get_surplus_var.lookup(ctx)
+    elif tool_name == "get_risk_attribution":
+        by = tool_params.get("by", "asset_class")
+        return _execute_get_risk_attribution.lookup(
+            ctx, by=by if by in risk_attribution.ATTRIBUTION_DIMENSIONS else "asset_class")
+    return _execute_get_risk_metrics.lookup(ctx)
+
+
+def _run_tool_safe(call: dict, ctx: dict) -> Tuple[dict, Optional[str], bool]:
+    """线程池里执行单个工具，返回 (output, error, cache_hit)，异常不向外抛"""
+    tool_name = call["tool"]
+    if tool_name not in TOOL_MAP:
+        return {}, f"Unknown tool: {tool_name}", False
+    try:
+        output, cache_hit = _run_tool(tool_name, call["params"], ctx)
+        return output, None, cache_hit
+    except Exception as e:
+        return {}, f"Tool execution failed: {str(e)}", False
+
+
+def _primary_result(results: List[dict]) -> dict:
+    """主结果: 未通过的对冲检查 > 其他对冲检查 > 第一个工具（审批流程只看主结果）"""
+    hedge_results = [r for r in results if r["tool"] == "check_hedge_compliance"]
+    for r in hedge_results:
+        if r["output"].get("status") == "FAIL":
+            return r
+    return hedge_results[0] if hedge_results else results[0]
+
+
+def _pending_tool_calls(state: AgentState) -> List[dict]:
+    return state.get("tool_calls") or [{
+        "tool": state.get("selected_tool") or "get_risk_metrics",
+        "params": state.get("tool_input", {}),
+    }]
+
+
+@_timed_node
 def node_execute_tool(state: AgentState) -> AgentState:
-    """执行选中的工具"""
-    steps = list(state.get("thinking_steps", []))
+    """执行选中的工具；多个工具时在线程池中并发执行，结果按 tool_calls 顺序合并"""
+    ctx = state["ctx"]
+    tool_calls = _pending_tool_calls(state)
     
-    selected_tool = state.get("selected_tool", "get_risk_metrics")
-    tool_params = state.get("tool_input", {})
+    if len(tool_calls) == 1:
+        outcomes = [_run_tool_safe(tool_calls[0], ctx)]
+    else:
+        outcomes = list(_tool_executor.map(lambda call: _run_tool_safe(call, ctx), tool_calls))
+    
+    return _merge_tool_outcomes(state, tool_calls, outcomes)
+
+
+@_timed_node
+async def anode_execute_tool(state: AgentState) -> AgentState:
+    """node_execute_tool 的异步版本: 工具放到同一个线程池执行，不占用 event loop"""
     ctx = state["ctx"]
+    tool_calls = _pending_tool_calls(state)
     
-    if selected_tool not in TOOL_MAP:
-        steps.append(ThinkingStep(
-            node="⚙️ Execute",
-            status="error",
-            message=f"Unknown tool: {selected_tool}",
-        ))
-        return {**state, "thinking_steps": steps, "tool_output": {}}
+    loop = asyncio.get_running_loop()
+    outcomes = await asyncio.gather(*(
+        loop.run_in_executor(_tool_executor, _run_tool_safe, call, ctx)
+        for call in tool_calls
+    ))
     
-    try:
-        # 直接调用底层函数（不使用 .invoke()，因为需要注入 ctx）
-        if selected_tool == "check_hedge_compliance":
-            # 支持两种参数名: ratio 或 hedge_ratio
-            ratio = tool_params.get("ratio") or tool_params.get("hedge_ratio", 0.70)
-            result = _execute_check_hedge_compliance(
-                ctx=ctx,
-                ratio=ratio,
-                hedge_type=tool_params.get("hedge_type", "duration"),
-            )
-        elif selected_tool == "run_stress_test":
-            result = _execute_run_stress_test(
-                ctx=ctx,
-                rate_shock_bp=tool_params.get("rate_shock_bp", 100),
-                equity_shock_pct=tool_params.get("equity_shock_pct", -0.15),
-                inflation_shock_pct=tool_params.get("inflation_shock_pct", 0.0),
-                scenario_name=tool_params.get("scenario_name", "Custom"),
-            )
-        elif selected_tool == "get_limit_status":
-            result = _execute_get_limit_status(ctx)
-        elif selected_tool == "get_asset_allocation":
-            result = _execute_get_asset_allocation(ctx)
+    return _merge_tool_outcomes(state, tool_calls, outcomes)
+
+
+def _merge_tool_outcomes(state: AgentState, tool_calls: List[dict], outcomes: List[tuple]) -> AgentState:
+    """把 (output, error, cache_hit) 列表写回 state: 每个工具一个思考步骤 + tool_results + 主结果"""
+    steps = list(state.get("thinking_steps", []))
+    
+    results = []
+    for call, (output, error, cache_hit) in zip(tool_calls, outcomes):
+        tool_name = call["tool"]
+        if error:
+            steps.append(ThinkingStep(
+                node="⚙️ Execute",
+                status="error",
+                message=error,
+                tool_call=f"{tool_name}()",
+            ))
         else:
-            result = _execute_get_risk_metrics(ctx)
-        
-        # 格式化结果摘要
-        result_summary = _format_tool_result(selected_tool, result)
-        
-        steps.append(ThinkingStep(
-            node="⚙️ Execute",
-            status="success",
-            message=f"Tool executed: {TOOL_DESCRIPTIONS.get(selected_tool, selected_tool)}",
-            tool_call=f"{selected_tool}()",
-            tool_result=result_summary,
-        ))
-        
-        return {
-            **state,
-            "thinking_steps": steps,
-            "tool_output": result,
-        }
-        
-    except Exception as e:
-        steps.append(ThinkingStep(
-            node="⚙️ Execute",
-            status="error",
-            message=f"Tool execution failed: {str(e)}",
-        ))
-        return {**state, "thinking_steps": steps, "tool_output": {}}
+            steps.append(ThinkingStep(
+                node="⚙️ Execute",
+                status="success",
+                message=(f"Tool result reused: {TOOL_DESCRIPTIONS.get(tool_name, tool_name)}" if cache_hit
+                         else f"Tool executed: {TOOL_DESCRIPTIONS.get(tool_name, tool_name)}"),
+                tool_call=f"{tool_name}()",
+                tool_result=_format_tool_result(tool_name, output),
+                cache_hit=cache_hit,
+            ))
+        results.append({"tool": tool_name, "params": call["params"], "output": output})
+    
+    primary = _primary_result(results)
+    return {
+        **state,
+        "thinking_steps": steps,
+        "tool_results": results,
+        "selected_tool": primary["tool"],
+        "tool_input": primary["params"],
+        "tool_output": primary["output"],
+    }
 
 
 def _format_tool_result(tool_name: str, result: dict) -> str:
@@ -430,15 +669,32 @@ def _format_tool_result(tool_name: str, result: dict) -> str:
         return f"Funded: {result.get('funded_status', 0):.1%}, Surplus: ${result.get('surplus', 0)/1000:.1f}B"
     elif tool_name == "run_stress_test":
         res = result.get("results", {})
-        return f"Stressed Funded: {res.get('stressed_funded_status', 0):.1%} (Δ{res.get('delta_funded', 0)*100:+.1f}%)"
+        summary = f"Stressed Funded: {res.get('stressed_funded_status', 0):.1%} (Δ{res.get('delta_funded', 0)*100:+.1f}%)"
+        sigma = result.get("scenario_sigma_1y")
+        return summary + (f", {sigma:.1f}σ (1y)" if sigma is not None else "")
     elif tool_name == "check_hedge_compliance":
         status = result.get("status", "UNKNOWN")
         ratio = result.get("proposed_ratio", 0)
-        return f"{status} - Proposed ratio: {ratio:.0%}"
+        return (f"{status} - Proposed ratio: {ratio:.0%}, max compliant {result.get('max_allowed', 0):.0%} "
+                f"({result.get('binding_limit', 'policy cap')})")
     elif tool_name == "get_limit_status":
         return f"Breaches: {result.get('breaches', 0)}, Warnings: {result.get('warnings', 0)}"
     elif tool_name == "get_asset_allocation":
         return f"Asset allocation retrieved"
+    elif tool_name == "get_surplus_var":
+        levels = result.get("levels") or []
+        if not levels or levels[-1].get("surplus_var") is None:
+            return result.get("message", "VaR not available")
+        top = levels[-1]
+        return (f"{top['confidence']:.1%} VaR ${top['surplus_var']:,.0f}M, ES ${top['surplus_es']:,.0f}M "
+                f"({result.get('n_scenarios', 0)} scenarios)")
+    elif tool_name == "get_risk_attribution":
+        contributors = result.get("contributors") or []
+        if not contributors:
+            return result.get("message", "Risk attribution not available")
+        top = contributors[0]
+        return (f"Top contributor ({result.get('by')}): {top['group']} {top['risk_share']:.0%} "
+                f"of σ ${result.get('surplus_vol_1d', 0):,.0f}M")
     return str(result)[:100]
 
 
@@ -446,6 +702,7 @@ def _format_tool_result(tool_name: str, result: dict) -> str:
 # 节点 3: 合规审计 + 审批判断
 # ============================================================
 
+@_timed_node
 def node_audit(state: AgentState) -> AgentState:
     """
     审计节点 - 判断是否需要人工审批
@@ -453,6 +710,7 @@ def node_audit(state: AgentState) -> AgentState:
     关键逻辑:
     - 如果是 check_hedge_compliance 且返回 FAIL，需要审批
     - 其他情况直接通过
+    - 多工具时 execute 已把未通过的对冲检查选为主结果 (selected_tool / tool_output)
     """
     steps = list(state.get("thinking_steps", []))
     
@@ -473,7 +731,7 @@ def node_audit(state: AgentState) -> AgentState:
                 status="warning",
                 message="⚠️ Approval Required",
                 detail=approval_reason,
-                tool_result=f"Recommended: {tool_output.get('recommendation', 0):.0%}",
+                tool_result=f"Recommended: {_recommended_ratio(tool_output):.0%}",
                 is_warning=True,
                 requires_approval=True,
             ))
@@ -506,45 +764,106 @@ def node_audit(state: AgentState) -> AgentState:
 # 节点 4: 生成响应
 # ============================================================
 
+@_timed_node
 def node_respond(state: AgentState) -> AgentState:
     """生成最终响应"""
-    steps = list(state.get("thinking_steps", []))
+    if _approval_pending(state):
+        return _respond_approval_pending(state)
     
-    # 如果需要审批，生成审批相关响应
-    if state.get("requires_approval") and state.get("approval_status") == "pending":
-        tool_output = state.get("tool_output", {})
-        response = f"""⚠️ **Approval Required**
+    system_prompt, tool_output = _build_respond_prompt(state)
+    try:
+        emit = _get_token_writer()
+        usage = {}
+        deltas, cache_hit = llm_cache.cached_chat_stream(
+            state["api_key"], system_prompt, state["user_query"],
+            fingerprint=state["ctx"].get("fingerprint"),
+            tool_output=tool_output,
+            max_tokens=400, temperature=0.3,
+            on_usage=usage.update,
+        )
+        chunks = []
+        for delta in deltas:
+            chunks.append(delta)
+            emit(delta)
+        return _respond_done(state, "".join(chunks), cache_hit, usage)
+    except Exception as e:
+        return _respond_failed(state, e)
 
-Your proposed hedge ratio **{tool_output.get('proposed_ratio', 0):.0%}** exceeds the compliance limit **{tool_output.get('max_allowed', 0):.0%}**.
 
-**System Recommendation:** Adjust to **{tool_output.get('recommendation', 0):.0%}** (95% of limit)
+@_timed_node
+async def anode_respond(state: AgentState) -> AgentState:
+    """node_respond 的异步版本（异步 OpenAI client，token 流不阻塞 event loop）"""
+    if _approval_pending(state):
+        return _respond_approval_pending(state)
+    
+    system_prompt, tool_output = _build_respond_prompt(state)
+    try:
+        emit = _get_token_writer()
+        usage = {}
+        deltas, cache_hit = llm_cache.acached_chat_stream(
+            state["api_key"], system_prompt, state["user_query"],
+            fingerprint=state["ctx"].get("fingerprint"),
+            tool_output=tool_output,
+            max_tokens=400, temperature=0.3,
+            on_usage=usage.update,
+        )
+        chunks = []
+        async for delta in deltas:
+            chunks.append(delta)
+            emit(delta)
+        return _respond_done(state, "".join(chunks), cache_hit, usage)
+    except Exception as e:
+        return _respond_failed(state, e)
+
+
+def _approval_pending(state: AgentState) -> bool:
+    return bool(state.get("requires_approval")) and state.get("approval_status") == "pending"
+
+
+def _respond_approval_pending(state: AgentState) -> AgentState:
+    """需要审批: 生成模板化的审批提示（不调用 LLM）"""
+    steps = list(state.get("thinking_steps", []))
+    tool_output = state.get("tool_output", {})
+    response = f"""⚠️ **Approval Required**
+
+Your proposed hedge ratio **{tool_output.get('proposed_ratio', 0):.0%}** breaches {_breached_limits(tool_output)} (maximum compliant ratio **{tool_output.get('max_allowed', 0):.0%}**).
+
+**System Recommendation:** {_recommendation_text(tool_output)}
 
 Please select:
 - ✅ **Approve** the recommended adjustment
 - ❌ **Reject** this operation"""
-        
-        steps.append(ThinkingStep(
-            node="💬 Respond",
-            status="pending",
-            message="Waiting for approval",
-            requires_approval=True,
-        ))
-        
-        return {
-            **state,
-            "thinking_steps": steps,
-            "final_response": response,
-        }
     
-    # 正常响应生成
-    tool_output = state.get("tool_output", {})
-    selected_tool = state.get("selected_tool", "")
+    # 审批提示是模板文本，整段作为一个 token 事件推给 UI
+    _get_token_writer()(response)
     
-    # 构建 context for LLM
-    context = f"""
-Tool Used: {selected_tool}
-Tool Output: {json.dumps(tool_output, ensure_ascii=False, indent=2)}
-"""
+    steps.append(ThinkingStep(
+        node="💬 Respond",
+        status="pending",
+        message="Waiting for approval",
+        requires_approval=True,
+    ))
+    
+    return {
+        **state,
+        "thinking_steps": steps,
+        "final_response": response,
+    }
+
+
+def _build_respond_prompt(state: AgentState) -> Tuple[str, list]:
+    """构建 respond 的 system prompt，返回 (system_prompt, 各工具输出)"""
+    tool_results = state.get("tool_results") or [{
+        "tool": state.get("selected_tool", ""),
+        "output": state.get("tool_output", {}),
+    }]
+    tool_output = [r["output"] for r in tool_results]
+    
+    # 构建 context for LLM（多工具时逐个列出）
+    context = "".join(f"""
+Tool Used: {r['tool']}
+Tool Output: {json.dumps(r['output'], ensure_ascii=False, indent=2)}
+""" for r in tool_results)
     
     system_prompt = f"""You are a risk advisor for a large pension fund.
 
@@ -556,38 +875,23 @@ Guidelines:
 - Be concise (under 150 words)
 - Highlight key metrics
 - If compliance passed, mention it
+- If several tools were used, answer every part of the question
 - Use professional terminology
 - Respond in the same language as the user's query
 """
-    
-    try:
-        client = OpenAI(api_key=state["api_key"])
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": state["user_query"]},
-            ],
-            max_tokens=400,
-            temperature=0.3,
-        )
-        
-        final_response = response.choices[0].message.content
-        
-        steps.append(ThinkingStep(
-            node="💬 Respond",
-            status="success",
-            message="Response generated",
-        ))
-        
-    except Exception as e:
-        final_response = f"Error generating response: {str(e)}"
-        steps.append(ThinkingStep(
-            node="💬 Respond",
-            status="error",
-            message=str(e),
-        ))
-    
+    return system_prompt, tool_output
+
+
+def _respond_done(state: AgentState, final_response: str, cache_hit: bool, usage: dict) -> AgentState:
+    steps = list(state.get("thinking_steps", []))
+    steps.append(ThinkingStep(
+        node="💬 Respond",
+        status="success",
+        message="Response generated (cached)" if cache_hit else "Response generated",
+        cache_hit=cache_hit,
+        prompt_tokens=usage.get("prompt_tokens", 0),
+        completion_tokens=usage.get("completion_tokens", 0),
+    ))
     return {
         **state,
         "thinking_steps": steps,
@@ -595,15 +899,89 @@ Guidelines:
     }
 
 
+def _respond_failed(state: AgentState, error: Exception) -> AgentState:
+    steps = list(state.get("thinking_steps", []))
+    steps.append(ThinkingStep(
+        node="💬 Respond",
+        status="error",
+        message=str(error),
+    ))
+    return {
+        **state,
+        "thinking_steps": steps,
+        "final_response": f"Error generating response: {str(error)}",
+    }
+
+
+def _get_token_writer():
+    """graph.stream(stream_mode='custom') 的 writer；直接调用节点（不在图里）时返回空操作"""
+    try:
+        writer = get_stream_writer()
+    except RuntimeError:
+        return lambda text: None
+    return lambda text: writer({"token": text})
+
+
 # ============================================================
-# 节点 5: 处理审批结果 (简化版 - 由 UI 触发)
+# 节点 5: 等待审批 (interrupt) → 处理审批结果
 # ============================================================
 
+def _recommended_ratio(tool_output: dict) -> float:
+    """批准后执行的比例: 审计给出的合规建议值；没有任何合规规模时按原提议（作为政策例外审批）"""
+    recommendation = tool_output.get("recommendation")
+    return recommendation if recommendation is not None else tool_output.get("proposed_ratio", 0)
+
+
+def _breached_limits(tool_output: dict) -> str:
+    names = [d["limit"] for d in tool_output.get("breach_details", [])]
+    return ", ".join(f"**{name}**" for name in names) or "the compliance limits"
+
+
+def _recommendation_text(tool_output: dict) -> str:
+    if tool_output.get("recommendation") is None:
+        return (f"No {tool_output.get('hedge_type', '')} hedge size satisfies every limit; "
+                f"approving records **{tool_output.get('proposed_ratio', 0):.0%}** as a policy exception")
+    return (f"Adjust to **{tool_output['recommendation']:.0%}** "
+            f"(within {tool_output.get('recommendation_limit') or tool_output.get('binding_limit', 'the limit')}, 5% buffer)")
+
+
+def _approved_scope(tool_output: dict) -> str:
+    if tool_output.get("recommendation") is None:
+        return "approved as a policy exception"
+    return (f"within the {tool_output.get('min_allowed', 0):.0%}–{tool_output.get('max_allowed', 0):.0%} "
+            f"compliant range")
+
+
+def _approval_context(state: AgentState) -> dict:
+    """审批卡片需要的数字（float 化，checkpoint 里不留 numpy 标量）"""
+    tool_output = state.get("tool_output", {})
+    return {
+        "proposed_ratio": float(tool_output.get("proposed_ratio", 0)),
+        "max_allowed": float(tool_output.get("max_allowed", 0)),
+        "recommendation": float(_recommended_ratio(tool_output)),
+        "reason": state.get("approval_reason", ""),
+    }
+
+
+def node_wait_approval(state: AgentState) -> AgentState:
+    """
+    在这里暂停图，等待人工决定
+
+    interrupt() 第一次执行时抛出 GraphInterrupt，状态落到 checkpointer；
+    process_approval 用 Command(resume="approved" / "rejected") 恢复时，
+    节点从头重跑，interrupt() 直接返回 resume 的值。
+    不加 _timed_node: 这段时间是人在看审批卡片，不是节点耗时。
+    """
+    decision = interrupt(_approval_context(state))
+    return {**state, "approval_status": decision}
+
+
+@_timed_node
 def node_handle_approval(state: AgentState) -> AgentState:
     """
     处理审批结果
     
-    这个节点由 UI 触发，用于处理用户的批准/驳回操作
+    wait_approval 恢复后执行，approval_status 是 UI 传入的批准/驳回
     """
     steps = list(state.get("thinking_steps", []))
     approval_status = state.get("approval_status", "")
@@ -611,7 +989,7 @@ def node_handle_approval(state: AgentState) -> AgentState:
     
     if approval_status == "approved":
         # 用户批准了调整
-        new_ratio = tool_output.get("recommendation", 0)
+        new_ratio = _recommended_ratio(tool_output)
         
         steps.append(ThinkingStep(
             node="✅ Approved",
@@ -622,7 +1000,7 @@ def node_handle_approval(state: AgentState) -> AgentState:
         
         response = f"""✅ **Operation Approved**
 
-Hedge ratio adjusted to **{new_ratio:.0%}** (within {tool_output.get('max_allowed', 0):.0%} limit)
+Hedge ratio adjusted to **{new_ratio:.0%}** ({_approved_scope(tool_output)})
 
 This action has been logged to the audit trail."""
         
@@ -658,26 +1036,37 @@ def route_after_audit(state: AgentState) -> Literal["respond", "wait_approval"]:
     return "respond"
 
 
+def route_after_respond(state: AgentState) -> Literal["wait_approval", "end"]:
+    """respond 已推送审批提示时进入 wait_approval 暂停，否则结束"""
+    if _approval_pending(state):
+        return "wait_approval"
+    return "end"
+
+
 # ============================================================
 # 构建 StateGraph
 # ============================================================
 
-def build_graph() -> StateGraph:
+def build_graph(use_async: bool = False) -> StateGraph:
     """
     构建治理版 StateGraph
     
     流程:
-        analyze → execute → audit → respond
-                              ↓
-                        wait_approval (如需审批)
+        analyze → execute → audit → respond → END
+                                       ↓ (如需审批)
+                                 wait_approval ⏸ → handle_approval → END
+    
+    use_async=True 时 analyze / execute / respond 换成异步节点（ainvoke / astream 使用），
+    audit 与 handle_approval 是纯 CPU 节点，两种图共用
     """
     graph = StateGraph(AgentState)
     
     # 添加节点
-    graph.add_node("analyze", node_analyze_with_tools)
-    graph.add_node("execute", node_execute_tool)
+    graph.add_node("analyze", anode_analyze_with_tools if use_async else node_analyze_with_tools)
+    graph.add_node("execute", anode_execute_tool if use_async else node_execute_tool)
     graph.add_node("audit", node_audit)
-    graph.add_node("respond", node_respond)
+    graph.add_node("respond", anode_respond if use_async else node_respond)
+    graph.add_node("wait_approval", node_wait_approval)
     graph.add_node("handle_approval", node_handle_approval)
     
     # 入口点
@@ -693,48 +1082,64 @@ def build_graph() -> StateGraph:
         route_after_audit,
         {
             "respond": "respond",
-            "wait_approval": "respond",  # 简化版：仍然生成响应，但标记需要审批
+            "wait_approval": "respond",  # 先生成审批提示，再进入 wait_approval 暂停
         }
     )
     
-    graph.add_edge("respond", END)
+    graph.add_conditional_edges(
+        "respond",
+        route_after_respond,
+        {
+            "wait_approval": "wait_approval",
+            "end": END,
+        }
+    )
+    graph.add_edge("wait_approval", "handle_approval")
     graph.add_edge("handle_approval", END)
     
     return graph
 
 
-# 编译图
+# 编译图（同步 / 异步图共用一个 checkpointer，审批可以由任意一种图恢复）
 _compiled_graph = None
+_compiled_async_graph = None
+_checkpointer = None
+
+def get_checkpointer():
+    global _checkpointer
+    if _checkpointer is None:
+        _checkpointer = graph_checkpoint.make_checkpointer(
+            allowed_msgpack_modules=[(ThinkingStep.__module__, ThinkingStep.__name__)])
+    return _checkpointer
+
 
 def get_compiled_graph():
     global _compiled_graph
     if _compiled_graph is None:
-        _compiled_graph = build_graph().compile()
+        _compiled_graph = build_graph().compile(checkpointer=get_checkpointer())
     return _compiled_graph
 
 
+def get_compiled_async_graph():
+    global _compiled_async_graph
+    if _compiled_async_graph is None:
+        _compiled_async_graph = build_graph(use_async=True).compile(checkpointer=get_checkpointer())
+    return _compiled_async_graph
+
+
 # ============================================================
 # 主运行函数
 # ============================================================
 
-def run_agent(
-    user_query: str,
-    ctx: dict,
-    api_key: str,
-) -> Tuple[str, List[ThinkingStep], bool, dict]:
-    """
-    运行治理版 Agent
-    
-    Returns:
-        (final_response, thinking_steps, requires_approval, approval_context)
-    """
-    graph = get_compiled_graph()
-    
-    initial_state: AgentState = {
+def _initial_state(user_query: str, ctx: dict, api_key: str) -> AgentState:
+    return {
         "user_query": user_query,
         "ctx": ctx,
         "api_key": api_key,
+        "thread_id": uuid.uuid4().hex,
         "thinking_steps": [],
+        "tool_calls": [],
+        "tool_results": [],
         "selected_tool": "",
         "tool_input": {},
         "tool_output": {},
@@ -743,18 +1148,21 @@ def run_agent(
         "approval_reason": "",
         "final_response": "",
     }
-    
-    final_state = graph.invoke(initial_state)
-    
-    # 提取审批上下文
+
+
+def _thread_config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+# checkpoint 只在图退出（结束或 interrupt 暂停）时写一次，节点之间不落盘
+_DURABILITY = "exit"
+
+
+def _agent_result(final_state: AgentState) -> Tuple[str, List[ThinkingStep], bool, dict]:
+    # 提取审批上下文（thread_id 交给 process_approval 恢复）
     approval_context = {}
     if final_state.get("requires_approval"):
-        approval_context = {
-            "proposed_ratio": final_state["tool_output"].get("proposed_ratio", 0),
-            "max_allowed": final_state["tool_output"].get("max_allowed", 0),
-            "recommendation": final_state["tool_output"].get("recommendation", 0),
-            "reason": final_state.get("approval_reason", ""),
-        }
+        approval_context = {**_approval_context(final_state), "thread_id": final_state["thread_id"]}
     
     return (
         final_state["final_response"],
@@ -764,6 +1172,43 @@ def run_agent(
     )
 
 
+def run_agent(
+    user_query: str,
+    ctx: dict,
+    api_key: str,
+) -> Tuple[str, List[ThinkingStep], bool, dict]:
+    """
+    运行治理版 Agent
+    
+    Returns:
+        (final_response, thinking_steps, requires_approval, approval_context)
+        需要审批时图停在 wait_approval，approval_context["thread_id"] 用于 process_approval
+    """
+    graph = get_compiled_graph()
+    state = _initial_state(user_query, ctx, api_key)
+    final_state = graph.invoke(state, _thread_config(state["thread_id"]), durability=_DURABILITY)
+    if not _approval_pending(final_state):
+        get_checkpointer().delete_thread(state["thread_id"])
+    return _agent_result(final_state)
+
+
+async def arun_agent(
+    user_query: str,
+    ctx: dict,
+    api_key: str,
+) -> Tuple[str, List[ThinkingStep], bool, dict]:
+    """
+    run_agent 的异步版本: LLM 调用走 AsyncOpenAI，工具在线程池执行，
+    同一个 event loop 上可以并发跑多轮对话（API / 压测入口使用）
+    """
+    graph = get_compiled_async_graph()
+    state = _initial_state(user_query, ctx, api_key)
+    final_state = await graph.ainvoke(state, _thread_config(state["thread_id"]), durability=_DURABILITY)
+    if not _approval_pending(final_state):
+        await get_checkpointer().adelete_thread(state["thread_id"])
+    return _agent_result(final_state)
+
+
 def run_agent_stream(
     user_query: str,
     ctx: dict,
@@ -773,54 +1218,127 @@ def run_agent_stream(
     流式运行 Agent
     
     Yields: (node_name, state, is_final)
+        node_name == TOKEN_EVENT 时 state 为 {"token": str}，是最终回答的增量文本；
+        需要审批时 respond 节点把审批提示整段作为一个 token 事件推送，
+        随后图在 wait_approval 暂停，state["thread_id"] 用于 process_approval
     """
     graph = get_compiled_graph()
+    state = _initial_state(user_query, ctx, api_key)
+    interrupted = False
     
-    initial_state: AgentState = {
-        "user_query": user_query,
-        "ctx": ctx,
-        "api_key": api_key,
-        "thinking_steps": [],
-        "selected_tool": "",
-        "tool_input": {},
-        "tool_output": {},
-        "requires_approval": False,
-        "approval_status": "",
-        "approval_reason": "",
-        "final_response": "",
-    }
+    # updates: 每个节点结束后的状态; custom: respond 节点推送的 token 增量
+    try:
+        for mode, chunk in graph.stream(state, _thread_config(state["thread_id"]),
+                                        stream_mode=["updates", "custom"], durability=_DURABILITY):
+            if mode == "custom":
+                yield TOKEN_EVENT, chunk, False
+                continue
+            for node_name, node_state in chunk.items():
+                if node_name == "__interrupt__":
+                    interrupted = True
+                    continue
+                is_final = (node_name == "respond" and node_state.get("final_response"))
+                yield node_name, node_state, is_final
+    finally:
+        # 没有停在审批上的线程不再需要 checkpoint
+        if not interrupted:
+            get_checkpointer().delete_thread(state["thread_id"])
+
+
+async def arun_agent_stream(
+    user_query: str,
+    ctx: dict,
+    api_key: str,
+):
+    """run_agent_stream 的异步版本，事件格式相同"""
+    graph = get_compiled_async_graph()
+    state = _initial_state(user_query, ctx, api_key)
+    interrupted = False
     
-    for event in graph.stream(initial_state):
-        for node_name, state in event.items():
-            is_final = (node_name == "respond" and state.get("final_response"))
-            yield node_name, state, is_final
+    try:
+        async for mode, chunk in graph.astream(state, _thread_config(state["thread_id"]),
+                                               stream_mode=["updates", "custom"], durability=_DURABILITY):
+            if mode == "custom":
+                yield TOKEN_EVENT, chunk, False
+                continue
+            for node_name, node_state in chunk.items():
+                if node_name == "__interrupt__":
+                    interrupted = True
+                    continue
+                is_final = (node_name == "respond" and node_state.get("final_response"))
+                yield node_name, node_state, is_final
+    finally:
+        if not interrupted:
+            await get_checkpointer().adelete_thread(state["thread_id"])
+
+
+def pending_approval(thread_id: str) -> Optional[dict]:
+    """
+    取回停在 wait_approval 的线程的审批上下文（rerun / 重启后恢复审批卡片用）
+    
+    Returns:
+        {proposed_ratio, max_allowed, recommendation, reason, thread_id, thinking_steps}，
+        线程不存在或已处理时返回 None
+    """
+    snapshot = get_compiled_graph().get_state(_thread_config(thread_id))
+    if not snapshot.interrupts:
+        return None
+    return {
+        **snapshot.interrupts[0].value,
+        "thread_id": thread_id,
+        "thinking_steps": snapshot.values.get("thinking_steps", []),
+    }
 
 
 def process_approval(
     approval_status: str,  # "approved" or "rejected"
-    ctx: dict,
-    api_key: str,
-    pending_state: dict,
+    thread_id: str,
 ) -> Tuple[str, List[ThinkingStep]]:
     """
     处理审批结果 (由 UI 调用)
     
     Args:
         approval_status: "approved" 或 "rejected"
-        ctx: 风险上下文
-        api_key: API key
-        pending_state: 之前保存的待审批状态
+        thread_id: 待审批线程（run_agent 的 approval_context / 流式 state 里的 thread_id）
     
     Returns:
-        (final_response, thinking_steps)
+        (final_response, thinking_steps)，thinking_steps 包含审批前的全部步骤
+    
+    Raises:
+        LookupError: 线程不存在、已处理或已过期清理
     """
-    # 重建状态
-    state = {
-        **pending_state,
-        "approval_status": approval_status,
-    }
+    if pending_approval(thread_id) is None:
+        raise LookupError(f"No pending approval for thread {thread_id}")
     
-    # 执行审批处理
-    result_state = node_handle_approval(state)
+    # 从 wait_approval 断点继续: interrupt() 返回 approval_status → handle_approval
+    final_state = get_compiled_graph().invoke(
+        Command(resume=approval_status), _thread_config(thread_id), durability=_DURABILITY,
+    )
+    get_checkpointer().delete_thread(thread_id)
     
-    return result_state["final_response"], result_state["thinking_steps"]
\ No newline at end of file
+    return final_state["final_response"], final_state["thinking_steps"]
+
+
+# ============================================================
+# 指标导出
+# ============================================================
+
+def step_records(steps: List[ThinkingStep], **tags) -> List[dict]:
+    """
+    ThinkingStep → 扁平 dict 列表（含 duration_ms 和调用方给的标签，如 session_id / turn_id），
+    可直接转 DataFrame / CSV，或用 append_metrics_log 落盘后跨 session 汇总
+    """
+    return [
+        {**tags, "seq": i, **asdict(step), "duration_ms": step.duration_ms}
+        for i, step in enumerate(steps)
+    ]
+
+
+def append_metrics_log(records: List[dict], path: Optional[str] = None):
+    """把 step_records 追加到 JSONL 文件（默认 AGENT_METRICS_LOG；未配置时不写）"""
+    path = path or AGENT_METRICS_LOG
+    if not path or not records:
+        return
+    with open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
@@ -4,7 +4,10 @@ agent_logic_lg.py — Agentic Audit Loop (LangGraph Version)
 增强特性:
     - 工具调用透明化: 显示函数名、参数、返回值
     - 审计状态详细化: PASS/FAIL 明确标识
-    - 支持流式执行: run_agent_stream()
+    - 支持流式执行: run_agent_stream()，respond 节点逐 token 推送
+    - 异步运行时: arun_agent() / arun_agent_stream()，LLM 走 AsyncOpenAI，供并发调用
+    - 一步修正: audit 由 audit_engine 对操作后的组合做全部限额审计并解析求出最大合规比例，
+      refine 直接采用建议值，audit → refine → respond 不再循环
 
 架构:
     agent_logic_lg.py (Orchestrator) → skills.py (Calculator)
@@ -13,10 +16,13 @@ agent_logic_lg.py — Agentic Audit Loop (LangGraph Version)
 import re
 from typing import Optional, List, Tuple, TypedDict, Literal
 from dataclasses import dataclass
-from openai import OpenAI
+
+import llm_cache
+import prompt_builder
 
 # LangGraph imports
 from langgraph.graph import StateGraph, END
+from langgraph.config import get_stream_writer
 
 # 从 skills.py 导入业务计算函数
 from skills import (
@@ -43,6 +49,7 @@ class ThinkingStep:
         tool_params: 传入的参数
         tool_result: 返回的核心数据
         is_warning: 是否为警告状态 (用于审计失败高亮)
+        cache_hit: LLM 响应来自 llm_cache
     """
     node: str
     status: str  # "running", "success", "warning", "error"
@@ -52,6 +59,7 @@ class ThinkingStep:
     tool_params: Optional[str] = None    # 新增: 参数
     tool_result: Optional[str] = None    # 新增: 返回值
     is_warning: bool = False             # 新增: 警告标识
+    cache_hit: bool = False              # LLM 响应来自 llm_cache
 
 
 class AgentState(TypedDict):
@@ -80,6 +88,9 @@ COMPLIANCE_LIMITS = {
     "max_single_issuer": 0.05,
 }
 
+# run_agent_stream 中 respond 节点 token 增量事件的 node_name
+TOKEN_EVENT = "token"
+
 
 # ============================================================
 # 节点函数 (Nodes) - 增强版
@@ -249,7 +260,8 @@ def node_audit(state: AgentState) -> AgentState:
             message="✅ Compliance Passed",
             tool_call="check_hedge_compliance()",
             tool_params=f"proposed_ratio={proposed_ratio:.0%}, hedge_type='duration'",
-            tool_result=f"PASS - Within limit {audit_result['max_allowed']:.0%}",
+            tool_result=(f"PASS - {audit_result['limits_checked']} limits checked, "
+                         f"max compliant {audit_result['max_allowed']:.0%}"),
             is_warning=False,
         ))
     else:
@@ -258,10 +270,14 @@ def node_audit(state: AgentState) -> AgentState:
             node="🛡️ Audit",
             status="warning",
             message="⚠️ Compliance Failed - Auto-correction required",
-            detail=f"Proposed {proposed_ratio:.0%} exceeds limit {audit_result['max_allowed']:.0%}",
+            detail=(f"Proposed {proposed_ratio:.0%} breaches "
+                    f"{', '.join(d['limit'] for d in audit_result['breach_details']) or 'limits'}; "
+                    f"compliant range {audit_result['min_allowed']:.0%}–{audit_result['max_allowed']:.0%}"),
             tool_call="check_hedge_compliance()",
             tool_params=f"proposed_ratio={proposed_ratio:.0%}",
-            tool_result=f"FAIL - Exceeds limit! Recommended: {audit_result.get('recommendation', 0):.0%}",
+            tool_result=(f"FAIL - Recommended: {audit_result['recommendation']:.0%}"
+                         if audit_result.get("recommendation") is not None
+                         else "FAIL - No compliant hedge size"),
             is_warning=True,
         ))
     
@@ -273,14 +289,19 @@ def node_audit(state: AgentState) -> AgentState:
 
 
 def node_refine(state: AgentState) -> AgentState:
-    """Node 4: Auto-correction"""
+    """
+    Node 4: Auto-correction
+
+    audit 已经对操作后的组合求出合规区间，建议值保证通过全部限额，
+    一步到位后直接进入 respond（不再回到 audit 重新检查）
+    """
     steps = list(state.get("thinking_steps", []))
     
     audit_result = state.get("audit_result", {})
     params = dict(state.get("params", {}))
     iteration = state.get("iteration", 0) + 1
     
-    if audit_result.get("recommendation"):
+    if audit_result.get("recommendation") is not None:
         new_ratio = audit_result["recommendation"]
         old_ratio = params.get("hedge_ratio", 0)
         params["hedge_ratio"] = new_ratio
@@ -291,13 +312,15 @@ def node_refine(state: AgentState) -> AgentState:
             status="success",
             message="Auto-correction complete",
             detail=f"Hedge ratio: {old_ratio:.0%} → {new_ratio:.0%}",
-            tool_result=f"Adjusted to compliant range (95% of {audit_result['max_allowed']:.0%} limit)",
+            tool_result=(f"Adjusted to compliant range {audit_result['min_allowed']:.0%}–"
+                         f"{audit_result['max_allowed']:.0%} (bound by {audit_result.get('recommendation_limit') or audit_result['binding_limit']}, 5% buffer)"),
         ))
     else:
         steps.append(ThinkingStep(
             node="🔄 Refine",
             status="error",
             message="Unable to find compliant alternative",
+            detail=audit_result.get("message", ""),
         ))
     
     return {
@@ -310,8 +333,41 @@ def node_refine(state: AgentState) -> AgentState:
 
 def node_respond(state: AgentState) -> AgentState:
     """Node 5: Generate final response"""
-    steps = list(state.get("thinking_steps", []))
-    
+    full_prompt = _build_respond_prompt(state)
+    try:
+        emit = _get_token_writer()
+        deltas, cache_hit = _call_llm_stream(
+            state["api_key"], full_prompt, state["user_query"],
+            fingerprint=state["ctx"].get("fingerprint"),
+        )
+        chunks = []
+        for delta in deltas:
+            chunks.append(delta)
+            emit(delta)
+        return _respond_done(state, "".join(chunks), cache_hit)
+    except Exception as e:
+        return _respond_failed(state, e)
+
+
+async def anode_respond(state: AgentState) -> AgentState:
+    """Node 5 (async): 同 node_respond，LLM 走 AsyncOpenAI"""
+    full_prompt = _build_respond_prompt(state)
+    try:
+        emit = _get_token_writer()
+        deltas, cache_hit = _acall_llm_stream(
+            state["api_key"], full_prompt, state["user_query"],
+            fingerprint=state["ctx"].get("fingerprint"),
+        )
+        chunks = []
+        async for delta in deltas:
+            chunks.append(delta)
+            emit(delta)
+        return _respond_done(state, "".join(chunks), cache_hit)
+    except Exception as e:
+        return _respond_failed(state, e)
+
+
+def _build_respond_prompt(state: AgentState) -> str:
     # Build enhanced context
     context_parts = [f"User Intent: {state.get('intent', 'unknown')}"]
     
@@ -328,7 +384,7 @@ def node_respond(state: AgentState) -> AgentState:
     
     enhanced_context = "\n".join(context_parts)
     
-    full_prompt = f"""{state['system_prompt']}
+    return f"""{state['system_prompt']}
 
 === AGENT EXECUTION CONTEXT ===
 {enhanced_context}
@@ -339,24 +395,18 @@ def node_respond(state: AgentState) -> AgentState:
 3. Be concise (< 150 words) unless more detail requested
 4. Use professional risk management terminology
 """
-    
-    try:
-        response = _call_llm(state["api_key"], full_prompt, state["user_query"])
-        steps.append(ThinkingStep(
-            node="💬 Respond",
-            status="success",
-            message="Response generated",
-            tool_call="_call_llm()",
-            tool_result="GPT-4o-mini response ready",
-        ))
-    except Exception as e:
-        response = f"I apologize, but I encountered an error: {str(e)}"
-        steps.append(ThinkingStep(
-            node="💬 Respond",
-            status="error",
-            message=f"Generation failed: {str(e)}",
-        ))
-    
+
+
+def _respond_done(state: AgentState, response: str, cache_hit: bool) -> AgentState:
+    steps = list(state.get("thinking_steps", []))
+    steps.append(ThinkingStep(
+        node="💬 Respond",
+        status="success",
+        message="Response generated (cached)" if cache_hit else "Response generated",
+        tool_call="_call_llm_stream()",
+        tool_result="cache hit — no tokens used" if cache_hit else "GPT-4o-mini response ready",
+        cache_hit=cache_hit,
+    ))
     return {
         **state,
         "thinking_steps": steps,
@@ -364,6 +414,20 @@ def node_respond(state: AgentState) -> AgentState:
     }
 
 
+def _respond_failed(state: AgentState, error: Exception) -> AgentState:
+    steps = list(state.get("thinking_steps", []))
+    steps.append(ThinkingStep(
+        node="💬 Respond",
+        status="error",
+        message=f"Generation failed: {str(error)}",
+    ))
+    return {
+        **state,
+        "thinking_steps": steps,
+        "final_response": f"I apologize, but I encountered an error: {str(error)}",
+    }
+
+
 # ============================================================
 # 路由函数 (Conditional Edges)
 # ============================================================
@@ -384,9 +448,8 @@ def route_after_calculate(state: AgentState) -> Literal["audit", "respond"]:
 
 def route_after_audit(state: AgentState) -> Literal["refine", "respond"]:
     audit_result = state.get("audit_result", {})
-    iteration = state.get("iteration", 0)
     
-    if audit_result.get("status") == "FAIL" and iteration < 3:
+    if audit_result.get("status") == "FAIL":
         return "refine"
     return "respond"
 
@@ -395,14 +458,18 @@ def route_after_audit(state: AgentState) -> Literal["refine", "respond"]:
 # 构建 StateGraph
 # ============================================================
 
-def build_graph() -> StateGraph:
+def build_graph(use_async: bool = False) -> StateGraph:
     """
     构建 LangGraph StateGraph
     
     图结构:
-        analyze → calculate → audit ←→ refine
-                     ↓          ↓
-                  respond ← ─ ─ ┘
+        analyze → calculate → audit → refine
+                     ↓          ↓        ↓
+                  respond ← ─ ─ ┴ ─ ─ ─ ─┘
+
+    refine 用 audit 解析求出的建议值一步修正，不再回到 audit 循环
+    
+    use_async=True 时 respond 换成异步节点；其余节点是纯 CPU 计算，两种图共用
     """
     graph = StateGraph(AgentState)
     
@@ -411,7 +478,7 @@ def build_graph() -> StateGraph:
     graph.add_node("calculate", node_calculate)
     graph.add_node("audit", node_audit)
     graph.add_node("refine", node_refine)
-    graph.add_node("respond", node_respond)
+    graph.add_node("respond", anode_respond if use_async else node_respond)
     
     # 入口点
     graph.set_entry_point("analyze")
@@ -421,8 +488,8 @@ def build_graph() -> StateGraph:
     graph.add_conditional_edges("calculate", route_after_calculate, {"audit": "audit", "respond": "respond"})
     graph.add_conditional_edges("audit", route_after_audit, {"refine": "refine", "respond": "respond"})
     
-    # Refine 后重新 Audit
-    graph.add_edge("refine", "audit")
+    # Refine 的建议值已保证合规，直接生成响应
+    graph.add_edge("refine", "respond")
     
     # Respond 是终点
     graph.add_edge("respond", END)
@@ -432,6 +499,7 @@ def build_graph() -> StateGraph:
 
 # 编译图 (全局单例)
 _compiled_graph = None
+_compiled_async_graph = None
 
 def get_compiled_graph():
     global _compiled_graph
@@ -440,20 +508,19 @@ def get_compiled_graph():
     return _compiled_graph
 
 
+def get_compiled_async_graph():
+    global _compiled_async_graph
+    if _compiled_async_graph is None:
+        _compiled_async_graph = build_graph(use_async=True).compile()
+    return _compiled_async_graph
+
+
 # ============================================================
 # 主运行函数
 # ============================================================
 
-def run_agent(
-    user_query: str,
-    ctx: dict,
-    system_prompt: str,
-    api_key: str,
-) -> Tuple[str, List[ThinkingStep]]:
-    """运行 Agent (非流式版本)"""
-    graph = get_compiled_graph()
-    
-    initial_state: AgentState = {
+def _initial_state(user_query: str, ctx: dict, system_prompt: str, api_key: str) -> AgentState:
+    return {
         "user_query": user_query,
         "ctx": ctx,
         "system_prompt": system_prompt,
@@ -466,8 +533,29 @@ def run_agent(
         "final_response": "",
         "iteration": 0,
     }
-    
-    final_state = graph.invoke(initial_state)
+
+
+def run_agent(
+    user_query: str,
+    ctx: dict,
+    system_prompt: str,
+    api_key: str,
+) -> Tuple[str, List[ThinkingStep]]:
+    """运行 Agent (非流式版本)"""
+    graph = get_compiled_graph()
+    final_state = graph.invoke(_initial_state(user_query, ctx, system_prompt, api_key))
+    return final_state["final_response"], final_state["thinking_steps"]
+
+
+async def arun_agent(
+    user_query: str,
+    ctx: dict,
+    system_prompt: str,
+    api_key: str,
+) -> Tuple[str, List[ThinkingStep]]:
+    """运行 Agent (异步版本，同一个 event loop 上可并发多轮对话)"""
+    graph = get_compiled_async_graph()
+    final_state = await graph.ainvoke(_initial_state(user_query, ctx, system_prompt, api_key))
     return final_state["final_response"], final_state["thinking_steps"]
 
 
@@ -481,25 +569,36 @@ def run_agent_stream(
     运行 Agent (流式版本)
     
     Yields: (node_name, state, is_final)
+        node_name == TOKEN_EVENT 时 state 为 {"token": str}，是最终回答的增量文本
     """
     graph = get_compiled_graph()
     
-    initial_state: AgentState = {
-        "user_query": user_query,
-        "ctx": ctx,
-        "system_prompt": system_prompt,
-        "api_key": api_key,
-        "thinking_steps": [],
-        "intent": "",
-        "params": {},
-        "calculation_result": {},
-        "audit_result": {},
-        "final_response": "",
-        "iteration": 0,
-    }
-    
-    for event in graph.stream(initial_state):
-        for node_name, state in event.items():
+    # updates: 每个节点结束后的状态; custom: respond 节点推送的 token 增量
+    for mode, chunk in graph.stream(_initial_state(user_query, ctx, system_prompt, api_key),
+                                    stream_mode=["updates", "custom"]):
+        if mode == "custom":
+            yield TOKEN_EVENT, chunk, False
+            continue
+        for node_name, state in chunk.items():
+            is_final = (node_name == "respond" and state.get("final_response"))
+            yield node_name, state, is_final
+
+
+async def arun_agent_stream(
+    user_query: str,
+    ctx: dict,
+    system_prompt: str,
+    api_key: str,
+):
+    """运行 Agent (异步流式版本)，事件格式同 run_agent_stream"""
+    graph = get_compiled_async_graph()
+    
+    async for mode, chunk in graph.astream(_initial_state(user_query, ctx, system_prompt, api_key),
+                                           stream_mode=["updates", "custom"]):
+        if mode == "custom":
+            yield TOKEN_EVENT, chunk, False
+            continue
+        for node_name, state in chunk.items():
             is_final = (node_name == "respond" and state.get("final_response"))
             yield node_name, state, is_final
 
@@ -530,18 +629,37 @@ def _extract_equity_shock(text: str) -> Optional[float]:
     return None
 
 
-def _call_llm(api_key: str, system_prompt: str, user_query: str) -> str:
-    client = OpenAI(api_key=api_key)
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_query},
-        ],
-        max_tokens=400,
-        temperature=0.3,
+def _call_llm(api_key: str, system_prompt: str, user_query: str,
+              fingerprint: Optional[str] = None) -> Tuple[str, bool]:
+    return llm_cache.cached_chat(
+        api_key, system_prompt, user_query,
+        fingerprint=fingerprint, max_tokens=400, temperature=0.3,
+    )
+
+
+def _call_llm_stream(api_key: str, system_prompt: str, user_query: str,
+                     fingerprint: Optional[str] = None):
+    return llm_cache.cached_chat_stream(
+        api_key, system_prompt, user_query,
+        fingerprint=fingerprint, max_tokens=400, temperature=0.3,
+    )
+
+
+def _acall_llm_stream(api_key: str, system_prompt: str, user_query: str,
+                      fingerprint: Optional[str] = None):
+    return llm_cache.acached_chat_stream(
+        api_key, system_prompt, user_query,
+        fingerprint=fingerprint, max_tokens=400, temperature=0.3,
     )
-    return response.choices[0].message.content
+
+
+def _get_token_writer():
+    """graph.stream(stream_mode='custom') 的 writer；直接调用节点（不在图里）时返回空操作"""
+    try:
+        writer = get_stream_writer()
+    except RuntimeError:
+        return lambda text: None
+    return lambda text: writer({"token": text})
 
 
 # ============================================================
@@ -549,21 +667,8 @@ def _call_llm(api_key: str, system_prompt: str, user_query: str) -> str:
 # ============================================================
 
 def build_system_prompt(ctx: dict) -> str:
-    """构建 System Prompt"""
-    funded_status = ctx['funded_status']
-    total_assets = ctx['total_assets']
-    total_liabilities = ctx['total_liabilities']
-    surplus = ctx['surplus']
-    asset_dur = ctx['asset_dur']
-    liability_dur = ctx['liability_dur']
-    duration_gap = asset_dur - liability_dur
-    fx_pct = ctx['fx_pct']
-
-    comp_df = ctx['comp_df']
-    allocation_str = comp_df[['asset_class', 'current_weight', 'policy_target']].to_string(index=False)
-
-    limits_df = ctx['limits_df']
-    limits_str = limits_df[['asset_class', 'current_weight', 'range_min', 'range_max', 'Status']].to_string(index=False)
+    """构建 System Prompt（组合快照来自 prompt_builder，按 ctx 指纹缓存）"""
+    snapshot = prompt_builder.build_prompt_context(ctx).text
 
     return f"""You are a Risk Advisor for a large Canadian defined benefit pension fund (~$125B AUM).
 
@@ -571,22 +676,9 @@ IMPORTANT: You are part of an Agentic System powered by LangGraph with AUDIT cap
 - Any hedging/rebalancing suggestions are automatically checked against compliance limits
 - If a suggestion exceeds limits, the system auto-adjusts to a compliant alternative
 
-=== PORTFOLIO SNAPSHOT ===
-
-Key Metrics:
-- Funded Status: {funded_status:.1%} (Target: 111%)
-- Total Assets: ${total_assets/1000:.1f}B | Liabilities: ${total_liabilities/1000:.1f}B
-- Surplus: ${surplus/1000:.1f}B
-- Duration Gap: {duration_gap:.1f} years
-- FX Exposure: {fx_pct:.1%} (Limit: 15%)
-
 === COMPLIANCE LIMITS ===
 - Max Hedge Ratio: {COMPLIANCE_LIMITS['max_hedge_ratio']:.0%}
 - Max FX Exposure: {COMPLIANCE_LIMITS['max_fx_exposure']:.0%}
 
-Asset Allocation:
-{allocation_str}
-
-Limit Status:
-{limits_str}
+{snapshot}
 """
\ No newline at end of file
@@ -4,8 +4,8 @@ app.py — HOOPP Risk Navigator 入口
 职责:
     1. page config + 全局样式注入
     2. sidebar: 日期选择器 + HOOPP Logo
-    3. 调用 engine.build_context() 拿到 ctx
-    4. 依次 render 5 个 Tab
+    3. 通过 context_cache.get_context() 拿到 ctx（进程级共享，内部调用 engine.build_context()）
+    4. Tab 选择器 + 只 render 当前可见的 Tab
 
 设计: 方案 C 混合主题 (深色侧边栏 + 浅色内容区)
 """
@@ -14,7 +14,8 @@ import streamlit as st
 import pandas as pd
 from pathlib import Path
 
-import engine
+import context_cache
+import context_store
 
 # ============================================================
 # 1. Page Config（必须是文件里第一个 Streamlit 调用）
@@ -40,13 +41,16 @@ st.markdown(GLOBAL_CSS, unsafe_allow_html=True)
 
 @st.cache_data
 def load_data():
-    """读 CSV，返回原始 DataFrame。只在启动时跑一次。"""
+    """读 CSV，返回原始 DataFrame + 数据文件指纹。只在启动时跑一次。"""
     base = Path(__file__).resolve().parent / "data"
-    df_all    = pd.read_csv(base / "hoopp_positions_sample.csv", parse_dates=["timestamp"])
-    df_policy = pd.read_csv(base / "policy_limit_management.csv")
-    return df_all, df_policy
+    positions_path = base / "hoopp_positions_sample.csv"
+    policy_path    = base / "policy_limit_management.csv"
+    df_all    = pd.read_csv(positions_path, parse_dates=["timestamp"])
+    df_policy = pd.read_csv(policy_path)
+    data_fp   = context_store.source_fingerprint(positions_path, policy_path)
+    return df_all, df_policy, data_fp
 
-df_all, df_policy = load_data()
+df_all, df_policy, data_fp = load_data()
 
 # ============================================================
 # 4. Sidebar (方案 C: 深色侧边栏 + 文字 Logo)
@@ -140,14 +144,16 @@ with st.sidebar:
     )
 
 # ============================================================
-# 5. 调用 engine，拿到 ctx
+# 5. 拿到 ctx（进程级共享缓存：同一天所有 session 只算一次）
 # ============================================================
 
-ctx = engine.build_context(df_all, df_policy, selected_date)
+ctx = context_cache.get_context(df_all, df_policy, selected_date, data_fp)
 
 # ============================================================
-# 6. Tab 渲染
+# 6. Tab 渲染（惰性：只执行当前可见的 Tab）
 # ============================================================
+# st.tabs 会执行所有 Tab 的 body，任何交互都会把 7 个 Tab 的图表全部重建一遍。
+# 这里改成 Tab 选择器：只调用当前选中 Tab 的 render(ctx)，其余 Tab 不做任何计算。
 
 from tabs.tab_funding_status import render as render_funding_status
 from tabs.tab_limit_monitor import render as render_limit_monitor
@@ -157,42 +163,42 @@ from tabs.tab_ai_copilot_lg import render as render_ai_copilot_langgraph
 from tabs.tab_ai_copilot_gov import render as render_ai_copilot_gov
 from tabs.tab_data_governance import render as render_data_governance
 
+TABS = {
+    "📊 Funding Status":                 render_funding_status,
+    "🚦 Limit Monitor":                  render_limit_monitor,
+    "🎚️ Stress Testing":                 render_stress,
+    "🤖 AI Copilot":                     render_ai_copilot,
+    "🤖 AI Copilot (LangGraph)":         render_ai_copilot_langgraph,
+    "🤖 AI Copilot (Governance)":        render_ai_copilot_gov,
+    "🛡️ Data Governance (in pipeline)":  render_data_governance,
+}
+tab_labels = list(TABS.keys())
+
+if "active_tab" not in st.session_state:
+    st.session_state["active_tab"] = tab_labels[0]
+
+
+def _on_tab_change():
+    """
+    segmented_control 再次点击当前选项会取消选中，这里恢复为上一次的 Tab。
+
+    注意: 每次 run 只渲染当前 Tab，没渲染的 widget 会被 Streamlit 清掉 key，
+    切回来时回到默认值。需要跨 Tab 保留取值的 widget 用
+    ui_components.restore_widget_state / save_widget_state 另存到非 widget key。
+    """
+    if st.session_state["tab_selector"] is None:
+        st.session_state["tab_selector"] = st.session_state["active_tab"]
+    else:
+        st.session_state["active_tab"] = st.session_state["tab_selector"]
+
+
+st.segmented_control(
+    label="Navigation",
+    options=tab_labels,
+    default=st.session_state["active_tab"],
+    label_visibility="collapsed",
+    key="tab_selector",
+    on_change=_on_tab_change,
+)
 
-
-tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
-    "📊 Funding Status",
-    "🚦 Limit Monitor",
-    "🎚️ Stress Testing",
-    "🤖 AI Copilot",
-    "🤖 AI Copilot (LangGraph)",
-    "🤖 AI Copilot (Governance)",
-    "🛡️ Data Governance (in pipeline)",
-])
-with tab1:
-    render_funding_status(ctx)
-with tab2:
-    render_limit_monitor(ctx)
-with tab3:
-    render_stress(ctx)
-with tab4:
-    render_ai_copilot(ctx)
-with tab5:
-    render_ai_copilot_langgraph(ctx)
-with tab6:
-    render_ai_copilot_gov(ctx)
-with tab7:
-    render_data_governance(ctx)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+TABS[st.session_state["active_tab"]](ctx)
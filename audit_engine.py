@@ -0,0 +1,307 @@
+"""
+audit_engine.py — 对冲操作的向量化合规审计 + 解析求最大合规规模
+
+背景:
+    agent_logic_lg / agent_logic_gov 的 audit 节点只拿对冲比例和 COMPLIANCE_LIMITS
+    里的 max_hedge_ratio 比一下:
+        · 操作之后的组合完全没检查（资产配置区间、FX、funded status、发行人集中度）
+        · 超限时的建议值固定是 "上限 × 95%"，它本身可能违反别的限额，
+          lg 的 refine 循环只能 audit → refine → audit 反复试
+
+设计:
+    - 每种对冲把操作规模 x（对冲比例）映射为对限额表每一行的仿射变化:
+          post_i(x) = base_i + slope_i · x
+      (对冲都是 repo 融资 / 衍生品 overlay，总资产不变，所以每一行都是 x 的一次函数)
+        duration — repo 融资买入长债: Fixed Income ↑、Cash & Funding ↓、久期缺口 ↑
+                   x = 资产美元久期 / 负债美元久期，x 等于当前水平时不交易
+        fx       — 远期对冲当前净外汇敞口的 x 比例: FX Net Exposure × (1 − x)
+        equity   — 期货 overlay 对冲公开股票的 x 比例: 股票经济敞口 × (1 − x)
+      限额表 = ctx['limits_df'] 全部行 + 发行人集中度（issuer_df）+ 该对冲类型自身的
+      限额（max_hedge_ratio、久期缺口区间、最低股票敞口）
+    - 一次 numpy 运算得到每一行允许的 x 区间，取交集 = [min_compliant, max_compliant]；
+      提议的 x 在区间内即 PASS，否则 FAIL，建议值 = 区间内按 5% buffer 收缩的点，
+      保证一步到位（不再需要 refine → audit 循环）
+    - 对冲前后的盈余日波动: 对冲只改变盈余对因子的敏感度 g（duration → 利率，equity → 权益，
+      fx 不是模型因子），σ = √(gᵀ Σ g)，Σ 取 ctx 里的 EWMA 协方差（cov_service）
+    - slope = 0 且操作前就超限的行（与本次操作无关）记为 pre_existing，不阻止操作
+    - 长债 overlay 按政府债处理，不计入发行人集中度
+
+对外暴露:
+    HEDGE_OVERLAY_DURATION
+    AuditResult (to_tool_output)
+    current_ratio(ctx, hedge_type) → 当前对冲比例（duration: 资产 / 负债美元久期；fx / equity: 0）
+    limit_rows(ctx, hedge_type, hedge_limits) → DataFrame (limit | base | slope | current | range_min | range_max)
+    surplus_vol(ctx, hedge_type, ratio) → (操作前, 操作后) 盈余 1 日波动；无协方差时 None
+    audit_hedge(ctx, ratio, hedge_type, hedge_limits) → AuditResult
+"""
+
+import math
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import cov_service
+import var_engine
+
+
+# duration overlay 买入的长债久期（Long Canada 指数附近）
+HEDGE_OVERLAY_DURATION = 15.0
+
+# 建议值离区间边界留 5% buffer（与原来的 "上限 × 95%" 一致）
+_BUFFER = 0.95
+
+# 与 engine._build_issuer_df 相同的保守阈值
+_ISSUER_LIMIT = 0.05
+
+# 浮点误差容忍
+_EPS = 1e-12
+
+
+# ============================================================
+# 数据结构
+# ============================================================
+
+@dataclass
+class AuditResult:
+    hedge_type: str
+    proposed_ratio: float
+    min_compliant: float
+    max_compliant: float
+    binding_limit: str                      # 决定 max_compliant 的限额
+    min_binding_limit: str                  # 决定 min_compliant 的限额
+    table: pd.DataFrame                     # 每行: limit | current | post | range_min | range_max | status
+    breaches: List[str] = field(default_factory=list)       # 提议规模下因本次操作超限的行
+    pre_existing: List[str] = field(default_factory=list)   # 操作前就超限、且与本次操作无关的行
+    surplus_vol: Optional[Tuple[float, float]] = None      # (操作前, 操作后) 盈余 1 日波动
+
+    @property
+    def feasible(self) -> bool:
+        return self.min_compliant <= self.max_compliant
+
+    @property
+    def status(self) -> str:
+        return "PASS" if not self.breaches else "FAIL"
+
+    @property
+    def recommendation(self) -> Optional[float]:
+        """FAIL 时的一步到位建议值；找不到合规规模时为 None"""
+        if self.status == "PASS" or not self.feasible:
+            return None
+        if self.proposed_ratio > self.max_compliant:
+            return max(self.max_compliant * _BUFFER, self.min_compliant)
+        return min(self.min_compliant / _BUFFER, self.max_compliant)
+
+    @property
+    def recommendation_limit(self) -> Optional[str]:
+        """建议值所贴近的限额: 提议超过上界 → binding_limit，低于下界 → min_binding_limit"""
+        if self.recommendation is None:
+            return None
+        return self.binding_limit if self.proposed_ratio > self.max_compliant else self.min_binding_limit
+
+    def breach_details(self) -> List[dict]:
+        """提议规模下超限的行: [{limit, post, range_min, range_max}]"""
+        t = self.table
+        mask = (t["status"] == "BREACH").to_numpy()
+        return [{"limit": name, "post": float(post), "range_min": float(lo), "range_max": float(hi)}
+                for name, post, lo, hi in zip(t["limit"].to_numpy()[mask], t["post"].to_numpy()[mask],
+                                              t["range_min"].to_numpy()[mask], t["range_max"].to_numpy()[mask])]
+
+    def to_tool_output(self) -> dict:
+        """工具返回格式（check_hedge_compliance），数值全部转成 float"""
+        out = {
+            "status": self.status,
+            "proposed_ratio": float(self.proposed_ratio),
+            "max_allowed": float(self.max_compliant),
+            "min_allowed": float(self.min_compliant),
+            "binding_limit": self.binding_limit,
+            "min_binding_limit": self.min_binding_limit,
+            "hedge_type": self.hedge_type,
+            "limits_checked": len(self.table),
+            "breach_details": self.breach_details(),
+            "pre_existing_breaches": list(self.pre_existing),
+            "recommendation": self.recommendation,
+            "recommendation_limit": self.recommendation_limit,
+            "requires_approval": self.status == "FAIL",
+            "surplus_vol_1d_before": float(self.surplus_vol[0]) if self.surplus_vol else None,
+            "surplus_vol_1d_after": float(self.surplus_vol[1]) if self.surplus_vol else None,
+        }
+        if self.status == "PASS":
+            out["message"] = (f"Hedge ratio {self.proposed_ratio:.0%} passes all {len(self.table)} limits "
+                              f"(max compliant {self.max_compliant:.0%}, bound by {self.binding_limit})")
+        elif self.feasible:
+            out["message"] = (f"Hedge ratio {self.proposed_ratio:.0%} breaches {', '.join(self.breaches)}; "
+                              f"compliant range {self.min_compliant:.0%}–{self.max_compliant:.0%}, approval required")
+            out["recommendation_message"] = (f"Recommended adjustment: {self.recommendation:.0%} "
+                                             f"(within {self.recommendation_limit} with 5% buffer)")
+        else:
+            out["message"] = (f"Hedge ratio {self.proposed_ratio:.0%} breaches {', '.join(self.breaches)}; "
+                              f"no {self.hedge_type} hedge size satisfies every limit")
+        return out
+
+
+# ============================================================
+# 限额行: post(x) = base + slope · x
+# ============================================================
+
+def current_ratio(ctx: dict, hedge_type: str) -> float:
+    """操作前的对冲比例: duration 是现有资产久期覆盖负债的比例；fx / equity overlay 从 0 起算"""
+    if hedge_type == "duration":
+        liab_dd = ctx["liability_dur"] * ctx["total_liabilities"]
+        return float(ctx["asset_dur"] * ctx["total_assets"] / liab_dd) if liab_dd else 0.0
+    return 0.0
+
+
+def _limit_arrays(ctx: dict, hedge_type: str, hedge_limits: dict) -> dict:
+    """limit_rows 的 numpy 版本（audit_hedge 直接用，省掉 DataFrame 开销）"""
+    limits_df = ctx["limits_df"]
+    names = limits_df["asset_class"].to_numpy(dtype=object)
+    base = limits_df["current_weight"].to_numpy(dtype=float)
+    slope = np.zeros(len(limits_df))
+    lo = limits_df["range_min"].to_numpy(dtype=float)
+    hi = limits_df["range_max"].to_numpy(dtype=float)
+
+    # 该对冲类型自身的限额: (limit, base, slope, range_min, range_max)
+    extra = [("Max Hedge Ratio", 0.0, 1.0, 0.0, hedge_limits.get("max_hedge_ratio", 1.0))]
+
+    if hedge_type == "duration":
+        # x = 资产美元久期 / 负债美元久期；补足久期需要的长债名义 N(x) = (x·LDD − ADD₀) / D
+        total_assets = ctx["total_assets"]
+        liab_dd = ctx["liability_dur"] * ctx["total_liabilities"]
+        asset_dd = ctx["asset_dur"] * total_assets
+        per_x = liab_dd / (HEDGE_OVERLAY_DURATION * total_assets)
+        at_zero = asset_dd / (HEDGE_OVERLAY_DURATION * total_assets)
+        sign = np.where(names == "Fixed Income", 1.0, np.where(names == "Cash & Funding", -1.0, 0.0))
+        base = base - sign * at_zero
+        slope = slope + sign * per_x
+        # 久期缺口 = 资产久期(x) − 负债久期，资产久期(x) = x · LDD / TA
+        extra.append(("Duration Gap", -ctx["liability_dur"], liab_dd / total_assets,
+                      hedge_limits.get("min_duration_gap", -math.inf),
+                      hedge_limits.get("max_duration_gap", math.inf)))
+    elif hedge_type == "fx":
+        slope = np.where(names == "FX Net Exposure", -base, slope)
+    elif hedge_type == "equity":
+        equity = base[names == "Public Equities"].sum()
+        extra.append(("Equity Exposure", equity, -equity,
+                      hedge_limits.get("min_equity_exposure", 0.0), math.inf))
+
+    issuer_df = ctx["issuer_df"]
+    n_issuers = len(issuer_df)
+    extra_names, extra_base, extra_slope, extra_lo, extra_hi = zip(*extra)
+
+    issuer_names = np.array([f"Issuer {name}" for name in issuer_df["Issuer"]], dtype=object)
+
+    rows = {
+        "limit": np.concatenate([names, extra_names, issuer_names]),
+        "base": np.concatenate([base, extra_base, issuer_df["Weight"].to_numpy(dtype=float)]),
+        "slope": np.concatenate([slope, extra_slope, np.zeros(n_issuers)]),
+        "range_min": np.concatenate([lo, extra_lo, np.zeros(n_issuers)]),
+        "range_max": np.concatenate([hi, extra_hi, np.full(n_issuers, _ISSUER_LIMIT)]),
+    }
+    rows["current"] = rows["base"] + rows["slope"] * current_ratio(ctx, hedge_type)
+    return rows
+
+
+def limit_rows(ctx: dict, hedge_type: str, hedge_limits: dict) -> pd.DataFrame:
+    """
+    该对冲类型下限额表每一行的仿射模型。
+
+    hedge_limits: COMPLIANCE_LIMITS[hedge_type]（max_hedge_ratio、久期缺口区间等）
+    """
+    return pd.DataFrame(_limit_arrays(ctx, hedge_type, hedge_limits))
+
+
+# ============================================================
+# 盈余波动: σ = √(gᵀ Σ g)
+# ============================================================
+
+def surplus_vol(ctx: dict, hedge_type: str, ratio: float) -> Optional[Tuple[float, float]]:
+    """
+    对冲前后盈余的 1 日波动（单位同 mtm_cad）。
+
+    duration: 长债名义 N(x) = (x − x₀)·LDD / D，利率敏感度变化 −N·D / 1e4 = −(x − x₀)·LDD / 1e4
+    equity  : 公开股票的权益敏感度对冲掉 x 比例
+    fx      : FX 不是模型因子，波动不变
+    """
+    cov = cov_service.cov_from_ctx(ctx)
+    basis = ctx.get("stress_basis")
+    if cov is None or basis is None:
+        return None
+
+    before = var_engine.factor_sensitivities(basis).sum(axis=1)
+    after = before.copy()
+    if hedge_type == "duration":
+        liab_dd = ctx["liability_dur"] * ctx["total_liabilities"]
+        after[0] -= (ratio - current_ratio(ctx, hedge_type)) * liab_dd / 10_000
+    elif hedge_type == "equity":
+        is_equity = np.asarray(basis["is_asset"], dtype=bool) & (basis["asset_class"] == "Public Equities")
+        after[1] -= ratio * basis["equity_pnl_1pct"][is_equity].sum()
+
+    return (float(np.sqrt(max(before @ cov @ before, 0.0))),
+            float(np.sqrt(max(after @ cov @ after, 0.0))))
+
+
+# ============================================================
+# PUBLIC: audit_hedge
+# ============================================================
+
+def audit_hedge(ctx: dict, ratio: float, hedge_type: str, hedge_limits: dict) -> AuditResult:
+    """
+    一次向量化运算审计提议的对冲比例，同时求出合规区间 [min_compliant, max_compliant]。
+
+    对每一行 lo ≤ base + slope·x ≤ hi:
+        slope > 0 → x ∈ [(lo − base)/slope, (hi − base)/slope]
+        slope < 0 → 上下界对调
+        slope = 0 → 不约束 x（操作前就超限的行记为 pre_existing）
+    对冲比例本身限制在 [0, 1]。
+    """
+    rows = _limit_arrays(ctx, hedge_type, hedge_limits)
+    names, base, slope = rows["limit"], rows["base"], rows["slope"]
+    lo, hi = rows["range_min"], rows["range_max"]
+
+    moves = np.abs(slope) > _EPS
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t_lo = (lo - base) / slope
+        t_hi = (hi - base) / slope
+    upper = np.where(moves, np.where(slope > 0, t_hi, t_lo), np.inf)
+    lower = np.where(moves, np.where(slope > 0, t_lo, t_hi), -np.inf)
+    upper = np.nan_to_num(upper, nan=np.inf)
+    lower = np.nan_to_num(lower, nan=-np.inf)
+
+    min_compliant = max(0.0, float(lower.max()))
+    max_compliant = min(1.0, float(upper.min()))
+    binding = names[int(upper.argmin())] if upper.min() < 1.0 else "Full Hedge (100%)"
+    min_binding = names[int(lower.argmax())] if lower.max() > 0.0 else "No Hedge (0%)"
+
+    current = rows["current"]
+    post = base + slope * ratio
+    out_of_range = (post < lo - _EPS) | (post > hi + _EPS)
+    caused = out_of_range & moves
+    pre_existing = out_of_range & ~moves         # 不随 x 变化 → 操作前就已超限
+
+    table = pd.DataFrame({
+        "limit": names,
+        "current": current,
+        "post": post,
+        "range_min": lo,
+        "range_max": hi,
+        "status": np.where(caused, "BREACH", np.where(pre_existing, "PRE-EXISTING", "OK")),
+    })
+    # 区间之外但没有行被打破只可能来自 [0, 1] 的边界
+    breaches = list(names[caused])
+    if not breaches and not (min_compliant - _EPS <= ratio <= max_compliant + _EPS):
+        breaches = ["Hedge Ratio Range (0–100%)"]
+
+    return AuditResult(
+        hedge_type=hedge_type,
+        proposed_ratio=float(ratio),
+        min_compliant=min_compliant,
+        max_compliant=max_compliant,
+        binding_limit=binding,
+        min_binding_limit=min_binding,
+        table=table,
+        breaches=breaches,
+        pre_existing=list(names[pre_existing]),
+        surplus_vol=surplus_vol(ctx, hedge_type, ratio),
+    )
@@ -0,0 +1,229 @@
+"""
+context_cache.py — 进程级共享 ctx 缓存 (多用户部署)
+
+背景:
+    整个风险团队共用一个 Streamlit server，每个 session 原本都会对同一个日期
+    各自跑一遍 engine.build_context()。20 个分析师看最新日期 = 20 次重复计算。
+
+设计:
+    - 两级缓存: 进程内 LRU → 磁盘 context_store（重启后免重算）→ engine.build_context
+    - 进程级单例: 所有 session 读同一份 ctx（按 context_fingerprint 做 key）
+    - 不可变: ctx 以只读 Mapping 形式发布，numpy 数组设为 read-only；
+      DataFrame / Series 每次读取返回浅拷贝（copy-on-read）: Copy-on-Write 下浅拷贝不复制数据，
+      Tab 在读到的 frame 上做 df[...] = ... / .loc 赋值只改自己的拷贝，不会改到其他 session 的 ctx。
+      （pandas 3 对只读 block 的原地赋值会换一块新 block 而不是报错，所以不能靠 writeable 标志锁 frame）
+    - Single-flight: 同一个 key 并发请求时只有一个线程计算，其余线程等待结果
+    - 内存上限: 按 ctx 估算字节数做 LRU 淘汰
+
+对外暴露:
+    get_context(df_all, df_policy, selected_date, data_fp) → ctx (只读 Mapping)
+    get_shared_cache() → SharedContextCache 单例（peek / stats / clear）
+"""
+
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Callable, Iterator, Mapping, Optional
+
+import numpy as np
+import pandas as pd
+
+import engine
+import context_store
+
+
+# 进程内所有 ctx 的估算内存上限
+CONTEXT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# 所有日期共享同一个对象的原始数据，不计入单个 ctx 的内存
+_SHARED_KEYS = ('df_all', 'df_policy')
+
+
+# ============================================================
+# 辅助函数
+# ============================================================
+
+def _estimate_nbytes(value) -> int:
+    """估算一个 ctx 值占用的内存（DataFrame / ndarray / 嵌套 dict）"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, Mapping):
+        return sum(_estimate_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_estimate_nbytes(v) for v in value)
+    return 64
+
+
+class _FrozenContext(Mapping):
+    """只读 ctx: 不能增删改 key；DataFrame / Series 按读取返回浅拷贝，原对象永远不交给调用方"""
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data: dict):
+        self._data = data
+
+    def __getitem__(self, key):
+        value = self._data[key]
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            return value.copy(deep=False)
+        return value
+
+    def __iter__(self) -> Iterator:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def _freeze(ctx: dict) -> Mapping:
+    """把 ctx 发布为只读对象: 顶层只读 Mapping，numpy 数组不可写，frame 读时浅拷贝"""
+    frozen = {}
+    for key, value in ctx.items():
+        if isinstance(value, dict):
+            for arr in value.values():
+                if isinstance(arr, np.ndarray):
+                    arr.flags.writeable = False
+            value = MappingProxyType(value)
+        frozen[key] = value
+    return _FrozenContext(frozen)
+
+
+class _Flight:
+    """一次进行中的计算（single-flight 的等待点）"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Optional[Mapping] = None
+        self.error: Optional[BaseException] = None
+
+
+# ============================================================
+# SharedContextCache
+# ============================================================
+
+class SharedContextCache:
+    """
+    线程安全的进程级 ctx 缓存。
+
+    get_or_build(key, builder):
+        命中 → 直接返回共享 ctx
+        未命中且无人计算 → 当前线程计算，完成后唤醒等待者
+        未命中但已有线程在算 → 等待那次计算的结果（不重复计算）
+    """
+
+    def __init__(self, max_bytes: int = CONTEXT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key → (ctx, nbytes)
+        self._inflight: dict = {}
+        self._total_bytes = 0
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    def get_or_build(self, key: str, builder: Callable[[], dict]) -> Mapping:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[0]
+
+            flight = self._inflight.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+                self._stats["misses"] += 1
+            else:
+                self._stats["coalesced"] += 1
+
+        if not is_leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            ctx = _freeze(builder())
+            flight.value = ctx
+            self._store(key, ctx)
+            return ctx
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def peek(self, key: str) -> Optional[Mapping]:
+        """只查不算: 命中返回共享 ctx，否则 None（不计入命中统计，不改变 LRU 顺序）"""
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[0] if entry is not None else None
+
+    def _store(self, key: str, ctx: Mapping):
+        nbytes = sum(_estimate_nbytes(v) for k, v in ctx.items() if k not in _SHARED_KEYS)
+        with self._lock:
+            self._entries[key] = (ctx, nbytes)
+            self._total_bytes += nbytes
+            # LRU 淘汰，至少保留刚放进去的这一个
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_bytes
+                self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "inflight": len(self._inflight),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+
+# 进程级单例
+_shared_cache = SharedContextCache()
+
+
+def get_shared_cache() -> SharedContextCache:
+    return _shared_cache
+
+
+# ============================================================
+# PUBLIC: get_context
+# ============================================================
+
+def get_context(df_all: pd.DataFrame,
+                df_policy: pd.DataFrame,
+                selected_date,
+                data_fp: str = None) -> Mapping:
+    """
+    engine.build_context 的共享缓存版本，app.py 用它替代直接调用。
+
+    同一份数据 + 同一个日期在整个进程里只计算一次；返回的 ctx 是只读的，
+    所有 session 共享同一个对象。进程内未命中时先尝试从磁盘恢复，
+    磁盘也没有才真正计算，并把结果写回磁盘。
+    """
+    if data_fp is None:
+        data_fp = engine.data_fingerprint(df_all, df_policy)
+    key = engine.context_fingerprint(df_all, df_policy, selected_date, data_fp)
+
+    def _load_or_build() -> dict:
+        ctx = context_store.load_context(key, df_all, df_policy)
+        if ctx is None:
+            ctx = engine.build_context(df_all, df_policy, selected_date, data_fp)
+            context_store.save_context(key, ctx)
+        return ctx
+
+    return _shared_cache.get_or_build(key, _load_or_build)
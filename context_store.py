@@ -0,0 +1,247 @@
+"""
+context_store.py — ctx 磁盘持久化缓存（重启 / 重新部署后秒级恢复）
+
+背景:
+    context_cache 是进程内缓存，每次 deploy / pod 重启都会清空，
+    重启后的第一批用户要等所有 ctx 和 time series 重新计算。
+
+设计:
+    - 目录 key: context_fingerprint = ENGINE_VERSION + 数据文件 hash + 政策文件 hash + 日期
+    - DataFrame → Arrow IPC 文件（未压缩，读取时 memory-map，不需要解析）
+    - dict of ndarray（stress_basis）→ 同样一张 Arrow 表；2-D 数组（如 krd_pnl_1bp）拆成 col[j] 列，
+      读回时重新拼成 C 连续矩阵
+    - 标量 / 字符串 / 日期列表 → meta.json
+    - 写入先落到临时目录再 rename，多进程同时写也不会读到半成品
+    - df_all / df_policy 是原始输入，不落盘，加载时直接挂回
+    - 目录有上限: 每次写入新 ctx 后删掉 ENGINE_VERSION 不同的旧条目（升级后永远不会再命中），
+      其余按最近使用时间（命中时刷新目录 mtime）淘汰到 CONTEXT_STORE_MAX_BYTES 以内，
+      和 context_cache 的进程内上限一样有界
+
+对外暴露:
+    source_fingerprint(positions_path, policy_path) → str
+    load_context(key, df_all, df_policy) → ctx | None
+    save_context(key, ctx)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import engine
+
+
+CONTEXT_STORE_DIR = Path(__file__).resolve().parent / ".cache" / "contexts"
+
+# 磁盘上所有 ctx 目录的总大小上限
+CONTEXT_STORE_MAX_BYTES = int(os.environ.get("CONTEXT_STORE_MAX_BYTES", 256 * 1024 * 1024))
+
+_logger = logging.getLogger(__name__)
+
+# 原始输入，不落盘
+_PASSTHROUGH_KEYS = ('df_all', 'df_policy')
+
+
+# ============================================================
+# 文件指纹
+# ============================================================
+
+def _file_sha1(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_fingerprint(positions_path: Path, policy_path: Path) -> str:
+    """
+    数据文件 + 政策文件的内容 hash，作为 engine.context_fingerprint 的 data_fp。
+    直接 hash 文件字节，不需要先 hash 整个 DataFrame。
+    """
+    key = f"{_file_sha1(positions_path)}|{_file_sha1(policy_path)}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+# ============================================================
+# Arrow IPC 读写
+# ============================================================
+
+def _write_frame(path: Path, df: pd.DataFrame):
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def _read_frame(path: Path) -> pd.DataFrame:
+    # memory_map: 数据页按需从 page cache 映射进来，数值列 to_pandas 时可零拷贝
+    with pa.memory_map(str(path), "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def _to_json_value(value):
+    """标量转成 JSON 可存的值，返回 (type_tag, json_value)"""
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return "timestamp", pd.Timestamp(value).isoformat()
+    if isinstance(value, (np.floating, float)):
+        return "float", float(value)
+    if isinstance(value, (np.integer, int)):
+        return "int", int(value)
+    if isinstance(value, (list, tuple)) and all(isinstance(v, (pd.Timestamp, np.datetime64)) for v in value):
+        return "timestamp_list", [pd.Timestamp(v).isoformat() for v in value]
+    return "raw", value
+
+
+def _from_json_value(tag: str, value):
+    if tag == "timestamp":
+        return pd.Timestamp(value)
+    if tag == "timestamp_list":
+        return [pd.Timestamp(v) for v in value]
+    return value
+
+
+# ============================================================
+# 淘汰
+# ============================================================
+
+def _dir_bytes(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+
+
+def _entry_version(path: Path) -> Optional[str]:
+    try:
+        with open(path / "meta.json", encoding="utf-8") as f:
+            return json.load(f).get("engine_version")
+    except (OSError, ValueError):
+        return None
+
+
+def _prune(store_dir: Path, keep: str, max_bytes: int):
+    """
+    删除 ENGINE_VERSION 不同（或 meta 损坏）的条目，再按目录 mtime 从旧到新删到 max_bytes 以内。
+    keep（刚写入的条目）不删；临时目录（.<key>-*）属于正在写入的进程，不碰。
+    """
+    entries = []
+    for path in store_dir.iterdir():
+        if not path.is_dir() or path.name.startswith(".") or path.name == keep:
+            continue
+        if _entry_version(path) != engine.ENGINE_VERSION:
+            shutil.rmtree(path, ignore_errors=True)
+            continue
+        entries.append((path.stat().st_mtime, _dir_bytes(path), path))
+
+    total = _dir_bytes(store_dir / keep) + sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+# ============================================================
+# PUBLIC: save_context / load_context
+# ============================================================
+
+def save_context(key: str, ctx, store_dir: Path = CONTEXT_STORE_DIR,
+                 max_bytes: int = CONTEXT_STORE_MAX_BYTES):
+    """
+    把 ctx 写到 store_dir/<key>/，写入后按 _prune 清理旧版本和超出 max_bytes 的条目。
+    任何失败（磁盘满、权限、不能序列化的值、长度不一的 dict）都只记 warning 并清理临时目录:
+    磁盘缓存只是加速，不能影响主流程。
+    """
+    final_dir = store_dir / key
+    if final_dir.exists():
+        return
+
+    tmp_dir = None
+    try:
+        store_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(prefix=f".{key}-", dir=store_dir))
+
+        meta = {"engine_version": engine.ENGINE_VERSION, "frames": [], "arrays": {}, "matrices": {},
+                "scalars": {}}
+        for name, value in ctx.items():
+            if name in _PASSTHROUGH_KEYS:
+                continue
+            if isinstance(value, pd.DataFrame):
+                _write_frame(tmp_dir / f"{name}.arrow", value)
+                meta["frames"].append(name)
+            elif isinstance(value, Mapping):
+                # dict of ndarray（如 stress_basis）→ 一张 Arrow 表；2-D 数组按列拆开
+                columns, widths = {}, {}
+                for col, arr in value.items():
+                    if np.ndim(arr) == 2:
+                        widths[col] = arr.shape[1]
+                        columns.update({f"{col}[{j}]": arr[:, j] for j in range(arr.shape[1])})
+                    else:
+                        columns[col] = arr
+                _write_frame(tmp_dir / f"{name}.arrow", pd.DataFrame(columns))
+                meta["arrays"][name] = list(value.keys())
+                meta["matrices"][name] = widths
+            else:
+                meta["scalars"][name] = _to_json_value(value)
+
+        with open(tmp_dir / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        os.replace(tmp_dir, final_dir)
+        tmp_dir = None
+    except Exception:
+        _logger.warning("context_store: failed to persist ctx %s", key, exc_info=True)
+        return
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    try:
+        _prune(store_dir, key, max_bytes)
+    except OSError:
+        _logger.warning("context_store: failed to prune %s", store_dir, exc_info=True)
+
+
+def load_context(key: str,
+                 df_all: pd.DataFrame,
+                 df_policy: pd.DataFrame,
+                 store_dir: Path = CONTEXT_STORE_DIR) -> Optional[dict]:
+    """
+    从 store_dir/<key>/ 恢复 ctx；不存在、版本不符或文件损坏时返回 None（调用方重新计算）。
+    """
+    ctx_dir = store_dir / key
+    meta_path = ctx_dir / "meta.json"
+    if not meta_path.exists():
+        return None
+
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("engine_version") != engine.ENGINE_VERSION:
+            return None
+
+        ctx = {'df_all': df_all, 'df_policy': df_policy}
+        for name in meta["frames"]:
+            ctx[name] = _read_frame(ctx_dir / f"{name}.arrow")
+        for name, columns in meta["arrays"].items():
+            table = _read_frame(ctx_dir / f"{name}.arrow")
+            widths = meta["matrices"].get(name, {})
+            ctx[name] = {
+                col: (np.ascontiguousarray(table[[f"{col}[{j}]" for j in range(widths[col])]].to_numpy())
+                      if col in widths else table[col].to_numpy())
+                for col in columns
+            }
+        for name, (tag, value) in meta["scalars"].items():
+            ctx[name] = _from_json_value(tag, value)
+        os.utime(ctx_dir)   # 最近使用时间，_prune 按它淘汰
+        return ctx
+    except (OSError, ValueError, KeyError, pa.ArrowException):
+        return None
@@ -0,0 +1,183 @@
+"""
+conversation_memory.py — 有上限的 Copilot 对话记忆 (滚动摘要)
+
+背景:
+    st.session_state.chat_history / lg_chat_history / gov_chat_history 是无限增长的 list，
+    分析师一整天不关页面，每个 session 都攥着全部消息；每次 rerun 还要把它们全部重新渲染。
+
+设计:
+    - 最近 CHAT_MEMORY_TURNS 轮原文保留（一轮 = 一条 user 消息 + 之后的 assistant 消息）
+    - 更早的轮次折叠进滚动摘要: 每轮一行 "Q: … → A: 首句"，本地抽取，不额外调用 LLM
+    - 摘要本身也有 token 上限，超出时丢弃最旧的摘要行，只记数量
+    - 单条消息超过 CHAT_MESSAGE_MAX_CHARS 截断，因此每个 session 的内存有确定上界
+    - token 按条增量计数（prompt_builder.count_tokens），token_count() 是 O(1)
+    - 接口与 list 兼容（append / 迭代 / len / bool），tab 里原来的写法不用改
+
+对外暴露:
+    ConversationMemory (append / clear / summary / as_prompt / token_count / stats)
+"""
+
+import os
+import re
+from collections import deque
+from typing import Deque, Iterator, List
+
+import prompt_builder
+
+
+CHAT_MEMORY_TURNS = int(os.environ.get("CHAT_MEMORY_TURNS", 8))
+CHAT_SUMMARY_MAX_TOKENS = int(os.environ.get("CHAT_SUMMARY_MAX_TOKENS", 300))
+CHAT_MESSAGE_MAX_CHARS = int(os.environ.get("CHAT_MESSAGE_MAX_CHARS", 4000))
+
+# 摘要行里问题 / 回答各保留的字符数
+_SUMMARY_QUESTION_CHARS = 120
+_SUMMARY_ANSWER_CHARS = 160
+
+_MARKDOWN_RE = re.compile(r"[*_`#>]+")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?。！？])\s")
+
+
+# ============================================================
+# 辅助函数
+# ============================================================
+
+def _plain(text: str) -> str:
+    """去掉 markdown 标记、合并空白"""
+    return " ".join(_MARKDOWN_RE.sub("", text).split())
+
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def _summarize_turn(turn: List[dict]) -> str:
+    """一轮对话 → 一行摘要: 用户问题 + 第一条回答的首句"""
+    question = next((m["content"] for m in turn if m["role"] == "user"), "")
+    answer = next((m["content"] for m in turn if m["role"] == "assistant"), "")
+    answer = _SENTENCE_END_RE.split(_plain(answer), maxsplit=1)[0] if answer else "(no answer)"
+    return (f"Q: {_clip(_plain(question), _SUMMARY_QUESTION_CHARS)}"
+            f" → A: {_clip(answer, _SUMMARY_ANSWER_CHARS)}")
+
+
+# ============================================================
+# ConversationMemory
+# ============================================================
+
+class ConversationMemory:
+    """
+    有上限的聊天记录。
+
+    append(message):
+        message 是 {"role": ..., "content": ..., ...}，其余字段原样保留；
+        user 消息开启新一轮，超过 max_turns 轮时最旧的一轮折叠进摘要
+    """
+
+    def __init__(self,
+                 max_turns: int = CHAT_MEMORY_TURNS,
+                 summary_max_tokens: int = CHAT_SUMMARY_MAX_TOKENS,
+                 message_max_chars: int = CHAT_MESSAGE_MAX_CHARS):
+        self.max_turns = max_turns
+        self.summary_max_tokens = summary_max_tokens
+        self.message_max_chars = message_max_chars
+        self.clear()
+
+    def clear(self):
+        self._messages: Deque[dict] = deque()
+        self._message_tokens: Deque[int] = deque()
+        self._summary_lines: Deque[str] = deque()
+        self._summary_line_tokens: Deque[int] = deque()
+        self._turns = 0              # 原文保留的轮数
+        self._folded_turns = 0       # 已折叠进摘要的轮数（含摘要里已丢弃的）
+        self._dropped_turns = 0      # 摘要超预算后丢弃的轮数
+        self._tokens = 0             # 原文 + 摘要的 token 总数
+
+    # ── list 兼容接口 ──
+    def append(self, message: dict):
+        content = str(message.get("content", ""))
+        if len(content) > self.message_max_chars:
+            message = {**message, "content": _clip(content, self.message_max_chars)}
+        if message.get("role") == "user":
+            self._turns += 1
+
+        tokens = prompt_builder.count_tokens(message["content"])
+        self._messages.append(message)
+        self._message_tokens.append(tokens)
+        self._tokens += tokens
+
+        while self._turns > self.max_turns:
+            self._fold_oldest_turn()
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self._messages)
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __bool__(self) -> bool:
+        return bool(self._messages) or bool(self._folded_turns)
+
+    # ── 折叠 ──
+    def _pop_message(self) -> dict:
+        self._tokens -= self._message_tokens.popleft()
+        return self._messages.popleft()
+
+    def _fold_oldest_turn(self):
+        """弹出最旧的一轮（到下一条 user 消息为止），写成一行摘要"""
+        turn = [self._pop_message()]
+        while self._messages and self._messages[0].get("role") != "user":
+            turn.append(self._pop_message())
+        if turn[0].get("role") == "user":
+            self._turns -= 1
+
+        line = _summarize_turn(turn)
+        tokens = prompt_builder.count_tokens(line)
+        self._summary_lines.append(line)
+        self._summary_line_tokens.append(tokens)
+        self._tokens += tokens
+        self._folded_turns += 1
+
+        summary_tokens = sum(self._summary_line_tokens)
+        while summary_tokens > self.summary_max_tokens and len(self._summary_lines) > 1:
+            self._summary_lines.popleft()
+            dropped = self._summary_line_tokens.popleft()
+            summary_tokens -= dropped
+            self._tokens -= dropped
+            self._dropped_turns += 1
+
+    # ── 读取 ──
+    @property
+    def folded_turns(self) -> int:
+        return self._folded_turns
+
+    @property
+    def summary(self) -> str:
+        """折叠轮次的滚动摘要；没有折叠过时为空字符串"""
+        if not self._summary_lines:
+            return ""
+        lines = list(self._summary_lines)
+        if self._dropped_turns:
+            lines.insert(0, f"({self._dropped_turns} earlier turns omitted)")
+        return "\n".join(lines)
+
+    def as_prompt(self) -> str:
+        """摘要 + 最近几轮原文，可直接拼进 prompt 的对话上下文"""
+        parts = []
+        if self._summary_lines:
+            parts.append("Earlier conversation (summary):\n" + self.summary)
+        if self._messages:
+            parts.append("\n".join(f"{m['role']}: {m['content']}" for m in self._messages))
+        return "\n\n".join(parts)
+
+    def token_count(self) -> int:
+        """历史（摘要 + 原文）贡献的 token 数"""
+        return self._tokens
+
+    def stats(self) -> dict:
+        return {
+            "messages": len(self._messages),
+            "turns": self._turns,
+            "folded_turns": self._folded_turns,
+            "dropped_turns": self._dropped_turns,
+            "tokens": self._tokens,
+            "chars": sum(len(m["content"]) for m in self._messages) + sum(len(l) for l in self._summary_lines),
+        }
@@ -0,0 +1,182 @@
+"""
+cov_service.py — 因子协方差服务（EWMA 增量更新，随 ctx 缓存）
+
+背景:
+    分布型风险指标（参数法 VaR、Monte Carlo、对冲前后的盈余波动、情景严重度）
+    都需要 利率 / 权益 / 通胀 三个因子的协方差矩阵。每次请求都从全量历史重新估计
+    不可扩展: 历史每多一天，全部重算一遍。
+
+设计:
+    - 因子日变动来自 var_engine.factor_moves（已按 data_fp 缓存），单位 bp / % / %
+    - 估计量: 零均值 EWMA（RiskMetrics），每来一天只做一步 O(1) 递推
+          Σ_t = λ Σ_t-1 + (1 − λ) r_t r_tᵀ
+      前 COV_WARMUP 天用等权二阶矩 Σ_t = (n Σ_t-1 + r_t r_tᵀ) / (n + 1) 起步，
+      避免用单个观测的外积当初值
+    - FactorCovarianceService 保存整条 Σ_t 路径（T×3×3）:
+        update(moves_df) 找出与已保存历史相同的最长前缀（日期 + 变动都一致），
+        只从第一个不同的日期往后递推 → 新增一天只算一步；数据被改写时从改写点回退重算
+    - 进程级单例，所有 session / 所有日期的 ctx 共享同一条路径
+    - build_context 把 selected_date 当天的 Σ（日度）写进 ctx['factor_cov_df']，
+      随 ctx 一起被 context_cache / context_store 缓存；下游用 cov_from_ctx 取矩阵并按
+      平方根法则换算到需要的期限
+
+对外暴露:
+    COV_EWMA_LAMBDA / COV_WARMUP / COV_ANNUALIZATION_DAYS
+    ewma_step(cov, move, n_obs, lam, warmup) → ndarray
+    FactorCovarianceService (update / covariance / stats)
+    get_service() → 进程级单例
+    to_frame(cov) → DataFrame
+    cov_from_ctx(ctx, horizon_days) → ndarray | None
+    scenario_sigma(ctx, shocks, horizon_days) → float | None
+"""
+
+import os
+import threading
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from var_engine import FACTOR_COLUMNS
+
+
+# RiskMetrics 日度衰减因子
+COV_EWMA_LAMBDA = float(os.environ.get("COV_EWMA_LAMBDA", 0.94))
+
+# 前 N 个观测用等权二阶矩起步
+COV_WARMUP = int(os.environ.get("COV_WARMUP", 20))
+
+# 日度 → 年度的换算天数
+COV_ANNUALIZATION_DAYS = 252
+
+
+# ============================================================
+# EWMA 递推
+# ============================================================
+
+def ewma_step(cov: np.ndarray,
+              move: np.ndarray,
+              n_obs: int,
+              lam: float = COV_EWMA_LAMBDA,
+              warmup: int = COV_WARMUP) -> np.ndarray:
+    """
+    加入一天的因子变动 move (3,)，返回新的协方差。
+
+    n_obs: cov 已经包含的观测数（warmup 内按等权平均）
+    """
+    outer = np.outer(move, move)
+    if n_obs < warmup:
+        return (n_obs * cov + outer) / (n_obs + 1)
+    return lam * cov + (1.0 - lam) * outer
+
+
+# ============================================================
+# FactorCovarianceService
+# ============================================================
+
+class FactorCovarianceService:
+    """保存 EWMA 协方差路径；历史变长时只递推新增的日期"""
+
+    def __init__(self, lam: float = COV_EWMA_LAMBDA, warmup: int = COV_WARMUP):
+        self.lam = lam
+        self.warmup = warmup
+        self._lock = threading.Lock()
+        self._dates = np.empty(0, dtype="datetime64[ns]")
+        self._moves = np.empty((0, 3))
+        self._covs = np.empty((0, 3, 3))
+        self._stats = {"updates": 0, "steps": 0, "reused": 0, "rewinds": 0}
+
+    def update(self, moves_df: pd.DataFrame) -> int:
+        """
+        同步到 moves_df（var_engine.factor_moves 的输出），返回本次新递推的天数。
+        """
+        dates = moves_df['date'].to_numpy(dtype="datetime64[ns]")
+        values = moves_df[FACTOR_COLUMNS].to_numpy(dtype=float)
+
+        with self._lock:
+            # 与已保存历史相同的最长前缀
+            n_common = min(len(self._dates), len(dates))
+            same = ((self._dates[:n_common] == dates[:n_common])
+                    & (self._moves[:n_common] == values[:n_common]).all(axis=1))
+            keep = n_common if same.all() else int(np.argmin(same))
+            if keep < len(self._dates):
+                self._stats["rewinds"] += 1
+
+            new_covs = np.empty((len(dates) - keep, 3, 3))
+            cov = self._covs[keep - 1] if keep else np.zeros((3, 3))
+            for i, move in enumerate(values[keep:]):
+                cov = ewma_step(cov, move, keep + i, self.lam, self.warmup)
+                new_covs[i] = cov
+
+            self._dates = dates
+            self._moves = values
+            self._covs = np.concatenate([self._covs[:keep], new_covs])
+            self._stats["updates"] += 1
+            self._stats["steps"] += len(new_covs)
+            self._stats["reused"] += keep
+            return len(new_covs)
+
+    def covariance(self, moves_df: pd.DataFrame, as_of=None) -> Tuple[Optional[np.ndarray], int]:
+        """
+        先 update(moves_df)，再取 as_of 当天（含）的日度协方差。
+
+        返回 (cov, n_obs)；as_of 之前没有任何观测时为 (None, 0)
+        """
+        self.update(moves_df)
+        with self._lock:
+            if as_of is None:
+                idx = len(self._dates) - 1
+            else:
+                idx = int(np.searchsorted(self._dates, np.datetime64(pd.Timestamp(as_of)), side="right")) - 1
+            if idx < 0:
+                return None, 0
+            return self._covs[idx].copy(), idx + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "dates": len(self._dates)}
+
+
+# 进程级单例
+_service = FactorCovarianceService()
+
+
+def get_service() -> FactorCovarianceService:
+    return _service
+
+
+# ============================================================
+# ctx 读写
+# ============================================================
+
+def to_frame(cov: Optional[np.ndarray]) -> pd.DataFrame:
+    """3×3 协方差 → ctx 里的 DataFrame（factor | rate_bp | equity_pct | inflation_pct）；None → 全 NaN"""
+    values = np.full((3, 3), np.nan) if cov is None else cov
+    frame = pd.DataFrame(values, columns=FACTOR_COLUMNS)
+    frame.insert(0, 'factor', FACTOR_COLUMNS)
+    return frame
+
+
+def cov_from_ctx(ctx: dict, horizon_days: float = 1) -> Optional[np.ndarray]:
+    """ctx['factor_cov_df'] → 3×3 矩阵，按平方根法则换算到 horizon_days；没有估计时返回 None"""
+    frame = ctx.get('factor_cov_df') if hasattr(ctx, 'get') else None
+    if frame is None:
+        return None
+    cov = frame[FACTOR_COLUMNS].to_numpy(dtype=float)
+    if not np.isfinite(cov).all():
+        return None
+    return cov * horizon_days
+
+
+def scenario_sigma(ctx: dict,
+                   shocks: Sequence[float],
+                   horizon_days: float = COV_ANNUALIZATION_DAYS) -> Optional[float]:
+    """
+    情景的严重度: 冲击向量（bp / % / %）在 horizon_days 期协方差下的 Mahalanobis 距离。
+    3 表示约 3 个标准差；没有协方差估计时返回 None
+    """
+    cov = cov_from_ctx(ctx, horizon_days)
+    if cov is None:
+        return None
+    x = np.asarray(shocks, dtype=float)
+    return float(np.sqrt(max(x @ np.linalg.pinv(cov) @ x, 0.0)))
@@ -0,0 +1,122 @@
+"""
+curve_engine.py — 关键期限久期（KRD）与非平行收益率曲线情景
+
+背景:
+    stress 模型原来每个仓位只有一个 duration（负债两行: 14.5 / 11.2），只能表达平行移动。
+    资产久期集中在 5–10 年、负债集中在 10–30 年，曲线扭转 / 陡峭化对盈余的影响
+    恰恰来自两边在不同期限上的错配，单一久期看不到。
+
+设计:
+    - 关键期限 KEY_RATE_TENORS = 2y / 5y / 10y / 20y / 30y，仓位数据多 5 列 KRD_COLUMNS，
+      每行 KRD 之和 = 该行 duration（平行移动的结果与原来一致）
+    - krd_matrix(df) 取成一块 C 连续的 (N, 5) float64 数组；数据里没有 KRD 列（旧数据文件）时
+      用 key_rate_profile(duration) 现场展开，下游不需要区分
+    - key_rate_profile: 把久期 D 看成期限 0.5D / D / 1.5D 的三笔零息现金流（市值占 25% / 50% / 25%，
+      平均期限 = D），每笔的久期贡献 = 市值占比 × 期限，按期限线性分到相邻两个关键期限上
+      （短于 2y 全归 2y，长于 30y 全归 30y）；
+      generate_data 也用它生成 KRD 列，两边口径一致
+    - 曲线情景 = 每个关键期限上的 bp 移动（5,），叠加在平行 rate shock 上:
+          仓位 P&L = krd_pnl_1bp (N, 5) @ shifts (5,)
+      CURVE_SCENARIOS 全部情景一次算完: 先按 资产 / 负债 汇总成 (5, 2)，再 (S, 5) @ (5, 2)
+
+对外暴露:
+    KEY_RATE_TENORS / KRD_COLUMNS / CURVE_SCENARIOS
+    key_rate_profile(duration) → ndarray (N, 5)
+    krd_matrix(df) → ndarray (N, 5)
+    key_rate_sensitivities(basis) → ndarray (5, 2)
+    scenario_table(basis, total_assets, total_liabilities, scenarios) → DataFrame
+"""
+
+from typing import Mapping, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+KEY_RATE_TENORS = (2, 5, 10, 20, 30)
+
+KRD_COLUMNS = [f"krd_{t}y" for t in KEY_RATE_TENORS]
+
+# 久期 D 展开成的零息现金流阶梯: (期限 / D, 市值占比)
+KRD_LADDER = ((0.5, 0.25), (1.0, 0.5), (1.5, 0.25))
+
+# 非平行情景: 各关键期限的 bp 移动（顺序同 KEY_RATE_TENORS），平行部分仍由 rate shock 给出
+CURVE_SCENARIOS = {
+    "Steepening Twist (10y pivot)": (-50, -25, 0, 25, 50),
+    "Flattening Twist (10y pivot)": (50, 25, 0, -25, -50),
+    "Bear Steepener":               (0, 15, 40, 70, 80),
+    "Bull Flattener":               (0, -15, -40, -70, -80),
+}
+
+
+# ============================================================
+# PUBLIC: key_rate_profile / krd_matrix
+# ============================================================
+
+def key_rate_profile(duration) -> np.ndarray:
+    """
+    单一久期 → 关键期限久期 (N, 5)，每行之和 = duration。
+    duration ≤ 0 的行（股票等）全部落在 2y 上，之和仍等于 duration。
+    """
+    d = np.asarray(duration, dtype=float).reshape(-1)
+    tenors = np.asarray(KEY_RATE_TENORS, dtype=float)
+    rows = np.arange(len(d))
+    out = np.zeros((len(d), len(tenors)))
+
+    for scale, share in KRD_LADDER:
+        maturity = d * scale
+        pos = np.clip(maturity, tenors[0], tenors[-1])
+        left = np.clip(np.searchsorted(tenors, pos, side='right') - 1, 0, len(tenors) - 2)
+        frac = (pos - tenors[left]) / (tenors[left + 1] - tenors[left])
+        amount = share * maturity
+        out[rows, left] += amount * (1.0 - frac)
+        out[rows, left + 1] += amount * frac
+    return out
+
+
+def krd_matrix(df: pd.DataFrame) -> np.ndarray:
+    """仓位 DataFrame → C 连续的 (N, 5) KRD 数组；缺 KRD 列时由 duration 展开"""
+    if all(col in df.columns for col in KRD_COLUMNS):
+        return np.ascontiguousarray(df[KRD_COLUMNS].to_numpy(dtype=float))
+    return key_rate_profile(df['duration'].to_numpy(dtype=float))
+
+
+# ============================================================
+# PUBLIC: key_rate_sensitivities / scenario_table
+# ============================================================
+
+def key_rate_sensitivities(basis: dict) -> np.ndarray:
+    """
+    build_stress_basis 的 krd_pnl_1bp 按 资产 / 负债 汇总: (5, 2)，
+    行 = KEY_RATE_TENORS（该期限 +1bp 的 P&L），列 = [资产, 负债]。
+    """
+    is_asset = np.asarray(basis['is_asset'], dtype=bool)
+    side = np.column_stack([is_asset, ~is_asset]).astype(float)   # (N, 2)
+    return basis['krd_pnl_1bp'].T @ side
+
+
+def scenario_table(basis: dict,
+                   total_assets: float,
+                   total_liabilities: float,
+                   scenarios: Mapping[str, Sequence[float]] = CURVE_SCENARIOS) -> pd.DataFrame:
+    """
+    全部曲线情景一次矩阵乘法:
+        scenario | shift_2y … shift_30y | asset_pnl | liability_change | surplus_pnl | funded_status
+    liability_change 为负债现值（正数口径）的变化；按 surplus_pnl 升序（最差在前）。
+    """
+    names = list(scenarios)
+    shifts = np.asarray([scenarios[n] for n in names], dtype=float).reshape(len(names), len(KEY_RATE_TENORS))
+    pnl = shifts @ key_rate_sensitivities(basis)                  # (S, 2)
+
+    assets_after = total_assets + pnl[:, 0]
+    liabilities_after = np.abs(-total_liabilities + pnl[:, 1])
+    surplus_before = total_assets - total_liabilities
+
+    table = pd.DataFrame(shifts, columns=[f"shift_{t}y" for t in KEY_RATE_TENORS])
+    table.insert(0, 'scenario', names)
+    table['asset_pnl'] = pnl[:, 0]
+    table['liability_change'] = liabilities_after - total_liabilities
+    table['surplus_pnl'] = assets_after - liabilities_after - surplus_before
+    table['funded_status'] = np.divide(assets_after, liabilities_after,
+                                       out=np.zeros_like(assets_after), where=liabilities_after != 0)
+    return table.sort_values('surplus_pnl', ignore_index=True)
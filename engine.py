@@ -1,25 +1,49 @@
 """
 engine.py — HOOPP Risk Navigator 核心计算引擎
 
-对外暴露两个入口：
-    calculate_metrics(df_in, s_rate, s_eq, s_inf) → df_stressed
-        Tab4 Stress Testing 用，slider 变化时实时调用
+对外暴露的入口：
+    calculate_metrics(df_in, s_rate, s_eq, s_inf, curve) → df_stressed
+        DataFrame 版 stress 计算（time series / baseline 用）
+
+    build_stress_basis(df_day) → basis (dict of ndarray)
+    apply_stress(basis, s_rate, s_eq, s_inf, curve) → dict
+        Tab3 Stress Testing 用：basis 随 ctx 预计算一次，slider 变化时只做向量运算
 
     build_context(df_all, df_policy, selected_date) → ctx (dict)
         app.py 调用一次，返回所有 Tab 需要的数据
 
+    data_fingerprint(df_all, df_policy) → str
+    context_fingerprint(df_all, df_policy, selected_date, data_fp) → str
+        数据 / ctx 的内容指纹（数据 + 日期 + ENGINE_VERSION），下游缓存的 key
+
 内部按 Layer 分层计算，不跳层：
     Layer 0  原始数据
     Layer 1  日期过滤
     Layer 2  Baseline stress（shock 全 0）
     Layer 3  KPI 标量
-    Layer 4  派生表（comp_df, limits_df, issuer_df, fx）
+    Layer 4  派生表（comp_df, limits_df, issuer_df, fx, 历史模拟 VaR / ES, 因子协方差, 风险贡献, 曲线情景）
     Layer 5  时间序列 + AI summary
+
+利率敏感度按关键期限久期（curve_engine，2y / 5y / 10y / 20y / 30y）计算，
+平行 rate shock 与非平行曲线移动走同一个 (N, 5) 矩阵。
 """
 
+import hashlib
+from typing import Optional, Sequence
+
 import pandas as pd
 import numpy as np
 
+import cov_service
+import curve_engine
+import prompt_builder
+import risk_attribution
+import var_engine
+
+
+# 计算逻辑有变化时递增，让所有按指纹缓存的结果（图表、ctx 等）自动失效
+ENGINE_VERSION = "1.5"
+
 
 # ============================================================
 # PUBLIC: calculate_metrics
@@ -28,7 +52,8 @@ import numpy as np
 def calculate_metrics(df_in: pd.DataFrame,
                       s_rate: float,
                       s_eq: float,
-                      s_inf: float) -> pd.DataFrame:
+                      s_inf: float,
+                      curve: Optional[Sequence[float]] = None) -> pd.DataFrame:
     """
     对一天的仓位数据执行 Scheme A stress 计算。
 
@@ -37,16 +62,23 @@ def calculate_metrics(df_in: pd.DataFrame,
         s_rate  : 利率冲击 (bps)，如 +50 表示利率上升 50bp
         s_eq    : 权益冲击 (%)，如 -10 表示股市跌 10%
         s_inf   : 通胀冲击 (%)，如 +1 表示通胀预期上升 1%
+        curve   : 可选，各关键期限在平行移动之外的 bp 移动（5,，顺序同 curve_engine.KEY_RATE_TENORS）
 
     返回:
         带新列 'mtm_stressed' 的 DataFrame
         mtm_stressed = mtm_cad + PnL
         PnL = market_exposure_cad × (rate_impact + equity_impact + inf_impact)
+        rate_impact = −KRD (N, 5) @ 各期限利率移动 / 10,000
     """
     df = df_in.copy()
 
+    # 各关键期限的利率移动: 平行 + 曲线形状
+    shifts = np.full(len(curve_engine.KEY_RATE_TENORS), float(s_rate))
+    if curve is not None:
+        shifts += np.asarray(curve, dtype=float)
+
     # 三个独立风险因子的 P&L%
-    rate_impact   = -1.0 * df['duration']        * (s_rate / 10_000)  # bps → 小数
+    rate_impact   = -1.0 * (curve_engine.krd_matrix(df) @ shifts) / 10_000  # bps → 小数
     equity_impact =        df['equity_beta']     * (s_eq   / 100)     # % → 小数
     inf_impact    =        df['inflation_beta']  * (s_inf  / 100)     # % → 小数
 
@@ -59,15 +91,126 @@ def calculate_metrics(df_in: pd.DataFrame,
     return df
 
 
+# ============================================================
+# PUBLIC: build_stress_basis / apply_stress
+# ============================================================
+
+def build_stress_basis(df_day: pd.DataFrame) -> dict:
+    """
+    把单日仓位预处理成 stress 用的 numpy 数组（每个因子 1 单位冲击的 P&L）。
+
+    和 calculate_metrics 同一套 Scheme A 线性模型，只是把
+    market_exposure_cad × sensitivity 提前乘好，slider 变化时不需要
+    再 copy DataFrame，只剩 3 次向量乘加。
+
+    返回:
+        is_asset        : bool 数组，Asset 行为 True
+        asset_name      : 仓位名称（Top Movers 用）
+        asset_class     : 资产类别（Top Movers 用）
+        mtm             : baseline mtm_cad
+        krd_pnl_1bp     : (N, 5) 各关键期限 +1bp 的 P&L（C 连续）
+        rate_pnl_1bp    : 利率平行 +1bp 的 P&L（krd_pnl_1bp 按行求和）
+        equity_pnl_1pct : 权益 +1% 的 P&L
+        infl_pnl_1pct   : 通胀 +1% 的 P&L
+    """
+    exposure = df_day['market_exposure_cad'].to_numpy(dtype=float)
+    krd_pnl = -exposure[:, None] * curve_engine.krd_matrix(df_day) / 10_000
+    return {
+        'is_asset':        (df_day['plan_category'] == 'Asset').to_numpy(),
+        'asset_name':      df_day['asset_name'].to_numpy(),
+        'asset_class':     df_day['asset_class'].to_numpy(),
+        'mtm':             df_day['mtm_cad'].to_numpy(dtype=float),
+        'krd_pnl_1bp':     krd_pnl,
+        'rate_pnl_1bp':    krd_pnl.sum(axis=1),
+        'equity_pnl_1pct': exposure * df_day['equity_beta'].to_numpy(dtype=float) / 100,
+        'infl_pnl_1pct':   exposure * df_day['inflation_beta'].to_numpy(dtype=float) / 100,
+    }
+
+
+def apply_stress(basis: dict,
+                 s_rate: float,
+                 s_eq: float,
+                 s_inf: float,
+                 curve: Optional[Sequence[float]] = None) -> dict:
+    """
+    在预计算的 basis 上执行 stress，返回 Tab3 需要的全部数值。
+
+    参数单位与 calculate_metrics 一致（bps / % / %，curve 为各关键期限的额外 bp 移动）。
+
+    返回:
+        stressed_assets / stressed_liabilities / stressed_funded / stressed_surplus
+        rate_pnl / equity_pnl / inflation_pnl : 资产端按因子拆分的 P&L（瀑布图用，rate 含曲线形状）
+        position_pnl                          : 每个仓位的 P&L 数组
+    """
+    rate_pnl   = basis['rate_pnl_1bp']    * s_rate
+    if curve is not None:
+        rate_pnl = rate_pnl + basis['krd_pnl_1bp'] @ np.asarray(curve, dtype=float)
+    equity_pnl = basis['equity_pnl_1pct'] * s_eq
+    infl_pnl   = basis['infl_pnl_1pct']   * s_inf
+    position_pnl = rate_pnl + equity_pnl + infl_pnl
+
+    is_asset = basis['is_asset']
+    mtm_stressed = basis['mtm'] + position_pnl
+
+    stressed_assets      = mtm_stressed[is_asset].sum()
+    stressed_liabilities = abs(mtm_stressed[~is_asset].sum())
+
+    return {
+        'stressed_assets':      stressed_assets,
+        'stressed_liabilities': stressed_liabilities,
+        'stressed_funded':      stressed_assets / stressed_liabilities if stressed_liabilities != 0 else 0,
+        'stressed_surplus':     stressed_assets - stressed_liabilities,
+        'rate_pnl':             rate_pnl[is_asset].sum(),
+        'equity_pnl':           equity_pnl[is_asset].sum(),
+        'inflation_pnl':        infl_pnl[is_asset].sum(),
+        'position_pnl':         position_pnl,
+    }
+
+
+# ============================================================
+# PUBLIC: data_fingerprint / context_fingerprint
+# ============================================================
+
+def data_fingerprint(df_all: pd.DataFrame, df_policy: pd.DataFrame) -> str:
+    """
+    原始数据（仓位 + 政策表）的内容指纹。
+    数据只在加载时变化，app.py 算一次后传给 context_fingerprint / build_context，
+    避免每次 rerun 都重新 hash 全量 df_all。
+    """
+    h = hashlib.sha1()
+    h.update(pd.util.hash_pandas_object(df_all, index=False).to_numpy().tobytes())
+    h.update(pd.util.hash_pandas_object(df_policy, index=False).to_numpy().tobytes())
+    return h.hexdigest()[:16]
+
+
+def context_fingerprint(df_all: pd.DataFrame,
+                        df_policy: pd.DataFrame,
+                        selected_date,
+                        data_fp: str = None) -> str:
+    """
+    ctx 的内容指纹: 同样的数据 + 同样的日期 + 同样的 ENGINE_VERSION → 同一个指纹。
+
+    下游缓存（图表、共享 ctx 等）都以它为 key，不依赖 session，
+    所以不同用户查看同一天时可以共享缓存。
+    """
+    if data_fp is None:
+        data_fp = data_fingerprint(df_all, df_policy)
+    key = f"{ENGINE_VERSION}|{data_fp}|{pd.Timestamp(selected_date).date()}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
 # ============================================================
 # PUBLIC: build_context
 # ============================================================
 
 def build_context(df_all: pd.DataFrame,
                   df_policy: pd.DataFrame,
-                  selected_date: str) -> dict:
+                  selected_date: str,
+                  data_fp: str = None) -> dict:
     """
     app.py 的唯一入口。返回 ctx dict，所有 Tab 从这里取数据。
+
+    data_fp: 可选，预先算好的 data_fingerprint，省掉一次全量 hash
     """
     ctx = {}
 
@@ -78,6 +221,8 @@ def build_context(df_all: pd.DataFrame,
     # ─── Layer 1: 日期过滤 ───
     df_day = df_all[df_all['timestamp'] == selected_date].copy()
     ctx['df_day'] = df_day          # Tab4 Stress 用（未 stress 的原始数据）
+    ctx['selected_date'] = selected_date
+    ctx['fingerprint']   = context_fingerprint(df_all, df_policy, selected_date, data_fp)
 
     # ─── Layer 2: Baseline（shock 全 0，算出 mtm_stressed = mtm_cad） ───
     df_baseline = calculate_metrics(df_day, 0, 0, 0)
@@ -88,6 +233,9 @@ def build_context(df_all: pd.DataFrame,
     ctx['assets']      = assets
     ctx['liabilities'] = liabilities
 
+    # Tab3 Stress 的 slider 只在这份预计算数组上做向量运算
+    ctx['stress_basis'] = build_stress_basis(df_day)
+
     # ─── Layer 3: KPI 标量 ───
     kpis = _build_kpis(assets, liabilities)
     ctx.update(kpis)
@@ -110,7 +258,29 @@ def build_context(df_all: pd.DataFrame,
     issuer_df = _build_issuer_df(assets, kpis['total_assets'])
     ctx['issuer_df'] = issuer_df                      # Tab2 Top5 表
 
-    # ─── sidebar（放在 ai_summary 之前，因为 summary 要用 available_dates） ───
+    # 历史模拟: 截至 selected_date 的每日因子变动作用在当日敏感度上
+    moves_df = var_engine.factor_moves(df_all, data_fp)
+    surplus_var_df, var_scenarios_df = var_engine.historical_var(
+        ctx['stress_basis'], moves_df, as_of=selected_date)
+    ctx['surplus_var_df']   = surplus_var_df          # Copilot get_surplus_var
+    ctx['var_scenarios_df'] = var_scenarios_df        # 情景级 P&L（最差情景）
+
+    # 截至 selected_date 的 EWMA 因子协方差（日度），压力 / VaR / 对冲工具共用
+    factor_cov, n_obs = cov_service.get_service().covariance(moves_df, as_of=selected_date)
+    ctx['factor_cov_df']    = cov_service.to_frame(factor_cov)
+    ctx['factor_cov_n_obs'] = n_obs
+
+    # 盈余波动的 Euler 分解（asset_class / sector / currency），成分贡献之和 = σ
+    attribution_df = risk_attribution.attribution_table(df_day, ctx['stress_basis'], factor_cov)
+    ctx['risk_attribution_df'] = attribution_df       # Tab1 风险贡献表 / Copilot get_risk_attribution
+    ctx['surplus_vol_1d'] = float(
+        attribution_df.loc[attribution_df['dimension'] == 'asset_class', 'component'].sum())
+
+    # 非平行曲线情景（扭转 / 陡峭化），全部情景一次矩阵乘法
+    ctx['curve_scenarios_df'] = curve_engine.scenario_table(
+        ctx['stress_basis'], kpis['total_assets'], kpis['total_liabilities'])   # Tab3 曲线情景表
+
+    # ─── sidebar ───
     ctx['available_dates'] = sorted(df_all['timestamp'].unique())
 
     # ─── Layer 5: 时间序列 + AI summary ───
@@ -338,42 +508,7 @@ def _build_ai_summary(ctx: dict) -> str:
     把当前快照序列化为 AI prompt 用的字符串。
     Tab5 AI Advisor 直接把这个 string 塞进 system prompt，不需要自己序列化。
 
-    格式设计目标: 让 LLM 能一次性理解整个基金状态。
+    具体编码在 prompt_builder（紧凑表格 + token 预算），与 Copilot 的 system prompt 共用同一份
+    按指纹缓存的结果；快照日期取 ctx['selected_date']。
     """
-    fs   = ctx['funded_status']
-    ta   = ctx['total_assets']
-    tl   = ctx['total_liabilities']
-    surp = ctx['surplus']
-    a_d  = ctx['asset_dur']
-    l_d  = ctx['liability_dur']
-    fx   = ctx['fx_pct']
-
-    # limits_df 里有 breach 状态
-    limits = ctx['limits_df']
-    breaches = limits[limits['Status'].str.contains('BREACH')]
-    breach_list = breaches['asset_class'].tolist() if len(breaches) > 0 else ['None']
-
-    summary = f"""
-=== HOOPP Fund Snapshot ===
-Date: {ctx['available_dates'][-1] if ctx['available_dates'] else 'N/A'}
-
-Key Metrics:
-- Funded Status: {fs:.1%} (target: 111%)
-- Total Assets: ${ta/1000:.1f}B CAD
-- Total Liabilities: ${tl/1000:.1f}B CAD
-- Surplus: ${surp/1000:.1f}B CAD
-- Asset Duration: {a_d:.1f} yrs
-- Liability Duration: {l_d:.1f} yrs
-- Duration Gap: {a_d - l_d:.1f} yrs
-- FX Exposure: {fx:.1%} (limit: 15%)
-
-Compliance Breaches: {', '.join(breach_list)}
-
-Asset Allocation (Top 5 by weight):
-"""
-    # 加上前5个资产类别的权重
-    comp = ctx['comp_df'].nlargest(5, 'current_weight')
-    for _, row in comp.iterrows():
-        summary += f"- {row['asset_class']}: {row['current_weight']:.1%} (target: {row['policy_target']:.1%})\n"
-
-    return summary.strip()
+    return prompt_builder.build_prompt_context(ctx).text
@@ -0,0 +1,433 @@
+"""
+eval_runner.py — 治理版 Copilot 批量评测 (回归 + 吞吐)
+
+背景:
+    改 skills_v2 的计算、intent_router 的规则或 agent prompt 之后，只能手点几个
+    Quick Question 看答案"像不像"。工具选错、参数抽错、数值悄悄变了都发现不了，
+    也没法在大批量下看吞吐。
+
+设计:
+    - 评测集是 JSONL（默认 data/eval_queries.jsonl），每行一个用例:
+        {"id", "query", "tool", "params"}                      单工具
+        {"id", "query", "tools": [{"tool", "params"}, ...]}    复合问题
+        "expected": {tool: {字段路径: 数值}}                    工具输出的黄金值（--record 生成）
+        "as_of": "YYYY-MM-DD"                                   黄金值对应的快照日期（缺省 = 最新）
+    - 每个用例走完整的 agent_logic_gov 图（run_agent_stream / arun_agent_stream），
+      线程池或单 event loop 并发；LLM 默认是本地 stub_llm_server，--real 走真实 OpenAI
+    - 打分:
+        tool      — 选中的工具集合与期望一致
+        params    — 期望参数都抽到了（数值按 1e-6 比较）
+        numeric   — 工具输出里的数值字段逐个与黄金值比对（rtol / atol），嵌套结构按路径展开
+    - --record: 用当前代码的工具输出重写黄金值（只写工具 + 参数都正确的用例）
+    - 报告: 各项准确率、吞吐、p50 / p95 延迟、失败明细；通过率低于 --min-pass 时退出码 1（CI 用）
+
+对外暴露:
+    EVAL_QUERIES_PATH
+    EvalCase / CaseResult / EvalReport
+    load_cases(path) → List[EvalCase]
+    run_eval(cases, api_key, concurrency, mode) → EvalReport
+    record_expected(cases, report, path)
+    命令行: python eval_runner.py [queries.jsonl] --concurrency 16 [--mode async] [--real] [--record]
+"""
+
+import asyncio
+import json
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import engine
+import graph_checkpoint
+import llm_cache
+import llm_client
+import llm_gateway
+import stub_llm_server
+import tool_cache
+
+import agent_logic_gov
+
+
+EVAL_QUERIES_PATH = Path(__file__).resolve().parent / "data" / "eval_queries.jsonl"
+
+# 数值比对的默认容差
+DEFAULT_RTOL = 1e-6
+DEFAULT_ATOL = 1e-9
+
+_DATA_DIR = Path(__file__).resolve().parent / "data"
+_STUB_API_KEY = "stub"
+
+
+# ============================================================
+# 数据结构
+# ============================================================
+
+@dataclass
+class EvalCase:
+    id: str
+    query: str
+    calls: List[dict]                                   # [{"tool", "params"}]，期望的工具调用
+    expected: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    as_of: Optional[str] = None
+
+    @classmethod
+    def from_json(cls, item: dict, line_no: int) -> "EvalCase":
+        calls = item.get("tools") or [{"tool": item["tool"], "params": item.get("params", {})}]
+        return cls(
+            id=str(item.get("id", f"line-{line_no}")),
+            query=item["query"],
+            calls=[{"tool": c["tool"], "params": c.get("params", {})} for c in calls],
+            expected=item.get("expected", {}),
+            as_of=item.get("as_of"),
+        )
+
+
+@dataclass
+class CaseResult:
+    case: EvalCase
+    latency_s: float
+    actual_calls: List[dict] = field(default_factory=list)
+    outputs: Dict[str, dict] = field(default_factory=dict)     # tool → 工具输出
+    tool_ok: bool = False
+    params_ok: bool = False
+    fields_checked: int = 0
+    fields_ok: int = 0
+    mismatches: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def numeric_ok(self) -> bool:
+        return self.fields_ok == self.fields_checked
+
+    @property
+    def passed(self) -> bool:
+        return self.error is None and self.tool_ok and self.params_ok and self.numeric_ok
+
+
+@dataclass
+class EvalReport:
+    mode: str
+    concurrency: int
+    wall_s: float
+    results: List[CaseResult]
+
+    def _rate(self, ok) -> float:
+        return sum(ok(r) for r in self.results) / len(self.results) if self.results else 0.0
+
+    @property
+    def tool_accuracy(self) -> float:
+        return self._rate(lambda r: r.tool_ok)
+
+    @property
+    def params_accuracy(self) -> float:
+        return self._rate(lambda r: r.tool_ok and r.params_ok)
+
+    @property
+    def numeric_fidelity(self) -> float:
+        """所有用例里比对过的数值字段中，与黄金值一致的比例"""
+        checked = sum(r.fields_checked for r in self.results)
+        return sum(r.fields_ok for r in self.results) / checked if checked else 1.0
+
+    @property
+    def pass_rate(self) -> float:
+        return self._rate(lambda r: r.passed)
+
+    @property
+    def throughput(self) -> float:
+        return len(self.results) / self.wall_s if self.wall_s else 0.0
+
+    def latency_ms(self, pct: float) -> float:
+        return float(np.percentile([r.latency_s for r in self.results], pct) * 1000)
+
+    def failures(self) -> List[CaseResult]:
+        return [r for r in self.results if not r.passed]
+
+    def summary(self) -> dict:
+        return {
+            "cases": len(self.results),
+            "mode": self.mode,
+            "concurrency": self.concurrency,
+            "tool_accuracy": self.tool_accuracy,
+            "params_accuracy": self.params_accuracy,
+            "numeric_fidelity": self.numeric_fidelity,
+            "pass_rate": self.pass_rate,
+            "throughput": self.throughput,
+            "p50_ms": self.latency_ms(50),
+            "p95_ms": self.latency_ms(95),
+        }
+
+
+# ============================================================
+# 加载 / ctx
+# ============================================================
+
+def load_cases(path: Path = EVAL_QUERIES_PATH) -> List[EvalCase]:
+    with open(path, encoding="utf-8") as f:
+        return [EvalCase.from_json(json.loads(line), i)
+                for i, line in enumerate(f, 1) if line.strip()]
+
+
+class _ContextPool:
+    """按 as_of 日期构建并复用 ctx（一次评测里同一天只算一遍）"""
+
+    def __init__(self):
+        self.df_all = pd.read_csv(_DATA_DIR / "hoopp_positions_sample.csv", parse_dates=["timestamp"])
+        self.df_policy = pd.read_csv(_DATA_DIR / "policy_limit_management.csv")
+        self.data_fp = engine.data_fingerprint(self.df_all, self.df_policy)
+        self.latest = self.df_all["timestamp"].max()
+        self._ctx: dict = {}
+
+    def get(self, as_of: Optional[str]) -> dict:
+        date = pd.Timestamp(as_of) if as_of else self.latest
+        if date not in self._ctx:
+            self._ctx[date] = engine.build_context(self.df_all, self.df_policy, date, self.data_fp)
+        return self._ctx[date]
+
+
+# ============================================================
+# 打分
+# ============================================================
+
+def _flatten_numbers(value, prefix: str = "") -> Dict[str, float]:
+    """工具输出 → {"results.stressed_surplus": 1.2e4, "breach_details.0.current_weight": ...}"""
+    out: Dict[str, float] = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            out.update(_flatten_numbers(item, f"{prefix}{key}."))
+    elif isinstance(value, (list, tuple)):
+        for i, item in enumerate(value):
+            out.update(_flatten_numbers(item, f"{prefix}{i}."))
+    elif isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, (bool, np.bool_)):
+        if math.isfinite(float(value)):
+            out[prefix[:-1]] = float(value)
+    return out
+
+
+def _params_match(expected: dict, actual: dict) -> bool:
+    for key, value in expected.items():
+        got = actual.get(key)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            if got is None or abs(float(got) - value) > 1e-6:
+                return False
+        elif got != value:
+            return False
+    return True
+
+
+def _score(result: CaseResult, rtol: float, atol: float):
+    case = result.case
+    expected_tools = {c["tool"] for c in case.calls}
+    result.tool_ok = expected_tools == {c["tool"] for c in result.actual_calls}
+    actual_params = {c["tool"]: c["params"] for c in result.actual_calls}
+    result.params_ok = all(_params_match(c["params"], actual_params.get(c["tool"], {})) for c in case.calls)
+
+    for tool, golden in case.expected.items():
+        actual = _flatten_numbers(result.outputs.get(tool, {}))
+        for path, want in golden.items():
+            result.fields_checked += 1
+            got = actual.get(path)
+            if got is not None and math.isclose(got, want, rel_tol=rtol, abs_tol=atol):
+                result.fields_ok += 1
+            else:
+                result.mismatches.append(f"{tool}.{path}: expected {want:.6g}, got "
+                                         f"{'missing' if got is None else f'{got:.6g}'}")
+
+
+# ============================================================
+# 执行
+# ============================================================
+
+def _collect(result: CaseResult, node_name: str, state: dict):
+    if node_name == "execute":
+        result.actual_calls = [{"tool": r["tool"], "params": r["params"]} for r in state.get("tool_results", [])]
+        result.outputs = {r["tool"]: r["output"] for r in state.get("tool_results", [])}
+    errors = [s.message for s in state.get("thinking_steps", [])[-1:] if s.status == "error"]
+    if errors and result.error is None:
+        result.error = f"{node_name}: {errors[0]}"
+
+
+def _run_case(case: EvalCase, ctx: dict, api_key: str) -> CaseResult:
+    t0 = time.perf_counter()
+    result = CaseResult(case, 0.0)
+    try:
+        for node_name, state, _ in agent_logic_gov.run_agent_stream(case.query, ctx, api_key):
+            if node_name != agent_logic_gov.TOKEN_EVENT:
+                _collect(result, node_name, state)
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    result.latency_s = time.perf_counter() - t0
+    return result
+
+
+async def _arun_case(case: EvalCase, ctx: dict, api_key: str) -> CaseResult:
+    t0 = time.perf_counter()
+    result = CaseResult(case, 0.0)
+    try:
+        async for node_name, state, _ in agent_logic_gov.arun_agent_stream(case.query, ctx, api_key):
+            if node_name != agent_logic_gov.TOKEN_EVENT:
+                _collect(result, node_name, state)
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    result.latency_s = time.perf_counter() - t0
+    return result
+
+
+# ============================================================
+# PUBLIC: run_eval / record_expected
+# ============================================================
+
+def run_eval(cases: List[EvalCase],
+             api_key: str = _STUB_API_KEY,
+             concurrency: int = 16,
+             mode: str = "thread",
+             rtol: float = DEFAULT_RTOL,
+             atol: float = DEFAULT_ATOL) -> EvalReport:
+    """全部用例跑一遍治理图并打分；mode="async" 时在一个 event loop 上并发"""
+    pool = _ContextPool()
+    contexts = [pool.get(case.as_of) for case in cases]
+
+    t0 = time.perf_counter()
+    if mode == "async":
+        async def _main():
+            sem = asyncio.Semaphore(concurrency)
+
+            async def _one(case, ctx):
+                async with sem:
+                    return await _arun_case(case, ctx, api_key)
+
+            return await asyncio.gather(*(_one(c, ctx) for c, ctx in zip(cases, contexts)))
+
+        results = list(asyncio.run(_main()))
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda args: _run_case(*args, api_key), zip(cases, contexts)))
+        mode = "thread"
+    wall = time.perf_counter() - t0
+
+    for result in results:
+        _score(result, rtol, atol)
+    return EvalReport(mode, concurrency, wall, results)
+
+
+def record_expected(cases: List[EvalCase], report: EvalReport, path: Path) -> int:
+    """
+    用本次运行的工具输出重写黄金值并写回 JSONL，返回更新的用例数。
+    工具或参数不对的用例不更新（它们的输出本来就不该当作黄金值）。
+    """
+    latest = str(_ContextPool().latest.date())
+    by_id = {r.case.id: r for r in report.results}
+    updated = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for case in cases:
+            result = by_id[case.id]
+            if result.error is None and result.tool_ok and result.params_ok:
+                case.expected = {tool: _flatten_numbers(result.outputs[tool]) for tool in
+                                 dict.fromkeys(c["tool"] for c in case.calls)}
+                case.as_of = case.as_of or latest
+                updated += 1
+            item = {"id": case.id, "query": case.query}
+            if len(case.calls) == 1:
+                item.update(tool=case.calls[0]["tool"], params=case.calls[0]["params"])
+            else:
+                item["tools"] = case.calls
+            if case.expected:
+                item.update(as_of=case.as_of, expected=case.expected)
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    return updated
+
+
+def _print_report(report: EvalReport, stub_stats: Optional[dict]):
+    s = report.summary()
+    print(f"\n=== governance eval ({s['cases']} cases, {s['mode']}, concurrency {s['concurrency']}) ===")
+    print(f"tool accuracy      {s['tool_accuracy']:.1%}")
+    print(f"params accuracy    {s['params_accuracy']:.1%}")
+    print(f"numeric fidelity   {s['numeric_fidelity']:.1%}  "
+          f"({sum(r.fields_ok for r in report.results)}/{sum(r.fields_checked for r in report.results)} fields)")
+    print(f"pass rate          {s['pass_rate']:.1%}")
+    print(f"throughput         {s['throughput']:.1f} cases/s   wall {report.wall_s:.2f}s"
+          f"   p50 {s['p50_ms']:.0f} ms   p95 {s['p95_ms']:.0f} ms")
+    print(f"llm gateway        {llm_gateway.get_gateway().stats()}")
+    tool_stats = tool_cache.get_cache().stats()
+    print(f"tool cache         hit rate {tool_stats['hit_rate']:.1%}  ({tool_stats['hits']} hits, "
+          f"{tool_stats['misses']} misses, {tool_stats['contexts']} contexts)")
+    if stub_stats is not None:
+        print(f"stub server        {stub_stats}")
+    for r in report.failures():
+        expected = ", ".join(f"{c['tool']}{c['params']}" for c in r.case.calls)
+        actual = ", ".join(f"{c['tool']}{c['params']}" for c in r.actual_calls) or "-"
+        print(f"  FAIL {r.case.id}: {r.case.query!r}")
+        if r.error:
+            print(f"       error     {r.error}")
+        if not (r.tool_ok and r.params_ok):
+            print(f"       expected  {expected}\n       got       {actual}")
+        for line in r.mismatches[:5]:
+            print(f"       numeric   {line}")
+        if len(r.mismatches) > 5:
+            print(f"       numeric   … {len(r.mismatches) - 5} more")
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
+
+    parser = argparse.ArgumentParser(description="Batch evaluation of the governance copilot")
+    parser.add_argument("queries", nargs="?", type=Path, default=EVAL_QUERIES_PATH)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mode", choices=("thread", "async"), default="thread")
+    parser.add_argument("--repeat", type=int, default=1, help="run every case N times (throughput)")
+    parser.add_argument("--real", action="store_true", help="use the real OpenAI API (OPENAI_API_KEY)")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="stub time-to-first-token")
+    parser.add_argument("--cache", action="store_true", help="keep llm_cache enabled")
+    parser.add_argument("--rtol", type=float, default=DEFAULT_RTOL)
+    parser.add_argument("--atol", type=float, default=DEFAULT_ATOL)
+    parser.add_argument("--min-pass", type=float, default=1.0, help="exit 1 below this pass rate")
+    parser.add_argument("--record", action="store_true", help="rewrite expected outputs from this run")
+    parser.add_argument("--json", type=Path, default=None, help="write the summary + failures as JSON")
+    args = parser.parse_args()
+
+    server = None
+    if args.real:
+        api_key = os.environ.get("OPENAI_API_KEY", "")
+        if not api_key:
+            sys.exit("--real needs OPENAI_API_KEY")
+    else:
+        api_key = _STUB_API_KEY
+        server, url = stub_llm_server.start(stub_llm_server.StubConfig(
+            latency_ms=args.latency_ms, token_ms=2.0, seed=0))
+        llm_client.configure(llm_client.LLMClientConfig(
+            base_url=url, max_connections=max(args.concurrency, 10), max_keepalive=max(args.concurrency, 10)))
+        # stub 不需要限流；真实 API 保留网关默认的 RPM / TPM 限额
+        llm_gateway.configure(llm_gateway.GatewayConfig(max_concurrency=args.concurrency, rpm=0, tpm=0))
+    if not args.cache:
+        llm_cache.get_cache().max_entries = 0
+        llm_cache.get_cache().disk_dir = None
+    # 对冲超限用例会停在审批上，不写进本地审批库
+    graph_checkpoint.GOV_CHECKPOINT_DB = ":memory:"
+
+    cases = load_cases(args.queries)
+    report = run_eval(cases * args.repeat, api_key, args.concurrency, args.mode, args.rtol, args.atol)
+    _print_report(report, server.stats() if server else None)
+
+    if args.record:
+        report.results = report.results[:len(cases)]
+        n = record_expected(cases, report, args.queries)
+        print(f"\nrecorded expected outputs for {n}/{len(cases)} cases → {args.queries}")
+    if args.json:
+        args.json.write_text(json.dumps({
+            "summary": report.summary(),
+            "failures": [{"id": r.case.id, "query": r.case.query, "error": r.error,
+                          "expected": r.case.calls, "actual": r.actual_calls,
+                          "mismatches": r.mismatches} for r in report.failures()],
+        }, indent=2, ensure_ascii=False))
+
+    if server is not None:
+        llm_client.close_all()
+        server.shutdown()
+    if not args.record and report.pass_rate < args.min_pass:
+        sys.exit(1)
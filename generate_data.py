@@ -3,6 +3,8 @@ import numpy as np
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from curve_engine import KRD_COLUMNS, key_rate_profile
+
 # 输出目录：与 app.py 一致，写入 data/ 便于应用加载
 _SCRIPT_DIR = Path(__file__).resolve().parent
 DATA_DIR = _SCRIPT_DIR / "data"
@@ -51,6 +53,16 @@ ASSET_PROFILES = [
 # ==========================================
 # 2. 生成核心函数
 # ==========================================
+def _krd_fields(duration):
+    """
+    单一久期 → KRD 列（2y/5y/10y/20y/30y），与 engine 的缺列回退同一套展开（curve_engine.key_rate_profile）。
+    保留 3 位小数，舍入误差放到最大的期限上，保证 KRD 之和 = duration。
+    """
+    krd = np.round(key_rate_profile([duration])[0], 3)
+    krd[np.argmax(np.abs(krd))] += round(duration - krd.sum(), 3)
+    return {col: round(float(v), 3) for col, v in zip(KRD_COLUMNS, krd)}
+
+
 def _generate_business_dates(base_date, n_days):
     """从 base_date 往回数 n_days 个工作日（跳过周六周日），返回逆序列表（最新在前）。"""
     dates = []
@@ -102,9 +114,13 @@ def generate_positions():
                         and profile['sub'] == 'FX Forwards'):
                     fx_exp *= FX_BREACH_RETAIN
 
+                # 随机数按原列顺序抽取（名称 → 久期 → beta → 碳强度 → ESG），保证同一 seed 下数据不变
+                asset_name = f"{profile['sub']}_{np.random.randint(1000, 9999)}"
+                duration   = round(profile['dur'] + np.random.normal(0, 0.5), 1)
+
                 row = {
                     'timestamp':              current_date.strftime('%Y-%m-%d'),
-                    'asset_name':             f"{profile['sub']}_{np.random.randint(1000, 9999)}",
+                    'asset_name':             asset_name,
                     'plan_category':          'Asset',
                     'asset_class':            profile['class'],
                     'sub_asset_class':        profile['sub'],
@@ -115,7 +131,8 @@ def generate_positions():
                     'mtm_cad':                round(mtm, 2),
                     'market_exposure_cad':    round(mkt_exp, 2),
                     'fx_exposure_cad':        round(fx_exp, 2),
-                    'duration':               round(profile['dur'] + np.random.normal(0, 0.5), 1),
+                    'duration':               duration,
+                    **_krd_fields(duration),
                     'equity_beta':            round(profile['beta'] + np.random.normal(0, 0.1), 2),
                     'inflation_beta':         profile['inf'],
                     'fx_delta':               1.0 if profile['curr'] != 'CAD' else 0.0,
@@ -128,6 +145,7 @@ def generate_positions():
         # 负债固定，不随资产波动。精算负债基于长期假设，不会日日变化。
         for liab_type in ['Active_Members', 'Retired_Members']:
             amt = -(TOTAL_LIABILITY_CAD * 0.5)  # 负号表示负债，Active 和 Retired 各占一半
+            duration = 14.5 if liab_type == 'Active_Members' else 11.2
             row = {
                 'timestamp':              current_date.strftime('%Y-%m-%d'),
                 'asset_name':             f"Pension_Obligation_{liab_type}",
@@ -141,7 +159,8 @@ def generate_positions():
                 'mtm_cad':                round(amt, 2),
                 'market_exposure_cad':    round(amt, 2),
                 'fx_exposure_cad':        0.0,
-                'duration':               14.5 if liab_type == 'Active_Members' else 11.2,
+                'duration':               duration,
+                **_krd_fields(duration),
                 'equity_beta':            0.0,
                 'inflation_beta':         0.8 if liab_type == 'Active_Members' else 0.5,  # COLA 条款：Active 成员未来 COLA 调整期更长，通胀敏感度更高
                 'fx_delta':               0.0,
@@ -0,0 +1,245 @@
+"""
+graph_checkpoint.py — LangGraph checkpointer: 内存 + 本地 SQLite 持久化，ctx 按指纹引用
+
+背景:
+    治理版 Copilot 的待审批状态原来整份塞在 st.session_state 里（包括 ctx 里的全部
+    DataFrame），审批时再手工拼回去调用 node_handle_approval:
+        · 每个待审批 session 都攥着一份 ctx 引用，rerun 时随 session_state 一起搬来搬去
+        · 浏览器刷新 / server 重启后待审批状态直接丢失，只能重新提问
+        · 审批不经过图本身，LangGraph 的 checkpoint / interrupt 机制完全没用上
+
+设计:
+    - 图在 wait_approval 节点用 interrupt() 暂停，状态由 checkpointer 按 thread_id 保存，
+      审批时 Command(resume=...) 从断点继续，不需要 UI 保存任何图状态
+    - ContextRefSerializer: ctx（带 fingerprint 的 Mapping）只序列化为指纹，
+      读取时到 context_cache 的共享 ctx 里按指纹找回；找不到（重启后还没人加载那个日期）
+      时返回 {"fingerprint": fp} 占位，审批节点本身不读 ctx
+    - 其余状态走 LangGraph 的 JsonPlusSerializer（msgpack），关闭 pickle 回退:
+      启动时会载入磁盘上的 checkpoint，能写这个文件的人不能借 unpickle 在应用进程里执行代码；
+      工具输出里的 numpy 标量（np.float64 等）写入前由 _to_native 转成 Python 标量，其余状态
+      只有基本类型 / 消息 / 白名单 dataclass，不需要 pickle
+    - SQLiteCheckpointSaver: 继承 InMemorySaver，读全部走内存；put / put_writes /
+      delete_thread 同步写穿到 SQLite（标准库 sqlite3，WAL），启动时整库载入内存，
+      并清理超过 GOV_CHECKPOINT_TTL_S 的线程（放弃的审批不会无限堆积）
+    - GOV_CHECKPOINT_DB 为空或 ":memory:" 时只用内存（单进程、不跨重启）
+
+对外暴露:
+    ContextRefSerializer
+    SQLiteCheckpointSaver (prune / close)
+    make_checkpointer(path, allowed_msgpack_modules) → InMemorySaver | SQLiteCheckpointSaver
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Tuple
+
+import numpy as np
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+import context_cache
+
+
+_DEFAULT_DB = Path(__file__).resolve().parent / ".cache" / "gov_checkpoints.sqlite3"
+
+GOV_CHECKPOINT_DB = os.environ.get("GOV_CHECKPOINT_DB", str(_DEFAULT_DB))
+GOV_CHECKPOINT_TTL_S = float(os.environ.get("GOV_CHECKPOINT_TTL_S", 7 * 24 * 3600))
+
+# ctx 引用在 checkpoint 里的类型标记
+_CTX_REF_TYPE = "ctx_ref"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT, ns TEXT, checkpoint_id TEXT,
+    checkpoint_type TEXT, checkpoint BLOB, metadata_type TEXT, metadata BLOB,
+    parent_id TEXT, created_at REAL,
+    PRIMARY KEY (thread_id, ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT, ns TEXT, channel TEXT, version TEXT, type TEXT, value BLOB,
+    PRIMARY KEY (thread_id, ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT, ns TEXT, checkpoint_id TEXT, task_id TEXT, idx INTEGER,
+    channel TEXT, type TEXT, value BLOB, task_path TEXT,
+    PRIMARY KEY (thread_id, ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+# ============================================================
+# 序列化: ctx 只存指纹
+# ============================================================
+
+def _ctx_fingerprint(obj) -> Optional[str]:
+    """engine.build_context 产出的 ctx（dict 或只读 Mapping）→ 指纹；其他值 → None"""
+    if isinstance(obj, Mapping) and 'limits_df' in obj:
+        fingerprint = obj.get('fingerprint')
+        if isinstance(fingerprint, str):
+            return fingerprint
+    return None
+
+
+def _to_native(obj):
+    """dict / list / tuple 里的 numpy 标量 → Python 标量（msgpack 不认 np.float64，且不再回退 pickle）"""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if type(obj) is dict:
+        return {k: _to_native(v) for k, v in obj.items()}
+    if type(obj) in (list, tuple):
+        return type(obj)(_to_native(v) for v in obj)
+    return obj
+
+
+class ContextRefSerializer(SerializerProtocol):
+    """
+    包一层 JsonPlusSerializer: ctx 写成 ("ctx_ref", 指纹)，读取时用 resolve(指纹) 找回。
+
+    resolve 默认查 context_cache 的进程级共享缓存（只查不算）。
+    """
+
+    def __init__(self,
+                 resolve: Optional[Callable[[str], Optional[Mapping]]] = None,
+                 allowed_msgpack_modules: Iterable[Tuple[str, str]] = ()):
+        self._resolve = resolve or context_cache.get_shared_cache().peek
+        self._inner = JsonPlusSerializer(pickle_fallback=False,
+                                         allowed_msgpack_modules=list(allowed_msgpack_modules))
+
+    def dumps_typed(self, obj) -> Tuple[str, bytes]:
+        fingerprint = _ctx_fingerprint(obj)
+        if fingerprint is not None:
+            return _CTX_REF_TYPE, fingerprint.encode()
+        return self._inner.dumps_typed(_to_native(obj))
+
+    def loads_typed(self, data: Tuple[str, bytes]):
+        type_, payload = data
+        if type_ == _CTX_REF_TYPE:
+            fingerprint = bytes(payload).decode()
+            ctx = self._resolve(fingerprint)
+            return ctx if ctx is not None else {"fingerprint": fingerprint}
+        return self._inner.loads_typed(data)
+
+
+# ============================================================
+# SQLite 写穿
+# ============================================================
+
+class SQLiteCheckpointSaver(InMemorySaver):
+    """
+    InMemorySaver + SQLite 写穿。
+
+    读（get_tuple / list）完全走父类的内存结构；每次写入后把本次新增的条目
+    同步 upsert 到 SQLite，构造时把库里的全部条目载回内存，因此重启后可以按
+    thread_id 继续被 interrupt 暂停的图。
+    """
+
+    def __init__(self, path, *, serde: Optional[SerializerProtocol] = None,
+                 ttl_s: Optional[float] = GOV_CHECKPOINT_TTL_S):
+        super().__init__(serde=serde)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        if ttl_s is not None:
+            self.prune(ttl_s)
+        self._load()
+
+    # ── 启动时载入 ──
+    def _load(self):
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT thread_id, ns, checkpoint_id, checkpoint_type, checkpoint,"
+                " metadata_type, metadata, parent_id FROM checkpoints").fetchall()
+            for tid, ns, cid, c_type, c_val, m_type, m_val, parent in rows:
+                self.storage[tid][ns][cid] = ((c_type, c_val), (m_type, m_val), parent)
+
+            for tid, ns, channel, version, type_, value in self._conn.execute(
+                    "SELECT thread_id, ns, channel, version, type, value FROM blobs"):
+                self.blobs[(tid, ns, channel, version)] = (type_, value)
+
+            for tid, ns, cid, task_id, idx, channel, type_, value, task_path in self._conn.execute(
+                    "SELECT thread_id, ns, checkpoint_id, task_id, idx, channel, type, value,"
+                    " task_path FROM writes"):
+                self.writes[(tid, ns, cid)][(task_id, idx)] = (task_id, channel, (type_, value), task_path)
+
+    # ── 写穿 ──
+    def put(self, config, checkpoint, metadata, new_versions):
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"]["checkpoint_ns"]
+        checkpoint_id = checkpoint["id"]
+        (c_type, c_val), (m_type, m_val), parent = self.storage[thread_id][ns][checkpoint_id]
+        blob_rows = [
+            (thread_id, ns, channel, str(version), *self.blobs[(thread_id, ns, channel, version)])
+            for channel, version in new_versions.items()
+        ]
+        with self._db_lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, ns, checkpoint_id, c_type, c_val, m_type, m_val, parent, time.time()))
+            self._conn.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", blob_rows)
+        return next_config
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        super().put_writes(config, writes, task_id, task_path)
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = [
+            (thread_id, ns, checkpoint_id, w_task_id, idx, channel, type_, value, w_task_path)
+            for (w_task_id, idx), (_, channel, (type_, value), w_task_path)
+            in self.writes.get((thread_id, ns, checkpoint_id), {}).items()
+            if w_task_id == task_id
+        ]
+        with self._db_lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self._db_lock, self._conn:
+            for table in ("checkpoints", "blobs", "writes"):
+                self._conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+
+    # ── 维护 ──
+    def prune(self, max_age_s: float) -> int:
+        """删除最后一个 checkpoint 早于 max_age_s 秒前的线程，返回删除的线程数"""
+        cutoff = time.time() - max_age_s
+        with self._db_lock:
+            stale = [tid for (tid,) in self._conn.execute(
+                "SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(created_at) < ?",
+                (cutoff,))]
+        for thread_id in stale:
+            self.delete_thread(thread_id)
+        return len(stale)
+
+    def close(self):
+        with self._db_lock:
+            self._conn.close()
+
+
+# ============================================================
+# PUBLIC: make_checkpointer
+# ============================================================
+
+def make_checkpointer(path: Optional[str] = None,
+                      allowed_msgpack_modules: Iterable[Tuple[str, str]] = ()) -> InMemorySaver:
+    """
+    path 默认取 GOV_CHECKPOINT_DB；为空或 ":memory:" → 纯内存 checkpointer，否则 SQLite 写穿。
+    allowed_msgpack_modules: 状态里出现的自定义 dataclass（如 ThinkingStep），
+    反序列化时按白名单放行。
+    """
+    if path is None:
+        path = GOV_CHECKPOINT_DB
+    serde = ContextRefSerializer(allowed_msgpack_modules=allowed_msgpack_modules)
+    if not path or path == ":memory:":
+        return InMemorySaver(serde=serde)
+    return SQLiteCheckpointSaver(path, serde=serde)
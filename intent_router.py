@@ -0,0 +1,369 @@
+"""
+intent_router.py — 本地确定性意图路由 (LLM 工具选择之前的快速通道)
+
+背景:
+    agent_logic_gov.node_analyze_with_tools 每个问题都要先走一次 LLM 往返，
+    只为在 7 个工具里选一个。它的异常 fallback 已经说明简单规则能覆盖大部分问题。
+
+设计:
+    - 关键词 / 正则打分: 每个工具一组 (pattern, weight)，命中累加
+    - 参数抽取: 对冲比例 / 对冲类型、利率 bp、权益 %、通胀 %、预设情景
+    - 置信度 = 领先幅度 (top - second) / top × 强度 min(1, top / ROUTER_STRONG_SCORE)
+      多个工具同时强命中（复合问题）或完全没命中时置信度低 → 交给 LLM
+    - 问题里有数字但抽取器没认出来时不套用默认参数，置信度置 0 → 交给 LLM；
+      默认参数只用于完全没有数字的问题（"run a stress test"）
+    - 抽出的参数超出 _PARAM_RANGES（如对冲 120%）: 原值保留（LLM 失败走 fallback 时审计照样判 FAIL
+      → 触发审批），置信度同样置 0
+    - 纯本地计算，无网络调用，微秒级
+
+对外暴露:
+    ROUTER_CONFIDENCE_THRESHOLD
+    RouteDecision
+    route(query) → RouteDecision
+    benchmark(corpus_path) → dict        (python intent_router.py 运行；语料 "local": false 表示必须交给 LLM)
+"""
+
+import json
+import re
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from skills_v2 import PRESET_SCENARIOS
+
+
+# 置信度 ≥ 阈值 → 本地直接路由；否则交给 LLM
+ROUTER_CONFIDENCE_THRESHOLD = 0.6
+
+# 单个工具得分达到该值视为"强命中"
+ROUTER_STRONG_SCORE = 2.0
+
+# 参数抽取成功时给对应工具的加分
+_PARAM_BONUS = 1.0
+
+DEFAULT_TOOL = "get_risk_metrics"
+
+INTENT_CORPUS_PATH = Path(__file__).resolve().parent / "data" / "intent_corpus.jsonl"
+
+
+# ============================================================
+# 关键词规则
+# ============================================================
+
+_TOOL_RULES: Dict[str, List[Tuple[str, float]]] = {
+    "check_hedge_compliance": [
+        (r"\bhedg(e|es|ed|ing)\b", 2.0),
+        (r"hedge ratio|hedging ratio", 1.0),
+        (r"对冲", 2.0),
+    ],
+    "run_stress_test": [
+        (r"\bstress(ed)?\b|压力测试|压力", 2.0),
+        (r"\bshocks?\b|冲击", 1.0),
+        (r"\bscenario\b|情景", 1.0),
+        (r"what if|what happens if|what would happen", 1.0),
+        (r"\d+\s*(?:bp|bps|basis points?|基点)", 1.0),
+        (r"\bcrash\b|\bcrisis\b|\b2008\b|\bgfc\b|stagflation|sell-?off", 1.0),
+    ],
+    "get_limit_status": [
+        (r"\blimits?\b|限额", 2.0),
+        (r"\bbreach(es|ed)?\b|超限", 2.0),
+        (r"\bwarnings?\b|预警", 1.0),
+        (r"\bcompliance\b|\bcompliant\b|合规", 1.0),
+        (r"\bkri\b|\bthresholds?\b", 1.0),
+    ],
+    "get_asset_allocation": [
+        (r"\ballocation\b|资产配置|配置", 2.0),
+        (r"asset mix|\bweights?\b|\bbreakdown\b", 1.0),
+        (r"asset class(es)?|portfolio composition|holdings", 1.0),
+    ],
+    "get_risk_metrics": [
+        (r"funded status|funding ratio|funded ratio|资金状况|融资比率", 2.0),
+        (r"\bsurplus\b|盈余", 2.0),
+        (r"duration gap|久期缺口", 2.0),
+        (r"\bsummary\b|overview|risk position|key metrics|\bkpis?\b|概况|总结", 2.0),
+        (r"\bduration\b|久期|\bliabilit(y|ies)\b", 1.0),
+    ],
+    "get_surplus_var": [
+        (r"\bvar\b|(?:value|surplus)[- ]at[- ]risk|在险价值|风险价值", 3.0),
+        (r"expected shortfall|\bcvar\b|预期损失|预期亏损", 3.0),
+        # 盈余 + VaR 同时出现: 抵消 get_risk_metrics 的 "surplus / 盈余" 得分
+        (r"(?:surplus|盈余).{0,20}(?:\bvar\b|shortfall|在险|风险价值)"
+         r"|(?:\bvar\b|shortfall|在险价值).{0,20}(?:surplus|盈余)", 2.0),
+        (r"surplus[- ]at[- ]risk|tail risk|尾部风险", 2.0),
+        (r"historical simulation|历史模拟|\bconfidence\b|置信", 1.0),
+    ],
+    "get_risk_attribution": [
+        (r"risk contributions?|risk attribution|contribut\w* to (?:surplus )?(?:risk|volatility)|风险贡献|风险归因", 3.0),
+        (r"\bdrives?\b|\bdriving\b|\bdrivers?\b|驱动", 2.0),
+        # "什么在驱动风险": 抵消 get_risk_metrics 的 "surplus" 得分
+        (r"\b(?:drives?|driving|drivers? of)\b.{0,30}\b(?:risk|volatility)\b"
+         r"|\b(?:risk|volatility) drivers?\b|驱动.{0,10}(?:风险|波动)", 2.0),
+        (r"risk budget|euler|marginal (?:risk|contribution)|边际贡献", 2.0),
+        (r"\bvolatility\b|波动", 1.0),
+    ],
+}
+
+_COMPILED_RULES = {
+    tool: [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in rules]
+    for tool, rules in _TOOL_RULES.items()
+}
+
+
+# ============================================================
+# 参数抽取
+# ============================================================
+
+_NUM = r"(\d+(?:\.\d+)?)"
+_DOWN_WORDS = r"\b(?:down|cut|cuts|fall|falls|drop|drops|decline|declines|lower|decrease|crash|plunge|sell-?off)\b|下跌|下降|降息"
+_UP_WORDS = r"\b(?:up|rise|rises|hike|hikes|increase|higher|rally|gain|gains)\b|上涨|上升|加息"
+_RE_DIRECTION = re.compile(rf"(?P<down>{_DOWN_WORDS})|(?P<up>{_UP_WORDS})", re.IGNORECASE)
+
+_RE_BP = re.compile(rf"([+-])?\s*{_NUM}\s*(?:bp|bps|basis points?|个基点|基点)", re.IGNORECASE)
+_RE_EQUITY = re.compile(
+    rf"(?:equit(?:y|ies)|stocks?|shares|股票|权益)[^%\d]{{0,25}}?([+-])?\s*{_NUM}\s*%"
+    rf"|([+-])?\s*{_NUM}\s*%[^%\d]{{0,15}}?(?:equit(?:y|ies)|stocks?|shares|股票|权益)",
+    re.IGNORECASE,
+)
+_RE_INFLATION = re.compile(rf"(?:inflation|cpi|通胀)[^%\d]{{0,20}}?([+-])?\s*{_NUM}\s*%", re.IGNORECASE)
+_RE_PERCENT = re.compile(rf"{_NUM}\s*%")
+_RE_DECIMAL_RATIO = re.compile(r"(?<![\d.])0?\.(\d{1,3})\b")
+_RE_ANY_NUMBER = re.compile(r"\d")
+
+_PRESET_PATTERNS = [
+    ("crisis_2008", re.compile(r"2008|\bgfc\b|financial crisis|金融危机", re.IGNORECASE)),
+    ("stagflation", re.compile(r"stagflation|滞胀", re.IGNORECASE)),
+    ("equity_crash", re.compile(r"equity crash|market crash|stock crash|股灾", re.IGNORECASE)),
+]
+
+
+def _direction(text: str, end: int, explicit_sign: Optional[str], default: int) -> int:
+    """方向: 显式 +/- 优先，其次取 end 之前 25 个字符内最近的涨跌词，都没有用 default"""
+    if explicit_sign:
+        return -1 if explicit_sign == "-" else 1
+    hits = list(_RE_DIRECTION.finditer(text[max(0, end - 25):end]))
+    if not hits:
+        return default
+    return -1 if hits[-1].group("down") else 1
+
+
+def _extract_hedge_params(text: str) -> Optional[dict]:
+    match = _RE_PERCENT.search(text)
+    if match:
+        ratio = float(match.group(1)) / 100
+    else:
+        match = _RE_DECIMAL_RATIO.search(text)
+        if not match:
+            return None
+        ratio = float("0." + match.group(1))
+
+    if re.search(r"\bfx\b|currency|foreign exchange|外汇|汇率", text, re.IGNORECASE):
+        hedge_type = "fx"
+    elif re.search(r"equity hedge|hedge.{0,15}equit|权益对冲", text, re.IGNORECASE):
+        hedge_type = "equity"
+    else:
+        hedge_type = "duration"
+    return {"ratio": round(ratio, 4), "hedge_type": hedge_type}
+
+
+def _extract_stress_params(text: str) -> Optional[dict]:
+    params = {}
+    bp = _RE_BP.search(text)
+    if bp:
+        sign = _direction(text, bp.start(), bp.group(1), default=1)
+        params["rate_shock_bp"] = int(sign * float(bp.group(2)))
+
+    eq = _RE_EQUITY.search(text)
+    if eq:
+        explicit = eq.group(1) or eq.group(3)
+        value = eq.group(2) or eq.group(4)
+        # 权益默认按下跌处理（压力测试语境）
+        sign = _direction(text, eq.start() + len(eq.group(0)), explicit, default=-1)
+        params["equity_shock_pct"] = round(sign * float(value) / 100, 4)
+
+    infl = _RE_INFLATION.search(text)
+    if infl:
+        sign = _direction(text, infl.start() + len(infl.group(0)), infl.group(1), default=1)
+        params["inflation_shock_pct"] = round(sign * float(infl.group(2)) / 100, 4)
+
+    if not params:
+        # 没有显式数字时才套用预设情景
+        for preset_name, pattern in _PRESET_PATTERNS:
+            if pattern.search(text):
+                return PRESET_SCENARIOS[preset_name].model_dump()
+        return None
+    # 只说了利率时权益不冲击，反之亦然（与 PRESET_SCENARIOS 一致）
+    params.setdefault("rate_shock_bp", 0)
+    params.setdefault("equity_shock_pct", 0.0)
+    params.setdefault("scenario_name", "Custom")
+    return params
+
+
+def _extract_attribution_params(text: str) -> Optional[dict]:
+    if re.search(r"\bsectors?\b|行业", text, re.IGNORECASE):
+        return {"by": "sector"}
+    if re.search(r"\bcurrenc(y|ies)\b|币种|货币", text, re.IGNORECASE):
+        return {"by": "currency"}
+    if re.search(r"asset class(es)?|资产类别", text, re.IGNORECASE):
+        return {"by": "asset_class"}
+    return None
+
+
+_PARAM_EXTRACTORS = {
+    "check_hedge_compliance": _extract_hedge_params,
+    "run_stress_test": _extract_stress_params,
+    "get_risk_attribution": _extract_attribution_params,
+}
+
+# 本地路由可以直接采用的参数范围；超出范围的原值保留，但交给 LLM
+_PARAM_RANGES = {
+    "check_hedge_compliance": {"ratio": (0.0, 1.0)},
+}
+
+_DEFAULT_PARAMS = {
+    "check_hedge_compliance": {"ratio": 0.70, "hedge_type": "duration"},
+    "run_stress_test": {"rate_shock_bp": 100, "equity_shock_pct": -0.15},
+    "get_risk_attribution": {"by": "asset_class"},
+}
+
+
+# ============================================================
+# PUBLIC: route
+# ============================================================
+
+@dataclass
+class RouteDecision:
+    """本地路由结果"""
+    tool: str
+    params: dict
+    confidence: float
+    scores: Dict[str, float] = field(default_factory=dict)
+    matched: List[str] = field(default_factory=list)   # 命中的规则 (用于思考面板)
+
+    @property
+    def is_confident(self) -> bool:
+        return self.confidence >= ROUTER_CONFIDENCE_THRESHOLD
+
+
+def route(query: str) -> RouteDecision:
+    """对 query 打分、抽参数并给出置信度；不做任何网络调用"""
+    text = query.strip()
+    scores: Dict[str, float] = {}
+    matched: List[str] = []
+    extracted: Dict[str, dict] = {}
+
+    for tool, rules in _COMPILED_RULES.items():
+        score = 0.0
+        for pattern, weight in rules:
+            m = pattern.search(text)
+            if m:
+                score += weight
+                matched.append(f"{tool}:{m.group(0).lower()}")
+        scores[tool] = score
+
+    # 参数抽取只在对应工具已经有关键词命中时才加分，避免 "85%" 单独把问题拉向对冲
+    for tool, extractor in _PARAM_EXTRACTORS.items():
+        params = extractor(text)
+        if params is not None:
+            extracted[tool] = params
+            if scores[tool] > 0:
+                scores[tool] += _PARAM_BONUS
+
+    ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+    (top_tool, top), (_, second) = ranked[0], ranked[1]
+
+    if top <= 0:
+        return RouteDecision(DEFAULT_TOOL, {}, 0.0, scores, matched)
+
+    confidence = (top - second) / top * min(1.0, top / ROUTER_STRONG_SCORE)
+    if top_tool in extracted:
+        params = extracted[top_tool]
+        out_of_range = [key for key, (lo, hi) in _PARAM_RANGES.get(top_tool, {}).items()
+                        if not lo <= params.get(key, lo) <= hi]
+        if out_of_range:
+            confidence = 0.0
+            matched.append(f"{top_tool}:out-of-range {', '.join(out_of_range)}")
+    elif top_tool in _PARAM_EXTRACTORS and _RE_ANY_NUMBER.search(text):
+        # 有数字但没抽出合法参数（超范围 / 格式不认识）: 不能拿默认值顶替，交给 LLM
+        params, confidence = {}, 0.0
+        matched.append(f"{top_tool}:unparsed-params")
+    else:
+        params = dict(_DEFAULT_PARAMS.get(top_tool, {}))
+    return RouteDecision(top_tool, params, round(confidence, 3), scores, matched)
+
+
+# ============================================================
+# 基准: 路由准确率 + 延迟
+#   python intent_router.py [corpus.jsonl]
+# ============================================================
+
+def _params_match(expected: dict, actual: dict) -> bool:
+    for key, value in expected.items():
+        got = actual.get(key)
+        if isinstance(value, float):
+            if got is None or abs(float(got) - value) > 1e-6:
+                return False
+        elif got != value:
+            return False
+    return True
+
+
+def benchmark(corpus_path: Path = INTENT_CORPUS_PATH, repeat: int = 200) -> dict:
+    """
+    在标注语料上评估:
+        coverage        — 本地直接路由（不走 LLM）的比例
+        local_accuracy  — 本地路由部分的工具 + 参数准确率
+        top1_accuracy   — 不看置信度时的 top-1 工具准确率（LLM 失败时的 fallback 质量）
+        p50_us / p99_us — 单次 route() 延迟
+    """
+    with open(corpus_path, encoding="utf-8") as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+
+    routed = correct_local = correct_top1 = 0
+    errors = []
+    for item in corpus:
+        decision = route(item["query"])
+        tool_ok = decision.tool == item["tool"]
+        params_ok = _params_match(item.get("params", {}), decision.params)
+        correct_top1 += tool_ok
+        if decision.is_confident and not item.get("local", True):
+            routed += 1
+            errors.append((item["query"], "llm", decision.tool, decision.params))
+        elif decision.is_confident:
+            routed += 1
+            if tool_ok and params_ok:
+                correct_local += 1
+            else:
+                errors.append((item["query"], item["tool"], decision.tool, decision.params))
+
+    timings = []
+    for _ in range(repeat):
+        for item in corpus:
+            t0 = time.perf_counter()
+            route(item["query"])
+            timings.append(time.perf_counter() - t0)
+    timings.sort()
+
+    return {
+        "n": len(corpus),
+        "coverage": routed / len(corpus),
+        "local_accuracy": correct_local / routed if routed else 0.0,
+        "top1_accuracy": correct_top1 / len(corpus),
+        "p50_us": timings[len(timings) // 2] * 1e6,
+        "p99_us": timings[int(len(timings) * 0.99)] * 1e6,
+        "errors": errors,
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    path = Path(sys.argv[1]) if len(sys.argv) > 1 else INTENT_CORPUS_PATH
+    result = benchmark(path)
+    print(f"corpus          {result['n']} queries")
+    print(f"coverage        {result['coverage']:.1%}  (answered locally, no LLM call)")
+    print(f"local accuracy  {result['local_accuracy']:.1%}  (tool + params)")
+    print(f"top-1 accuracy  {result['top1_accuracy']:.1%}  (ignoring confidence)")
+    print(f"latency         p50 {result['p50_us']:.1f} µs   p99 {result['p99_us']:.1f} µs")
+    for query, expected, got, params in result["errors"]:
+        print(f"  MISROUTE  {query!r}: expected {expected}, got {got} {params}")
@@ -0,0 +1,276 @@
+"""
+llm_cache.py — LLM 响应缓存 (按 prompt + 模型 + ctx 指纹)
+
+背景:
+    三个 Copilot tab 的 Quick Question 按钮对同一个 ctx 反复发送完全相同的 prompt
+    （例如最新日期的 "what's our funded status"），每次都要等一次 LLM 往返并付费。
+
+设计:
+    - key = sha256(model, 采样参数, system prompt, user query, tool output, context fingerprint)
+      ctx 指纹变化（换日期 / 数据更新 / ENGINE_VERSION 升级）自动失效
+    - 进程内 LRU + TTL，所有 session 共享
+    - 可选磁盘后端（设置 LLM_CACHE_DIR），每个 key 一个 JSON 文件，重启后仍可命中
+    - 只缓存成功的完整响应；流式调用在流读完后才写入
+    - on_usage 透传给 llm_client；命中缓存时不回调（没有消耗 token）
+
+对外暴露:
+    make_key(model, system_prompt, user_query, tool_output, fingerprint, **params) → str
+    LLMResponseCache (get / put / stats / clear)
+    get_cache() → 进程级单例
+    cached_chat(...) → (text, cache_hit)
+    cached_chat_stream(...) → (Iterator[str], cache_hit)
+    acached_chat(...) / acached_chat_stream(...) — 异步版本
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterator, Iterator, Optional, Tuple
+
+import llm_client
+
+
+LLM_CACHE_TTL_S = float(os.environ.get("LLM_CACHE_TTL_S", 15 * 60))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 512))
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR") or None   # None → 只用内存
+
+
+# ============================================================
+# Key
+# ============================================================
+
+def make_key(model: str,
+             system_prompt: str,
+             user_query: str,
+             tool_output=None,
+             fingerprint: Optional[str] = None,
+             **params) -> str:
+    """所有会影响 LLM 输出的输入做规范化 JSON 后取 sha256"""
+    payload = json.dumps(
+        {
+            "model": model,
+            "params": params,
+            "system": system_prompt,
+            "user": user_query,
+            "tool_output": tool_output,
+            "fingerprint": fingerprint,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# ============================================================
+# LLMResponseCache
+# ============================================================
+
+class LLMResponseCache:
+    """线程安全的 TTL + LRU 响应缓存，可选磁盘后端"""
+
+    def __init__(self,
+                 max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 ttl_s: float = LLM_CACHE_TTL_S,
+                 disk_dir: Optional[str] = LLM_CACHE_DIR):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()   # key → (created_at, text)
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created_at, text = entry
+                if now - created_at <= self.ttl_s:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return text
+                del self._entries[key]
+                self._stats["expired"] += 1
+
+        entry = self._disk_get(key, now)
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._insert(key, entry)
+            return entry[1]
+
+    def put(self, key: str, text: str):
+        entry = (time.time(), text)
+        with self._lock:
+            self._insert(key, entry)
+        self._disk_put(key, entry)
+
+    def _insert(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    # ── 磁盘后端 ──
+    def _disk_get(self, key: str, now: float) -> Optional[tuple]:
+        if self.disk_dir is None:
+            return None
+        try:
+            with open(self.disk_dir / f"{key}.json", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if now - record.get("created_at", 0) > self.ttl_s:
+            return None
+        return record["created_at"], record["text"]
+
+    def _disk_put(self, key: str, entry: tuple):
+        """失败时静默放弃: 磁盘缓存只是加速"""
+        if self.disk_dir is None:
+            return
+        try:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix=f".{key}-", dir=self.disk_dir)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"created_at": entry[0], "text": entry[1]}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.disk_dir / f"{key}.json")
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "max_entries": self.max_entries}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# 进程级单例
+_cache = LLMResponseCache()
+
+
+def get_cache() -> LLMResponseCache:
+    return _cache
+
+
+# ============================================================
+# PUBLIC: cached_chat / cached_chat_stream
+# ============================================================
+
+def cached_chat(api_key: str,
+                system_prompt: str,
+                user_query: str,
+                fingerprint: Optional[str] = None,
+                tool_output=None,
+                model: str = llm_client.DEFAULT_MODEL,
+                max_tokens: int = 400,
+                temperature: float = 0.3,
+                on_usage: Optional[llm_client.UsageCallback] = None) -> Tuple[str, bool]:
+    """llm_client.chat 的缓存版，返回 (text, cache_hit)"""
+    key = make_key(model, system_prompt, user_query, tool_output, fingerprint,
+                   max_tokens=max_tokens, temperature=temperature)
+    text = _cache.get(key)
+    if text is not None:
+        return text, True
+
+    text = llm_client.chat(api_key, system_prompt, user_query,
+                           model=model, max_tokens=max_tokens, temperature=temperature,
+                           on_usage=on_usage)
+    _cache.put(key, text)
+    return text, False
+
+
+def cached_chat_stream(api_key: str,
+                       system_prompt: str,
+                       user_query: str,
+                       fingerprint: Optional[str] = None,
+                       tool_output=None,
+                       model: str = llm_client.DEFAULT_MODEL,
+                       max_tokens: int = 400,
+                       temperature: float = 0.3,
+                       on_usage: Optional[llm_client.UsageCallback] = None) -> Tuple[Iterator[str], bool]:
+    """
+    llm_client.chat_stream 的缓存版，返回 (delta 迭代器, cache_hit)。
+    命中时迭代器一次性给出完整文本；未命中时边流边收集，流读完后写入缓存。
+    """
+    key = make_key(model, system_prompt, user_query, tool_output, fingerprint,
+                   max_tokens=max_tokens, temperature=temperature)
+    text = _cache.get(key)
+    if text is not None:
+        return iter([text]), True
+
+    def _stream():
+        chunks = []
+        for delta in llm_client.chat_stream(api_key, system_prompt, user_query,
+                                            model=model, max_tokens=max_tokens,
+                                            temperature=temperature, on_usage=on_usage):
+            chunks.append(delta)
+            yield delta
+        _cache.put(key, "".join(chunks))
+
+    return _stream(), False
+
+
+async def acached_chat(api_key: str,
+                       system_prompt: str,
+                       user_query: str,
+                       fingerprint: Optional[str] = None,
+                       tool_output=None,
+                       model: str = llm_client.DEFAULT_MODEL,
+                       max_tokens: int = 400,
+                       temperature: float = 0.3,
+                       on_usage: Optional[llm_client.UsageCallback] = None) -> Tuple[str, bool]:
+    """cached_chat 的异步版本"""
+    key = make_key(model, system_prompt, user_query, tool_output, fingerprint,
+                   max_tokens=max_tokens, temperature=temperature)
+    text = _cache.get(key)
+    if text is not None:
+        return text, True
+
+    text = await llm_client.achat(api_key, system_prompt, user_query,
+                                  model=model, max_tokens=max_tokens, temperature=temperature,
+                                  on_usage=on_usage)
+    _cache.put(key, text)
+    return text, False
+
+
+def acached_chat_stream(api_key: str,
+                        system_prompt: str,
+                        user_query: str,
+                        fingerprint: Optional[str] = None,
+                        tool_output=None,
+                        model: str = llm_client.DEFAULT_MODEL,
+                        max_tokens: int = 400,
+                        temperature: float = 0.3,
+                        on_usage: Optional[llm_client.UsageCallback] = None) -> Tuple[AsyncIterator[str], bool]:
+    """cached_chat_stream 的异步版本，返回 (async delta 迭代器, cache_hit)"""
+    key = make_key(model, system_prompt, user_query, tool_output, fingerprint,
+                   max_tokens=max_tokens, temperature=temperature)
+    text = _cache.get(key)
+
+    async def _cached():
+        yield text
+
+    if text is not None:
+        return _cached(), True
+
+    async def _stream():
+        chunks = []
+        async for delta in llm_client.achat_stream(api_key, system_prompt, user_query,
+                                                   model=model, max_tokens=max_tokens,
+                                                   temperature=temperature, on_usage=on_usage):
+            chunks.append(delta)
+            yield delta
+        _cache.put(key, "".join(chunks))
+
+    return _stream(), False
@@ -0,0 +1,356 @@
+"""
+llm_client.py — 共享 OpenAI client 注册表 (连接池复用)
+
+背景:
+    agent_logic / agent_logic_lg / agent_logic_gov 原来每次 LLM 调用都 new 一个
+    OpenAI(api_key=...)，HTTP keep-alive 和 TLS session 全部作废，
+    一轮 Copilot 对话要重复 2-3 次建连。
+
+设计:
+    - 按 (api_key, base_url) 缓存 OpenAI client，进程内所有 session / 线程共享
+    - 每个 client 自带 httpx 连接池（keep-alive），超时与重试可配置
+    - 重试使用 OpenAI SDK 内置的指数退避（429 / 5xx / 连接错误）
+    - 配置可用环境变量覆盖，方便指向本地 stub server 压测
+    - AsyncOpenAI 的连接池绑定在 event loop 上，异步 client 按 (loop, api_key, base_url) 缓存
+    - on_usage 回调: 调用方需要 token 用量时传入，收到 {"prompt_tokens", "completion_tokens"}；
+      流式调用会带上 stream_options.include_usage，用量在最后一块给出
+    - 所有 chat.completions.create 都经过 llm_gateway（并发上限 / 相同请求合并 / 限流）
+
+对外暴露:
+    LLMClientConfig
+    get_client(api_key, base_url) → OpenAI
+    chat(api_key, system_prompt, user_query, ...) → str
+    chat_stream(api_key, system_prompt, user_query, ...) → Iterator[str]
+    get_async_client(api_key, base_url) → AsyncOpenAI
+    achat(...) → str / achat_stream(...) → AsyncIterator[str]
+    close_all()
+"""
+
+import asyncio
+import os
+import threading
+import weakref
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, OpenAI, DefaultHttpxClient, Timeout
+
+import llm_gateway
+
+
+DEFAULT_MODEL = "gpt-4o-mini"
+
+
+# ============================================================
+# 配置
+# ============================================================
+
+@dataclass(frozen=True)
+class LLMClientConfig:
+    """连接池 / 超时 / 重试参数，默认值可被环境变量覆盖"""
+    base_url: Optional[str] = None        # None → api.openai.com
+    connect_timeout_s: float = 5.0
+    read_timeout_s: float = 60.0
+    max_retries: int = 3                  # SDK 内置指数退避
+    max_connections: int = 50
+    max_keepalive: int = 20
+    keepalive_expiry_s: float = 60.0
+
+    @classmethod
+    def from_env(cls) -> "LLMClientConfig":
+        return cls(
+            base_url=os.environ.get("OPENAI_BASE_URL") or None,
+            connect_timeout_s=float(os.environ.get("LLM_CONNECT_TIMEOUT_S", 5.0)),
+            read_timeout_s=float(os.environ.get("LLM_READ_TIMEOUT_S", 60.0)),
+            max_retries=int(os.environ.get("LLM_MAX_RETRIES", 3)),
+            max_connections=int(os.environ.get("LLM_MAX_CONNECTIONS", 50)),
+            max_keepalive=int(os.environ.get("LLM_MAX_KEEPALIVE", 20)),
+        )
+
+
+_config = LLMClientConfig.from_env()
+
+
+def configure(config: LLMClientConfig):
+    """替换全局配置；已经建好的 client 会被关闭，下次调用按新配置重建"""
+    global _config
+    close_all()
+    _config = config
+
+
+def get_config() -> LLMClientConfig:
+    return _config
+
+
+# ============================================================
+# Client 注册表
+# ============================================================
+
+_clients: Dict[Tuple[str, Optional[str]], OpenAI] = {}
+_clients_lock = threading.Lock()
+
+
+# event loop → {(api_key, base_url): AsyncOpenAI}；loop 被回收时条目自动消失
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict]" = weakref.WeakKeyDictionary()
+
+
+def _pool_kwargs(config: LLMClientConfig) -> dict:
+    return dict(
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive,
+            keepalive_expiry=config.keepalive_expiry_s,
+        ),
+        timeout=Timeout(config.read_timeout_s, connect=config.connect_timeout_s),
+    )
+
+
+def _build_client(api_key: str, base_url: Optional[str], config: LLMClientConfig) -> OpenAI:
+    return OpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        max_retries=config.max_retries,
+        http_client=DefaultHttpxClient(**_pool_kwargs(config)),
+    )
+
+
+def _build_async_client(api_key: str, base_url: Optional[str], config: LLMClientConfig) -> AsyncOpenAI:
+    return AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url,
+        max_retries=config.max_retries,
+        http_client=DefaultAsyncHttpxClient(**_pool_kwargs(config)),
+    )
+
+
+def get_client(api_key: str, base_url: Optional[str] = None) -> OpenAI:
+    """
+    返回 (api_key, base_url) 对应的共享 client，不存在时创建。
+    OpenAI client 本身是线程安全的，可以在多个 session 间共享。
+    """
+    base_url = base_url or _config.base_url
+    key = (api_key, base_url)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _build_client(api_key, base_url, _config)
+            _clients[key] = client
+        return client
+
+
+def get_async_client(api_key: str, base_url: Optional[str] = None) -> AsyncOpenAI:
+    """
+    返回当前 event loop 上 (api_key, base_url) 对应的共享 AsyncOpenAI client。
+    必须在协程里调用；同一个 loop 内的所有协程复用同一个连接池。
+    """
+    loop = asyncio.get_running_loop()
+    base_url = base_url or _config.base_url
+    key = (api_key, base_url)
+    with _clients_lock:
+        loop_clients = _async_clients.setdefault(loop, {})
+        client = loop_clients.get(key)
+        if client is None:
+            client = _build_async_client(api_key, base_url, _config)
+            loop_clients[key] = client
+        return client
+
+
+def close_all():
+    """关闭所有同步连接池（测试 / 切换配置时使用）；异步 client 随 event loop 一起回收"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+        _async_clients.clear()
+    for client in clients:
+        client.close()
+
+
+# ============================================================
+# PUBLIC: chat
+# ============================================================
+
+UsageCallback = Callable[[dict], None]
+
+
+def _report_usage(usage, on_usage: Optional[UsageCallback]):
+    if on_usage is not None and usage is not None:
+        on_usage({"prompt_tokens": usage.prompt_tokens or 0,
+                  "completion_tokens": usage.completion_tokens or 0})
+
+
+def _stream_kwargs(on_usage: Optional[UsageCallback]) -> dict:
+    # 只有调用方要用量时才请求 usage 块（部分 OpenAI 兼容服务不支持 stream_options）
+    return {"stream_options": {"include_usage": True}} if on_usage is not None else {}
+
+
+def _messages(system_prompt: str, user_query: str) -> list:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_query},
+    ]
+
+
+def _gateway_args(api_key: str, base_url: Optional[str], model: str, system_prompt: str,
+                  user_query: str, max_tokens: int, temperature: float, stream: bool) -> tuple:
+    """(合并 key, TPM 成本)"""
+    key = llm_gateway.request_key(api_key, base_url or _config.base_url, model, system_prompt,
+                                  user_query, stream, max_tokens=max_tokens, temperature=temperature)
+    return key, llm_gateway.estimate_tokens(system_prompt, user_query, max_tokens)
+
+
+def chat(api_key: str,
+         system_prompt: str,
+         user_query: str,
+         model: str = DEFAULT_MODEL,
+         max_tokens: int = 400,
+         temperature: float = 0.3,
+         base_url: Optional[str] = None,
+         on_usage: Optional[UsageCallback] = None) -> str:
+    """单轮 system + user 调用，返回 assistant 文本"""
+    def _create() -> str:
+        response = get_client(api_key, base_url).chat.completions.create(
+            model=model,
+            messages=_messages(system_prompt, user_query),
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        _report_usage(response.usage, on_usage)
+        return response.choices[0].message.content
+
+    key, cost = _gateway_args(api_key, base_url, model, system_prompt, user_query,
+                              max_tokens, temperature, stream=False)
+    return llm_gateway.get_gateway().call(key, _create, cost)
+
+
+def chat_stream(api_key: str,
+                system_prompt: str,
+                user_query: str,
+                model: str = DEFAULT_MODEL,
+                max_tokens: int = 400,
+                temperature: float = 0.3,
+                base_url: Optional[str] = None,
+                on_usage: Optional[UsageCallback] = None) -> Iterator[str]:
+    """同 chat()，但逐个 yield 文本增量 (stream=True)"""
+    def _open() -> Iterator[str]:
+        stream = get_client(api_key, base_url).chat.completions.create(
+            model=model,
+            messages=_messages(system_prompt, user_query),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            **_stream_kwargs(on_usage),
+        )
+
+        def _deltas():
+            with stream:
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                    _report_usage(getattr(chunk, "usage", None), on_usage)
+
+        return _deltas()
+
+    key, cost = _gateway_args(api_key, base_url, model, system_prompt, user_query,
+                              max_tokens, temperature, stream=True)
+    return llm_gateway.get_gateway().stream(key, _open, cost)
+
+
+async def achat(api_key: str,
+                system_prompt: str,
+                user_query: str,
+                model: str = DEFAULT_MODEL,
+                max_tokens: int = 400,
+                temperature: float = 0.3,
+                base_url: Optional[str] = None,
+                on_usage: Optional[UsageCallback] = None) -> str:
+    """chat() 的异步版本"""
+    async def _create() -> str:
+        response = await get_async_client(api_key, base_url).chat.completions.create(
+            model=model,
+            messages=_messages(system_prompt, user_query),
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+        _report_usage(response.usage, on_usage)
+        return response.choices[0].message.content
+
+    key, cost = _gateway_args(api_key, base_url, model, system_prompt, user_query,
+                              max_tokens, temperature, stream=False)
+    return await llm_gateway.get_gateway().acall(key, _create, cost)
+
+
+def achat_stream(api_key: str,
+                 system_prompt: str,
+                 user_query: str,
+                 model: str = DEFAULT_MODEL,
+                 max_tokens: int = 400,
+                 temperature: float = 0.3,
+                 base_url: Optional[str] = None,
+                 on_usage: Optional[UsageCallback] = None) -> AsyncIterator[str]:
+    """chat_stream() 的异步版本"""
+    async def _open() -> AsyncIterator[str]:
+        stream = await get_async_client(api_key, base_url).chat.completions.create(
+            model=model,
+            messages=_messages(system_prompt, user_query),
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True,
+            **_stream_kwargs(on_usage),
+        )
+
+        async def _deltas():
+            async with stream:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+                    _report_usage(getattr(chunk, "usage", None), on_usage)
+
+        return _deltas()
+
+    key, cost = _gateway_args(api_key, base_url, model, system_prompt, user_query,
+                              max_tokens, temperature, stream=True)
+    return llm_gateway.get_gateway().astream(key, _open, cost)
+
+
+# ============================================================
+# 基准: 本地 stub server 上对比每次新建 client vs 共享连接池
+#   python llm_client.py [turns]
+# ============================================================
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    import stub_llm_server
+
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    calls_per_turn = 2   # gov: analyze + respond
+    server, url = stub_llm_server.start(stub_llm_server.StubConfig(latency_ms=0, jitter=0))
+    # 只比较连接开销: 网关不限流、不合并
+    llm_gateway.configure(llm_gateway.GatewayConfig(rpm=0, tpm=0, coalesce=False))
+
+    def _fresh_call():
+        client = OpenAI(api_key="stub", base_url=url)
+        client.chat.completions.create(
+            model=DEFAULT_MODEL, messages=[{"role": "user", "content": "hi"}], max_tokens=8)
+        client.close()
+
+    def _pooled_call():
+        chat("stub", "sys", "hi", max_tokens=8, base_url=url)
+
+    for label, fn in (("fresh client", _fresh_call), ("pooled client", _pooled_call)):
+        fn()  # warm-up
+        t0 = time.perf_counter()
+        for _ in range(turns):
+            for _ in range(calls_per_turn):
+                fn()
+        per_turn_ms = (time.perf_counter() - t0) / turns * 1000
+        print(f"{label:14s} {per_turn_ms:7.2f} ms/turn  ({calls_per_turn} calls/turn, {turns} turns)")
+
+    close_all()
+    server.shutdown()
@@ -0,0 +1,588 @@
+"""
+llm_gateway.py — 进程级 LLM 网关: 并发上限 / 相同请求合并 / 令牌桶限流 / 排队指标
+
+背景:
+    整个风险团队共用一个 Streamlit server。几个分析师同时点同一个 Quick Question 时，
+    每个 session 各发一次完全相同的 OpenAI 请求（llm_cache 只在响应写回后才能命中）；
+    一阵突发请求还会撞上 OpenAI 的 RPM / TPM 限额，SDK 的 429 重试让所有人一起变慢。
+
+设计:
+    - llm_client 的 chat / chat_stream / achat / achat_stream 都经过这里，
+      agent 模块里所有 chat.completions.create 调用因此共享同一个网关
+    - 并发上限: 同步线程和协程共用一个槽位池（FIFO），超过 LLM_GATEWAY_MAX_CONCURRENCY
+      的请求排队；排队超过 LLM_GATEWAY_QUEUE_TIMEOUT_S 抛 GatewayTimeout
+    - 相同请求合并: key = (api_key, base_url, model, prompt, 采样参数, 是否流式)，
+      同 key 已在途时后来者不再发请求，等待 / 回放 leader 的结果（流式逐块回放）；
+      follower 不触发 on_usage（没有消耗 token）。leader 的消费方中途放弃流时，
+      有 follower 就在后台把上游读完，follower 不受影响
+    - 令牌桶: 请求数 (LLM_GATEWAY_RPM) 和 token 数 (LLM_GATEWAY_TPM) 各一个桶，
+      token 成本 = prompt 估算 + max_tokens（与 OpenAI 计入 TPM 的口径一致）；
+      桶容量为 _BURST_S 秒的额度，预留制: 先扣额度再等待，排队者按到达顺序放行。0 = 不限
+    - 指标: 当前 / 最大排队深度、在途数、合并数、限流等待次数与时长、超时数，stats() 读取
+
+对外暴露:
+    GatewayConfig / GatewayTimeout
+    LLMGateway (call / acall / stream / astream / stats)
+    request_key(...) / estimate_tokens(...)
+    get_gateway() / configure(config)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Iterator, Optional
+
+
+# 桶容量 = 多少秒的额度（允许的突发）
+_BURST_S = 10.0
+
+
+# ============================================================
+# 配置
+# ============================================================
+
+@dataclass(frozen=True)
+class GatewayConfig:
+    """默认值对应 gpt-4o-mini 的 tier-1 限额，可被环境变量覆盖"""
+    max_concurrency: int = 16
+    rpm: float = 500.0                   # 每分钟请求数，0 = 不限
+    tpm: float = 200_000.0               # 每分钟 token 数，0 = 不限
+    queue_timeout_s: float = 60.0        # 等待槽位的上限
+    coalesce: bool = True
+
+    @classmethod
+    def from_env(cls) -> "GatewayConfig":
+        return cls(
+            max_concurrency=int(os.environ.get("LLM_GATEWAY_MAX_CONCURRENCY", 16)),
+            rpm=float(os.environ.get("LLM_GATEWAY_RPM", 500)),
+            tpm=float(os.environ.get("LLM_GATEWAY_TPM", 200_000)),
+            queue_timeout_s=float(os.environ.get("LLM_GATEWAY_QUEUE_TIMEOUT_S", 60)),
+            coalesce=os.environ.get("LLM_GATEWAY_COALESCE", "1") != "0",
+        )
+
+
+class GatewayTimeout(TimeoutError):
+    """排队等待并发槽位超时"""
+
+
+# ============================================================
+# Key / 成本估算
+# ============================================================
+
+def request_key(api_key: str, base_url: Optional[str], model: str,
+                system_prompt: str, user_query: str, stream: bool, **params) -> str:
+    """所有会影响响应的输入规范化后取 sha256；流式与非流式分开合并"""
+    payload = json.dumps(
+        {"api_key": api_key, "base_url": base_url, "model": model, "system": system_prompt,
+         "user": user_query, "stream": stream, "params": params},
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(system_prompt: str, user_query: str, max_tokens: int) -> int:
+    """TPM 成本: prompt 按 4 字符 / token 估算 + 最多生成的 token"""
+    return (len(system_prompt) + len(user_query) + 3) // 4 + max_tokens
+
+
+# ============================================================
+# 令牌桶
+# ============================================================
+
+class _TokenBucket:
+    """预留制令牌桶: reserve(cost) 立即扣额度（可以扣成负数），返回需要等待的秒数"""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * _BURST_S)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, cost: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= min(cost, self.capacity)   # 单个超大请求最多等一整桶
+            return max(0.0, -self._tokens / self.rate)
+
+
+# ============================================================
+# 并发槽位（同步线程与协程共用）
+# ============================================================
+
+class _Waiter:
+    __slots__ = ("event", "loop", "future", "granted")
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+        self.granted = False
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Slots:
+    """
+    FIFO 信号量。release 时槽位直接交给队首等待者（同步 → Event，异步 → 所属 loop 的 Future），
+    因此线程和协程可以公平地共用同一个上限。
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._waiters: "deque[_Waiter]" = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    def _try_acquire(self, waiter: _Waiter) -> bool:
+        with self._lock:
+            if self._in_use < self.limit and not self._waiters:
+                self._in_use += 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """等待者放弃（超时 / 取消）: 返回 True 表示槽位其实已经交到它手上"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def acquire(self, timeout: float):
+        waiter = _Waiter()
+        if self._try_acquire(waiter):
+            return
+        if not waiter.event.wait(timeout) and not self._abandon(waiter):
+            raise GatewayTimeout(f"LLM gateway queue wait exceeded {timeout:.0f}s")
+
+    async def aacquire(self, timeout: float):
+        waiter = _Waiter(asyncio.get_running_loop())
+        if self._try_acquire(waiter):
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            if not self._abandon(waiter):
+                raise GatewayTimeout(f"LLM gateway queue wait exceeded {timeout:.0f}s") from None
+        except asyncio.CancelledError:
+            if self._abandon(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self._in_use -= 1
+                return
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+        if waiter.loop is None:
+            waiter.event.set()
+            return
+        try:
+            waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+        except RuntimeError:
+            # 等待者所在的 event loop 已关闭，没人会来取这个槽位，交给下一个
+            self.release()
+
+
+# ============================================================
+# 在途请求（合并用）
+# ============================================================
+
+class _Flight:
+    """一次非流式请求: follower 等 done 之后读 value / error"""
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.done = threading.Event()
+        self.future = loop.create_future() if loop is not None else None
+        self.value = None
+        self.error: Optional[BaseException] = None
+
+
+class _StreamFlight:
+    """一次流式请求: leader 追加 chunks，follower 从头回放并跟随"""
+
+    def __init__(self, is_async: bool = False):
+        self.cond = asyncio.Condition() if is_async else threading.Condition()
+        self.chunks: list = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+# ============================================================
+# LLMGateway
+# ============================================================
+
+class LLMGateway:
+    """
+    call(key, fn, cost) / acall(key, coro_fn, cost):
+        非流式；fn() 在拿到限流额度和并发槽位后执行，返回值共享给同 key 的 follower
+    stream(key, open_stream, cost) / astream(key, open_stream, cost):
+        流式；open_stream() 返回 delta 迭代器，整个流读完前一直占用槽位
+    """
+
+    def __init__(self, config: GatewayConfig = GatewayConfig()):
+        self.config = config
+        self._slots = _Slots(config.max_concurrency)
+        self._rpm = _TokenBucket(config.rpm)
+        self._tpm = _TokenBucket(config.tpm)
+        self._lock = threading.Lock()
+        self._flights: dict = {}           # key → _Flight / _StreamFlight（异步的 key 带 loop id）
+        self._queued = 0                   # 正在限流等待或排队等槽位的请求
+        self._stats = {
+            "requests": 0, "upstream": 0, "coalesced": 0, "errors": 0, "timeouts": 0,
+            "throttled": 0, "throttle_wait_s": 0.0, "queue_wait_s": 0.0, "max_queued": 0,
+            "max_in_flight": 0,
+        }
+
+    # ── 指标 ──
+    def _count(self, key: str, delta=1):
+        with self._lock:
+            self._stats[key] += delta
+
+    def _enter_queue(self):
+        with self._lock:
+            self._queued += 1
+            self._stats["max_queued"] = max(self._stats["max_queued"], self._queued)
+
+    def _exit_queue(self, waited_s: float, admitted: bool):
+        with self._lock:
+            self._queued -= 1
+            self._stats["queue_wait_s"] += waited_s
+            if admitted:
+                self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._slots.in_use)
+            else:
+                self._stats["timeouts"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "queued": self._queued,
+                "in_flight": self._slots.in_use,
+                "max_concurrency": self._slots.limit,
+            }
+
+    # ── 准入: 限流 → 并发槽位 ──
+    def _throttle_wait(self, cost: int) -> float:
+        wait = max(self._rpm.reserve(1), self._tpm.reserve(cost))
+        if wait > 0:
+            with self._lock:
+                self._stats["throttled"] += 1
+                self._stats["throttle_wait_s"] += wait
+        return wait
+
+    def _admit(self, cost: int):
+        wait = self._throttle_wait(cost)
+        t0 = time.perf_counter()
+        self._enter_queue()
+        admitted = False
+        try:
+            if wait > 0:
+                time.sleep(wait)
+            self._slots.acquire(self.config.queue_timeout_s)
+            admitted = True
+        finally:
+            self._exit_queue(time.perf_counter() - t0, admitted)
+
+    async def _aadmit(self, cost: int):
+        wait = self._throttle_wait(cost)
+        t0 = time.perf_counter()
+        self._enter_queue()
+        admitted = False
+        try:
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self._slots.aacquire(self.config.queue_timeout_s)
+            admitted = True
+        finally:
+            self._exit_queue(time.perf_counter() - t0, admitted)
+
+    # ── 合并: 登记 / 加入在途请求 ──
+    def _join(self, key, new_flight: Callable[[], object]):
+        """返回 (flight, is_leader)；不合并时每次都是新的 leader"""
+        self._count("requests")
+        if not self.config.coalesce:
+            return new_flight(), True
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._stats["coalesced"] += 1
+                if isinstance(flight, _StreamFlight):
+                    flight.followers += 1
+                return flight, False
+            flight = new_flight()
+            self._flights[key] = flight
+            return flight, True
+
+    def _leave(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _close_if_unshared(self, key, flight: _StreamFlight) -> bool:
+        """leader 放弃流时: 没有 follower 就注销 flight（之后也不会再有人加入），返回 True"""
+        with self._lock:
+            if flight.followers > 0:
+                return False
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            return True
+
+    # ── 非流式 ──
+    def call(self, key: str, fn: Callable[[], object], cost: int):
+        flight, is_leader = self._join(key, _Flight)
+        if not is_leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            self._admit(cost)
+            try:
+                self._count("upstream")
+                flight.value = fn()
+                return flight.value
+            finally:
+                self._slots.release()
+        except BaseException as e:
+            flight.error = e
+            self._count("errors")
+            raise
+        finally:
+            self._leave(key, flight)
+            flight.done.set()
+
+    async def acall(self, key: str, fn: Callable[[], Awaitable], cost: int):
+        loop = asyncio.get_running_loop()
+        flight, is_leader = self._join((id(loop), key), lambda: _Flight(loop))
+        if not is_leader:
+            await asyncio.shield(flight.future)
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            await self._aadmit(cost)
+            try:
+                self._count("upstream")
+                flight.value = await fn()
+                return flight.value
+            finally:
+                self._slots.release()
+        except BaseException as e:
+            flight.error = e
+            self._count("errors")
+            raise
+        finally:
+            self._leave((id(loop), key), flight)
+            _resolve(flight.future)
+
+    # ── 流式 ──
+    def stream(self, key: str, open_stream: Callable[[], Iterator[str]], cost: int) -> Iterator[str]:
+        # 生成器: 第一次 next() 时才登记 flight，创建了却没被迭代的流不会挂住 follower
+        flight, is_leader = self._join(key, _StreamFlight)
+        if is_leader:
+            yield from self._lead_stream(key, flight, open_stream, cost)
+        else:
+            yield from self._follow_stream(flight)
+
+    def _finish_stream(self, key, flight: _StreamFlight, error: Optional[BaseException]):
+        self._leave(key, flight)
+        with flight.cond:
+            flight.error = error
+            flight.done = True
+            flight.cond.notify_all()
+
+    def _pump(self, key, flight: _StreamFlight, upstream: Iterator[str]) -> Iterator[str]:
+        """从上游读一块、记一块、交出一块；读完 / 出错时结束 flight 并释放槽位"""
+        try:
+            for delta in upstream:
+                with flight.cond:
+                    flight.chunks.append(delta)
+                    flight.cond.notify_all()
+                yield delta
+        except GeneratorExit:
+            # 没有 follower 时由 leader 关闭: 关掉上游连接，结束 flight
+            getattr(upstream, "close", lambda: None)()
+            self._finish_stream(key, flight, None)
+            self._slots.release()
+            raise
+        except BaseException as e:
+            self._count("errors")
+            self._finish_stream(key, flight, e)
+            self._slots.release()
+            raise
+        self._finish_stream(key, flight, None)
+        self._slots.release()
+
+    def _lead_stream(self, key, flight: _StreamFlight, open_stream, cost: int) -> Iterator[str]:
+        try:
+            self._admit(cost)
+        except BaseException as e:
+            self._finish_stream(key, flight, e)
+            raise
+        try:
+            self._count("upstream")
+            upstream = open_stream()
+        except BaseException as e:
+            self._count("errors")
+            self._finish_stream(key, flight, e)
+            self._slots.release()
+            raise
+
+        # 不用 yield from: 消费方关闭本生成器时 pump 要保持原样，才能交给后台读完
+        pump = self._pump(key, flight, upstream)
+        try:
+            for delta in pump:
+                yield delta
+        except GeneratorExit:
+            if self._close_if_unshared(key, flight):
+                pump.close()
+            else:
+                threading.Thread(target=lambda: [None for _ in pump], daemon=True).start()
+            raise
+
+    def _follow_stream(self, flight: _StreamFlight) -> Iterator[str]:
+        i = 0
+        while True:
+            with flight.cond:
+                while i >= len(flight.chunks) and not flight.done:
+                    flight.cond.wait()
+                batch = flight.chunks[i:]
+                i += len(batch)
+                if not batch:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+            yield from batch
+
+    async def astream(self, key: str, open_stream: Callable[[], Awaitable[AsyncIterator[str]]],
+                      cost: int) -> AsyncIterator[str]:
+        loop_key = (id(asyncio.get_running_loop()), key)
+        flight, is_leader = self._join(loop_key, lambda: _StreamFlight(is_async=True))
+        inner = (self._alead_stream(loop_key, flight, open_stream, cost) if is_leader
+                 else self._afollow_stream(flight))
+        try:
+            async for delta in inner:
+                yield delta
+        finally:
+            await inner.aclose()
+
+    async def _afinish_stream(self, key, flight: _StreamFlight, error: Optional[BaseException]):
+        self._leave(key, flight)
+        async with flight.cond:
+            flight.error = error
+            flight.done = True
+            flight.cond.notify_all()
+
+    async def _apump(self, key, flight: _StreamFlight, upstream: AsyncIterator[str]):
+        try:
+            async for delta in upstream:
+                async with flight.cond:
+                    flight.chunks.append(delta)
+                    flight.cond.notify_all()
+                yield delta
+        except GeneratorExit:
+            await upstream.aclose()
+            await self._afinish_stream(key, flight, None)
+            self._slots.release()
+            raise
+        except asyncio.CancelledError:
+            # leader 的任务被取消: follower 收到普通异常，而不是别人任务的 CancelledError
+            await self._afinish_stream(key, flight, RuntimeError("coalesced LLM stream was cancelled"))
+            self._slots.release()
+            raise
+        except BaseException as e:
+            self._count("errors")
+            await self._afinish_stream(key, flight, e)
+            self._slots.release()
+            raise
+        await self._afinish_stream(key, flight, None)
+        self._slots.release()
+
+    async def _alead_stream(self, key, flight: _StreamFlight, open_stream, cost: int):
+        try:
+            await self._aadmit(cost)
+        except BaseException as e:
+            await self._afinish_stream(key, flight, e)
+            raise
+        try:
+            self._count("upstream")
+            upstream = await open_stream()
+        except BaseException as e:
+            self._count("errors")
+            await self._afinish_stream(key, flight, e)
+            self._slots.release()
+            raise
+
+        pump = self._apump(key, flight, upstream)
+        try:
+            async for delta in pump:
+                yield delta
+        except GeneratorExit:
+            if self._close_if_unshared(key, flight):
+                await pump.aclose()
+            else:
+                async def _drain():
+                    async for _ in pump:
+                        pass
+                asyncio.get_running_loop().create_task(_drain())
+            raise
+
+    async def _afollow_stream(self, flight: _StreamFlight):
+        i = 0
+        while True:
+            async with flight.cond:
+                while i >= len(flight.chunks) and not flight.done:
+                    await flight.cond.wait()
+                batch = flight.chunks[i:]
+                i += len(batch)
+                if not batch:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+            for delta in batch:
+                yield delta
+
+
+# ============================================================
+# PUBLIC: 进程级单例
+# ============================================================
+
+_gateway = LLMGateway(GatewayConfig.from_env())
+
+
+def get_gateway() -> LLMGateway:
+    return _gateway
+
+
+def configure(config: GatewayConfig):
+    """替换全局网关（测试 / 压测用）；旧网关上的在途请求照常完成"""
+    global _gateway
+    _gateway = LLMGateway(config)
@@ -0,0 +1,285 @@
+"""
+load_test.py — 三个 Copilot agent 的离线压测 harness
+
+背景:
+    没有办法在不花钱、不依赖 OpenAI 的情况下知道 Copilot 在多人并发时的表现:
+    吞吐多少、尾延迟多少、时间花在哪个节点上。
+
+设计:
+    - 启动 stub_llm_server（可配置延迟），llm_client 指向它，连接池按并发数放大
+    - 同一批查询（各 tab 的 Quick Questions）轮流发给:
+        simple → agent_logic.run_agent       (on_step 回调记录每个节点完成的时间)
+        lg     → agent_logic_lg.run_agent_stream   (同一个编译图，updates 事件记录节点完成时间)
+        gov    → agent_logic_gov.run_agent_stream
+      --mode async 时 lg / gov 改用 arun_agent_stream，在一个 event loop 上用 Semaphore 控制并发；
+      simple 没有异步版本，始终用线程池
+    - 默认关闭 llm_cache（否则同样的问题第二次起全部命中缓存，测不到 LLM 路径），--cache 打开
+    - llm_gateway 不限流、并发上限等于压测并发；相同请求合并默认关闭（理由同上），--coalesce 打开
+    - 报告: 吞吐 (req/s)、p50 / p95 / p99 端到端延迟、首 token 延迟、错误数、各节点耗时
+
+对外暴露:
+    run_load_test(agent, ctx, queries, requests, concurrency, mode) → LoadTestResult
+    命令行: python load_test.py --requests 300 --concurrency 50 --latency-ms 200 --token-ms 10 [--coalesce]
+"""
+
+import asyncio
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+import engine
+import graph_checkpoint
+import llm_cache
+import llm_client
+import llm_gateway
+import stub_llm_server
+
+import agent_logic
+import agent_logic_gov
+import agent_logic_lg
+
+
+AGENTS = ("simple", "lg", "gov")
+
+# 各 Copilot tab 的 Quick Questions + 一个复合问题（gov 会走 LLM 工具选择的多工具分支）
+DEFAULT_QUERIES = [
+    "Give me a quick snapshot of our current risk metrics - funded status, duration gap, and any concerns.",
+    "Check all risk limits and highlight any breaches or warnings that need immediate attention.",
+    "Run a stress test with rates up 100bp and equity down 15%. What's the impact?",
+    "I want to increase our duration hedge ratio to 85%. Check if this is compliant.",
+    "Which assets are most sensitive to interest rate changes?",
+    "Show current asset allocation",
+    "Check limit status and run a stress test with rates up 50bp",
+]
+
+_API_KEY = "stub"
+
+
+# ============================================================
+# 结果
+# ============================================================
+
+@dataclass
+class _Sample:
+    latency_s: float
+    ttft_s: float                               # 首个 token 事件；无流式时等于 latency
+    node_s: Dict[str, float]
+    error: bool
+
+
+@dataclass
+class LoadTestResult:
+    agent: str
+    mode: str
+    requests: int
+    concurrency: int
+    wall_s: float
+    samples: List[_Sample] = field(default_factory=list)
+
+    @property
+    def errors(self) -> int:
+        return sum(s.error for s in self.samples)
+
+    @property
+    def throughput(self) -> float:
+        return len(self.samples) / self.wall_s if self.wall_s else 0.0
+
+    def latency_ms(self, pct: float) -> float:
+        return float(np.percentile([s.latency_s for s in self.samples], pct) * 1000)
+
+    def ttft_ms(self, pct: float) -> float:
+        return float(np.percentile([s.ttft_s for s in self.samples], pct) * 1000)
+
+    def node_table(self) -> pd.DataFrame:
+        """各节点耗时: 调用次数 / mean / p95 (ms)"""
+        per_node = defaultdict(list)
+        for sample in self.samples:
+            for node, seconds in sample.node_s.items():
+                per_node[node].append(seconds * 1000)
+        return pd.DataFrame([
+            {"node": node, "calls": len(v), "mean_ms": np.mean(v), "p95_ms": np.percentile(v, 95)}
+            for node, v in per_node.items()
+        ])
+
+
+# ============================================================
+# 单次请求（记录节点耗时）
+# ============================================================
+
+def _add_node_time(node_s: Dict[str, float], node: str, seconds: float):
+    # refine ⇄ audit 可能循环多次，同一节点累加
+    node_s[node] = node_s.get(node, 0.0) + seconds
+
+
+def _run_simple(query: str, ctx, system_prompt: str) -> _Sample:
+    node_s: Dict[str, float] = {}
+    t0 = last = time.perf_counter()
+
+    def _on_step(step):
+        nonlocal last
+        now = time.perf_counter()
+        _add_node_time(node_s, step.node, now - last)
+        last = now
+
+    _, steps = agent_logic.run_agent(query, ctx, system_prompt, _API_KEY, on_step=_on_step)
+    latency = time.perf_counter() - t0
+    return _Sample(latency, latency, node_s, any(s.status == "error" for s in steps))
+
+
+def _stream_args(agent: str, query: str, ctx, system_prompt: str):
+    if agent == "lg":
+        return agent_logic_lg, (query, ctx, system_prompt, _API_KEY)
+    return agent_logic_gov, (query, ctx, _API_KEY)
+
+
+def _run_graph(agent: str, query: str, ctx, system_prompt: str) -> _Sample:
+    module, args = _stream_args(agent, query, ctx, system_prompt)
+    node_s: Dict[str, float] = {}
+    error = False
+    ttft = None
+    t0 = last = time.perf_counter()
+    for node_name, state, _ in module.run_agent_stream(*args):
+        now = time.perf_counter()
+        if node_name == module.TOKEN_EVENT:
+            ttft = ttft if ttft is not None else now - t0
+            continue
+        _add_node_time(node_s, node_name, now - last)
+        last = now
+        error = error or any(s.status == "error" for s in state.get("thinking_steps", [])[-1:])
+    latency = time.perf_counter() - t0
+    return _Sample(latency, ttft if ttft is not None else latency, node_s, error)
+
+
+async def _arun_graph(agent: str, query: str, ctx, system_prompt: str) -> _Sample:
+    module, args = _stream_args(agent, query, ctx, system_prompt)
+    node_s: Dict[str, float] = {}
+    error = False
+    ttft = None
+    t0 = last = time.perf_counter()
+    async for node_name, state, _ in module.arun_agent_stream(*args):
+        now = time.perf_counter()
+        if node_name == module.TOKEN_EVENT:
+            ttft = ttft if ttft is not None else now - t0
+            continue
+        _add_node_time(node_s, node_name, now - last)
+        last = now
+        error = error or any(s.status == "error" for s in state.get("thinking_steps", [])[-1:])
+    latency = time.perf_counter() - t0
+    return _Sample(latency, ttft if ttft is not None else latency, node_s, error)
+
+
+def _safe(fn, *args) -> _Sample:
+    """请求本身抛异常也算一个错误样本，不中断整轮压测"""
+    t0 = time.perf_counter()
+    try:
+        return fn(*args)
+    except Exception:
+        latency = time.perf_counter() - t0
+        return _Sample(latency, latency, {}, True)
+
+
+# ============================================================
+# PUBLIC: run_load_test
+# ============================================================
+
+def run_load_test(agent: str,
+                  ctx,
+                  queries: List[str] = DEFAULT_QUERIES,
+                  requests: int = 300,
+                  concurrency: int = 50,
+                  mode: str = "thread") -> LoadTestResult:
+    """对一个 agent 发 requests 个查询（轮流取 queries），最多 concurrency 个同时在途"""
+    system_prompt = (agent_logic_lg if agent == "lg" else agent_logic).build_system_prompt(ctx)
+    batch = [queries[i % len(queries)] for i in range(requests)]
+
+    if mode == "async" and agent != "simple":
+        async def _main():
+            sem = asyncio.Semaphore(concurrency)
+
+            async def _one(query):
+                async with sem:
+                    t0 = time.perf_counter()
+                    try:
+                        return await _arun_graph(agent, query, ctx, system_prompt)
+                    except Exception:
+                        latency = time.perf_counter() - t0
+                        return _Sample(latency, latency, {}, True)
+
+            return await asyncio.gather(*(_one(q) for q in batch))
+
+        t0 = time.perf_counter()
+        samples = asyncio.run(_main())
+        wall = time.perf_counter() - t0
+    else:
+        fn = _run_simple if agent == "simple" else (lambda q, c, p: _run_graph(agent, q, c, p))
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(lambda q: _safe(fn, q, ctx, system_prompt), batch))
+        wall = time.perf_counter() - t0
+        mode = "thread"
+
+    return LoadTestResult(agent, mode, requests, concurrency, wall, list(samples))
+
+
+def _load_ctx():
+    base = Path(__file__).resolve().parent / "data"
+    df_all = pd.read_csv(base / "hoopp_positions_sample.csv", parse_dates=["timestamp"])
+    df_policy = pd.read_csv(base / "policy_limit_management.csv")
+    return engine.build_context(df_all, df_policy, df_all["timestamp"].max())
+
+
+def _print_report(result: LoadTestResult):
+    print(f"\n=== {result.agent} ({result.mode}, {result.requests} req, concurrency {result.concurrency}) ===")
+    print(f"throughput {result.throughput:8.1f} req/s   wall {result.wall_s:6.2f}s   errors {result.errors}")
+    print(f"latency    p50 {result.latency_ms(50):7.0f}   p95 {result.latency_ms(95):7.0f}"
+          f"   p99 {result.latency_ms(99):7.0f} ms")
+    print(f"ttft       p50 {result.ttft_ms(50):7.0f}   p95 {result.ttft_ms(95):7.0f}"
+          f"   p99 {result.ttft_ms(99):7.0f} ms")
+    table = result.node_table()
+    if not table.empty:
+        print(table.to_string(index=False, float_format=lambda v: f"{v:8.1f}"))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline load test for the Copilot agents")
+    parser.add_argument("--agents", nargs="+", choices=AGENTS, default=list(AGENTS))
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mode", choices=("thread", "async"), default="thread")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="stub time-to-first-token")
+    parser.add_argument("--token-ms", type=float, default=10.0, help="stub delay between streamed chunks")
+    parser.add_argument("--cache", action="store_true", help="keep llm_cache enabled")
+    parser.add_argument("--coalesce", action="store_true", help="coalesce identical in-flight LLM requests")
+    parser.add_argument("--gateway-concurrency", type=int, default=None,
+                        help="llm_gateway concurrency cap (default: --concurrency)")
+    args = parser.parse_args()
+
+    server, url = stub_llm_server.start(stub_llm_server.StubConfig(
+        latency_ms=args.latency_ms, token_ms=args.token_ms, seed=0))
+    llm_client.configure(llm_client.LLMClientConfig(
+        base_url=url, max_connections=max(args.concurrency, 10), max_keepalive=max(args.concurrency, 10)))
+    if not args.cache:
+        # 容量为 0: put 之后立即淘汰，get 永远未命中
+        llm_cache.get_cache().max_entries = 0
+        llm_cache.get_cache().disk_dir = None
+    llm_gateway.configure(llm_gateway.GatewayConfig(
+        max_concurrency=args.gateway_concurrency or args.concurrency, rpm=0, tpm=0, coalesce=args.coalesce))
+    # "hedge 85%" 会停在审批上，压测产生的待审批线程不写进本地审批库
+    graph_checkpoint.GOV_CHECKPOINT_DB = ":memory:"
+
+    ctx = _load_ctx()
+    for agent in args.agents:
+        _print_report(run_load_test(agent, ctx, requests=args.requests,
+                                    concurrency=args.concurrency, mode=args.mode))
+    print(f"\nstub server: {server.stats()}")
+    print(f"llm gateway: {llm_gateway.get_gateway().stats()}")
+    llm_client.close_all()
+    server.shutdown()
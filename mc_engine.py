@@ -0,0 +1,371 @@
+"""
+mc_engine.py — 盈余 Monte Carlo 模拟（分块、内存有界、进程池并行、可复现）
+
+背景:
+    Stress Tab 只能看单个情景，var_engine 的历史模拟受限于历史天数（样本只有几天时
+    尾部分位数没有意义）。需要在选定日期的组合上模拟大量相关的因子冲击，
+    看盈余 / 融资比率的完整分布。
+
+设计:
+    - 与 calculate_metrics 同一套 Scheme A 线性模型: 因子 = 利率 (bp)、权益 (%)、通胀 (%)，
+      仓位敏感度取 ctx['stress_basis']，先汇总成 资产 / 负债 两列（3×2），
+      每条路径的 P&L 只是一次 3 维点积
+    - 冲击 ~ N(0, Σ)，Σ 可配置（默认 = MC_FACTOR_VOLS + MC_FACTOR_CORR，1 年期），
+      用 Cholesky 分解生成相关冲击
+    - 分块: 每块 MC_CHUNK_SIZE 条路径，块内算完立即归约成固定长度的直方图
+      （计数 + 损失和）和矩，不保留路径 → 内存与路径数无关
+      直方图边界按解析 σ（线性模型下盈余 P&L 是正态的）取 ±MC_RANGE_SIGMAS σ，两端各一个溢出桶，
+      VaR 在桶内线性插值，ES 用桶内损失和（溢出桶也精确计入）
+    - 并行（可选）: MC_WORKERS > 1 时块分发到进程池（spawn，Streamlit / LangGraph 的线程里 fork 不安全），
+      池进程级复用；默认 MC_WORKERS = 1 在本进程执行（百万路径级别进程池的启动 / 传输开销大于收益），
+      路径数不超过一块时也在本进程执行
+    - 可复现: SeedSequence(seed).spawn(块数)，块 i 永远用第 i 个子种子，
+      结果按块顺序归约 → 同一 seed 在任意 worker 数下结果一致
+    - 结果按 (ctx 指纹, Σ, 路径数, 块大小, seed) 进程级 LRU 缓存，切回同一天不重算
+
+对外暴露:
+    MC_PATHS / MC_CHUNK_SIZE / MC_WORKERS / MC_SEED / MC_BINS / MC_CONFIDENCES
+    default_covariance() → ndarray (3, 3)
+    MonteCarloResult (summary_df / histogram_df)
+    simulate(basis, cov, n_paths, chunk_size, seed, workers) → MonteCarloResult
+    simulate_context(ctx, cov, n_paths, seed) → MonteCarloResult   (带缓存)
+    shutdown()
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import var_engine
+
+
+MC_PATHS = int(os.environ.get("MC_PATHS", 1_000_000))
+MC_CHUNK_SIZE = int(os.environ.get("MC_CHUNK_SIZE", 65_536))
+# 默认本进程执行: 1M 路径本进程约 0.2s，spawn 池首次调用要 2–3s（子进程启动 + import），
+# 常驻后也不比本进程快；超大路径数 + 多核时再用 MC_WORKERS > 1 打开进程池
+MC_WORKERS = int(os.environ.get("MC_WORKERS", 1))
+MC_SEED = int(os.environ.get("MC_SEED", 20260130))
+MC_BINS = int(os.environ.get("MC_BINS", 400))
+
+# 直方图覆盖 ±MC_RANGE_SIGMAS 个解析 σ，之外落入溢出桶
+MC_RANGE_SIGMAS = float(os.environ.get("MC_RANGE_SIGMAS", 8.0))
+
+# 默认 1 年期因子波动（单位同 calculate_metrics: bp / % / %）与相关系数
+# MC_FACTOR_CORR 为上三角: rate-equity, rate-inflation, equity-inflation
+MC_FACTOR_VOLS = tuple(float(v) for v in os.environ.get("MC_FACTOR_VOLS", "100,16,1.0").split(","))
+MC_FACTOR_CORR = tuple(float(v) for v in os.environ.get("MC_FACTOR_CORR", "0.2,0.4,-0.1").split(","))
+
+MC_CONFIDENCES = (0.95, 0.975, 0.99)
+
+_RESULT_CACHE_SIZE = 16
+
+
+# ============================================================
+# 协方差
+# ============================================================
+
+def default_covariance(vols: Sequence[float] = MC_FACTOR_VOLS,
+                       corr_upper: Sequence[float] = MC_FACTOR_CORR) -> np.ndarray:
+    """波动 + 上三角相关系数 → 3×3 协方差矩阵"""
+    rho_re, rho_ri, rho_ei = corr_upper
+    corr = np.array([
+        [1.0,    rho_re, rho_ri],
+        [rho_re, 1.0,    rho_ei],
+        [rho_ri, rho_ei, 1.0],
+    ])
+    vols = np.asarray(vols, dtype=float)
+    return corr * np.outer(vols, vols)
+
+
+def _cholesky(cov: np.ndarray) -> np.ndarray:
+    """Cholesky 分解；半正定（某个因子波动为 0）时加极小对角项"""
+    cov = np.asarray(cov, dtype=float)
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        jitter = 1e-12 * max(np.trace(cov), 1.0)
+        return np.linalg.cholesky(cov + jitter * np.eye(len(cov)))
+
+
+# ============================================================
+# 单块模拟（进程池 worker，必须是模块级函数）
+# ============================================================
+
+def _bin_index(values: np.ndarray, edges: np.ndarray) -> np.ndarray:
+    """0 = 下溢桶，1..B = 正常桶，B+1 = 上溢桶"""
+    return np.searchsorted(edges, values, side='right')
+
+
+def _simulate_chunk(task: tuple) -> dict:
+    seed_seq, n, chol, sens, total_assets, total_liabilities, loss_edges, funded_edges = task
+    rng = np.random.default_rng(seed_seq)
+
+    shocks = rng.standard_normal((n, 3)) @ chol.T          # (n, 3) 相关冲击
+    pnl = shocks @ sens                                    # (n, 2) 资产 / 负债 P&L
+    loss = -(pnl[:, 0] + pnl[:, 1])
+    stressed_liabilities = total_liabilities - pnl[:, 1]
+    funded = (total_assets + pnl[:, 0]) / stressed_liabilities
+
+    n_slots = len(loss_edges) + 1
+    loss_idx = _bin_index(loss, loss_edges)
+    funded_idx = _bin_index(funded, funded_edges)
+    return {
+        "loss_counts":   np.bincount(loss_idx, minlength=n_slots),
+        "loss_sums":     np.bincount(loss_idx, weights=loss, minlength=n_slots),
+        "funded_counts": np.bincount(funded_idx, minlength=len(funded_edges) + 1),
+        "sum":           loss.sum(),
+        "sumsq":         np.dot(loss, loss),
+        "underfunded":   int(np.count_nonzero(funded < 1.0)),
+    }
+
+
+# ============================================================
+# 进程池
+# ============================================================
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def shutdown():
+    """关闭进程池（测试 / 进程退出时用）"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+        _pool, _pool_workers = None, 0
+
+
+# ============================================================
+# 结果
+# ============================================================
+
+@dataclass
+class MonteCarloResult:
+    """分块归约后的分布（只有直方图和矩，不含路径）"""
+    n_paths: int
+    seed: int
+    chunk_size: int
+    workers: int
+    base_surplus: float
+    base_funded: float
+    loss_edges: np.ndarray      # (B+1,) 盈余损失（= −ΔSurplus）的桶边界
+    loss_counts: np.ndarray     # (B+2,) 含两端溢出桶
+    loss_sums: np.ndarray       # (B+2,) 每个桶内损失之和
+    funded_edges: np.ndarray
+    funded_counts: np.ndarray
+    mean_pnl: float
+    std_pnl: float
+    prob_underfunded: float
+    elapsed_s: float
+
+    @property
+    def n_chunks(self) -> int:
+        return -(-self.n_paths // self.chunk_size)
+
+    def surplus_var(self, confidence: float) -> Tuple[float, float]:
+        """(VaR, ES)，桶内线性插值"""
+        var, es = _tail_from_histogram(self.loss_edges, self.loss_counts, self.loss_sums,
+                                       np.array([confidence]), self.n_paths)
+        return float(var[0]), float(es[0])
+
+    def summary_df(self, confidences: Sequence[float] = MC_CONFIDENCES) -> pd.DataFrame:
+        """confidence | surplus_var | surplus_es | funded_floor（融资比率的 1−α 分位数）"""
+        levels = np.asarray(confidences, dtype=float)
+        var, es = _tail_from_histogram(self.loss_edges, self.loss_counts, self.loss_sums,
+                                       levels, self.n_paths)
+        floor = _quantile_from_histogram(self.funded_edges, self.funded_counts, 1.0 - levels, self.n_paths)
+        return pd.DataFrame({
+            'confidence':   levels,
+            'surplus_var':  var,
+            'surplus_es':   es,
+            'funded_floor': floor,
+        })
+
+    def histogram_df(self) -> pd.DataFrame:
+        """ΔSurplus 分布（图表用）: surplus_pnl（桶中点） | probability；溢出桶和两端的空桶不画"""
+        mids = (self.loss_edges[:-1] + self.loss_edges[1:]) / 2
+        counts = self.loss_counts[1:-1]
+        filled = np.flatnonzero(counts)
+        keep = slice(filled[0], filled[-1] + 1) if len(filled) else slice(0, 0)
+        return pd.DataFrame({
+            'surplus_pnl': -mids[keep][::-1],
+            'probability': counts[keep][::-1] / self.n_paths,
+        })
+
+
+def _slot_bounds(edges: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """每个桶（含溢出桶）的上下界；溢出桶按边界处理"""
+    lo = np.concatenate([[edges[0]], edges])
+    hi = np.concatenate([edges, [edges[-1]]])
+    return lo, hi
+
+
+def _quantile_from_histogram(edges: np.ndarray, counts: np.ndarray,
+                             levels: np.ndarray, n: int) -> np.ndarray:
+    cdf = np.cumsum(counts)
+    target = np.clip(levels * n, 0, n)
+    k = np.minimum(np.searchsorted(cdf, target, side='left'), len(counts) - 1)
+    below = cdf[k] - counts[k]
+    frac = np.divide(target - below, counts[k], out=np.zeros_like(target), where=counts[k] > 0)
+    lo, hi = _slot_bounds(edges)
+    return lo[k] + frac * (hi[k] - lo[k])
+
+
+def _tail_from_histogram(edges: np.ndarray, counts: np.ndarray, sums: np.ndarray,
+                         levels: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """损失直方图 → VaR（α 分位数）与 ES（超过 VaR 的部分按桶内比例计入）"""
+    var = _quantile_from_histogram(edges, counts, levels, n)
+    cdf = np.cumsum(counts)
+    target = levels * n
+    k = np.minimum(np.searchsorted(cdf, target, side='left'), len(counts) - 1)
+    above = cdf[-1] - cdf[k]                                   # 严格高于 VaR 所在桶的路径数
+    tail_sums = np.concatenate([np.cumsum(sums[::-1])[::-1], [0.0]])
+    partial = cdf[k] - target                                  # VaR 所在桶里高于 VaR 的路径数
+    share = np.divide(partial, counts[k], out=np.zeros_like(target), where=counts[k] > 0)
+    tail_n = above + partial
+    es = np.divide(tail_sums[k + 1] + share * sums[k], tail_n,
+                   out=var.copy(), where=tail_n > 0)
+    return var, es
+
+
+# ============================================================
+# PUBLIC: simulate
+# ============================================================
+
+def simulate(basis: dict,
+             cov: Optional[np.ndarray] = None,
+             n_paths: int = MC_PATHS,
+             chunk_size: int = MC_CHUNK_SIZE,
+             seed: int = MC_SEED,
+             workers: int = MC_WORKERS,
+             bins: int = MC_BINS) -> MonteCarloResult:
+    """
+    在 build_stress_basis 的敏感度上模拟 n_paths 条相关因子冲击。
+
+    cov: 3×3 因子协方差（顺序同 var_engine.FACTOR_COLUMNS），None → default_covariance()
+    同一 (basis, cov, n_paths, chunk_size, seed) 的结果与 workers 无关。
+    n_paths / chunk_size < 1 → ValueError
+    """
+    if n_paths < 1 or chunk_size < 1:
+        raise ValueError(f"n_paths and chunk_size must be >= 1 (got {n_paths}, {chunk_size})")
+
+    start = time.perf_counter()
+    cov = default_covariance() if cov is None else np.asarray(cov, dtype=float)
+    chol = _cholesky(cov)
+
+    sens = var_engine.factor_sensitivities(basis)                 # (3, 2)
+    is_asset = np.asarray(basis['is_asset'], dtype=bool)
+    total_assets = float(basis['mtm'][is_asset].sum())
+    total_liabilities = float(abs(basis['mtm'][~is_asset].sum()))
+    base_funded = total_assets / total_liabilities if total_liabilities != 0 else 0.0
+
+    # 解析 σ 定直方图范围: 盈余 P&L 线性 → 正态；融资比率用 delta 法
+    surplus_grad = sens.sum(axis=1)
+    funded_grad = (sens[:, 0] / total_liabilities + sens[:, 1] * total_assets / total_liabilities ** 2
+                   if total_liabilities != 0 else np.zeros(3))
+    loss_sigma = max(float(np.sqrt(surplus_grad @ cov @ surplus_grad)), 1e-9)
+    funded_sigma = max(float(np.sqrt(funded_grad @ cov @ funded_grad)), 1e-9)
+    loss_edges = np.linspace(-MC_RANGE_SIGMAS * loss_sigma, MC_RANGE_SIGMAS * loss_sigma, bins + 1)
+    funded_edges = np.linspace(base_funded - MC_RANGE_SIGMAS * funded_sigma,
+                               base_funded + MC_RANGE_SIGMAS * funded_sigma, bins + 1)
+
+    sizes = [chunk_size] * (n_paths // chunk_size)
+    if n_paths % chunk_size:
+        sizes.append(n_paths % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(s, n, chol, sens, total_assets, total_liabilities, loss_edges, funded_edges)
+             for s, n in zip(seeds, sizes)]
+
+    used_workers = min(workers, len(tasks))
+    if used_workers > 1:
+        try:
+            partials = list(_get_pool(used_workers).map(_simulate_chunk, tasks))
+        except (BrokenProcessPool, OSError):
+            # 进程池不可用（沙箱 / 资源限制）时退回本进程，结果相同
+            shutdown()
+            used_workers = 1
+            partials = [_simulate_chunk(t) for t in tasks]
+    else:
+        used_workers = 1
+        partials = [_simulate_chunk(t) for t in tasks]
+
+    # 按块顺序归约 → 与 worker 数无关
+    loss_counts = np.sum([p["loss_counts"] for p in partials], axis=0)
+    loss_sums = np.sum([p["loss_sums"] for p in partials], axis=0)
+    funded_counts = np.sum([p["funded_counts"] for p in partials], axis=0)
+    total = sum(p["sum"] for p in partials)
+    total_sq = sum(p["sumsq"] for p in partials)
+    mean_loss = total / n_paths
+    variance = max(total_sq / n_paths - mean_loss ** 2, 0.0)
+
+    return MonteCarloResult(
+        n_paths=n_paths,
+        seed=seed,
+        chunk_size=chunk_size,
+        workers=used_workers,
+        base_surplus=total_assets - total_liabilities,
+        base_funded=base_funded,
+        loss_edges=loss_edges,
+        loss_counts=loss_counts,
+        loss_sums=loss_sums,
+        funded_edges=funded_edges,
+        funded_counts=funded_counts,
+        mean_pnl=-mean_loss,
+        std_pnl=float(np.sqrt(variance)),
+        prob_underfunded=sum(p["underfunded"] for p in partials) / n_paths,
+        elapsed_s=time.perf_counter() - start,
+    )
+
+
+# ============================================================
+# PUBLIC: simulate_context（按 ctx 指纹缓存）
+# ============================================================
+
+_results: "OrderedDict[tuple, MonteCarloResult]" = OrderedDict()
+_results_lock = threading.Lock()
+
+
+def simulate_context(ctx: dict,
+                     cov: Optional[np.ndarray] = None,
+                     n_paths: int = MC_PATHS,
+                     seed: int = MC_SEED) -> MonteCarloResult:
+    """ctx['stress_basis'] 上的 simulate；同一 ctx 指纹 + 参数直接返回缓存结果"""
+    cov = default_covariance() if cov is None else np.asarray(cov, dtype=float)
+    key = (ctx.get('fingerprint'), cov.round(12).tobytes(), n_paths, MC_CHUNK_SIZE, seed)
+    with _results_lock:
+        cached = _results.get(key)
+        if cached is not None:
+            _results.move_to_end(key)
+            return cached
+
+    result = simulate(ctx['stress_basis'], cov, n_paths=n_paths, seed=seed)
+
+    if key[0] is not None:
+        with _results_lock:
+            _results[key] = result
+            while len(_results) > _RESULT_CACHE_SIZE:
+                _results.popitem(last=False)
+    return result
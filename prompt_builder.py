@@ -0,0 +1,243 @@
+"""
+prompt_builder.py — 紧凑、按 ctx 指纹缓存的 prompt 上下文
+
+背景:
+    agent_logic.build_system_prompt / agent_logic_lg.build_system_prompt / engine._build_ai_summary
+    每轮对话都从 ctx 重新拼一遍快照: DataFrame.to_string 的对齐空格、6 位小数和 emoji 状态
+    占掉了大部分 token；_build_ai_summary 还用 iterrows 逐行拼接，并且把
+    available_dates[-1]（最新日期）当成快照日期，选历史日期时日期是错的。
+
+设计:
+    - 一个 builder 产出有优先级的 section: snapshot（KPI，必留）→ allocation（配置 vs 政策表）
+    - 紧凑表格编码: `|` 分隔，权重用 1 位小数的百分数，allocation 与 limit 合并为一张表，
+      状态用 OK / WARN / BREACH，按列格式化（不用 iterrows）
+    - token 预算 (PROMPT_TOKEN_BUDGET): 超出时按优先级从低到高把 section 换成摘要版，
+      仍超出再整段省略；snapshot 永远保留
+    - 结果按 (ctx 指纹, 预算) memoize，同一个 ctx 的后续对话轮直接复用
+    - token 计数: 装了 tiktoken 用 tiktoken，否则按 4 字符 / token 估算
+
+对外暴露:
+    PromptContext (text / tokens / summarized / omitted)
+    build_prompt_context(ctx, token_budget) → PromptContext
+    count_tokens(text) → int
+    prompt_cache_stats() / clear_prompt_cache()
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 400))
+PROMPT_CACHE_MAX_ENTRIES = 64
+
+# 摘要版 allocation 表保留的偏离最大的行数
+_SUMMARY_TOP_DEVIATIONS = 3
+
+_STATUS_CODES = (("BREACH", "BREACH"), ("WARN", "WARN"), ("OK", "OK"))
+
+
+# ============================================================
+# 数据结构
+# ============================================================
+
+@dataclass
+class _Section:
+    name: str
+    priority: int            # 0 = 必留；数字越大越先被摘要 / 省略
+    full: str
+    summary: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class PromptContext:
+    """可直接拼进 system prompt 的快照文本"""
+    text: str
+    tokens: int
+    summarized: List[str] = field(default_factory=list)   # 被换成摘要版的 section
+    omitted: List[str] = field(default_factory=list)      # 预算内放不下、整段省略的 section
+
+
+# ============================================================
+# Token 计数
+# ============================================================
+
+_encoding = None
+_encoding_loaded = False
+
+
+def count_tokens(text: str) -> int:
+    """tiktoken 可用时精确计数，否则按 4 字符 / token 估算"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:   # 未安装，或离线时编码表下载失败
+            _encoding = None
+        _encoding_loaded = True
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+# ============================================================
+# Section 构建
+# ============================================================
+
+def _pct(values) -> List[str]:
+    """权重列 → 百分数字符串（1 位小数，去掉多余的 .0），缺失值写 '-'"""
+    out = []
+    for v in values:
+        if v != v:   # NaN
+            out.append("-")
+        else:
+            text = f"{v * 100:.1f}"
+            out.append(text[:-2] if text.endswith(".0") else text)
+    return out
+
+
+def _status_code(status: str) -> str:
+    """'🔴 BREACH' / '🟡 WARN' / '🟢 OK' → BREACH / WARN / OK（去掉 emoji）"""
+    for needle, label in _STATUS_CODES:
+        if needle in status:
+            return label
+    return status
+
+
+def _snapshot_section(ctx: dict) -> _Section:
+    fs = ctx['funded_status']
+    a_d, l_d = ctx['asset_dur'], ctx['liability_dur']
+
+    limits = ctx['limits_df']
+    breaches = limits.loc[limits['Status'].str.contains('BREACH', regex=False), 'asset_class']
+    breach_str = ", ".join(breaches) if len(breaches) else "None"
+
+    text = (
+        f"=== PORTFOLIO SNAPSHOT ({pd.Timestamp(ctx['selected_date']).date()}) ===\n"
+        f"Funded {fs:.1%} (target 111%) | Assets ${ctx['total_assets']/1000:.1f}B"
+        f" | Liabilities ${ctx['total_liabilities']/1000:.1f}B | Surplus ${ctx['surplus']/1000:.1f}B\n"
+        f"Duration asset {a_d:.1f}y | liability {l_d:.1f}y | gap {a_d - l_d:.1f}y\n"
+        f"FX exposure {ctx['fx_pct']:.1%} (limit 15%)\n"
+        f"Breaches: {breach_str}"
+    )
+    return _Section("snapshot", 0, text)
+
+
+def _allocation_section(ctx: dict) -> _Section:
+    """
+    配置 vs 政策 + 限额状态合成一张表: limits_df 已包含 comp_df 的全部资产类别，
+    外加 FX / Funded Status 两行全局限额（它们没有 policy target，写 '-'）。
+    按列格式化，不逐行 iterrows。
+    """
+    df = ctx['limits_df']
+    targets = ctx['comp_df'].set_index('asset_class')['policy_target']
+    weight = df['current_weight'].to_numpy(dtype=float)
+    target = df['asset_class'].map(targets).to_numpy(dtype=float)
+    status = [_status_code(s) for s in df['Status']]
+
+    lines = [
+        "|".join(row)
+        for row in zip(df['asset_class'].astype(str), _pct(weight), _pct(target),
+                       _pct(df['range_min'].to_numpy(dtype=float)),
+                       _pct(df['range_max'].to_numpy(dtype=float)), status)
+    ]
+    header = "class|wt|tgt|min|max|status"
+    full = "=== ALLOCATION vs POLICY (weights in %) ===\n" + header + "\n" + "\n".join(lines)
+
+    # 摘要版: 非 OK 的行 + 偏离目标最大的几行
+    flagged = np.array([s != "OK" for s in status])
+    deviation = np.abs(weight - target)
+    deviation[np.isnan(deviation) | flagged] = -1.0
+    top = np.argsort(-deviation, kind="stable")[:_SUMMARY_TOP_DEVIATIONS]
+    keep = flagged.copy()
+    keep[top[deviation[top] >= 0]] = True
+    summary = (
+        "=== ALLOCATION vs POLICY (summary, weights in %) ===\n" + header + "\n"
+        + "\n".join(line for line, k in zip(lines, keep) if k)
+        + f"\n({int((~keep).sum())} other rows OK and closer to target)"
+    )
+    return _Section("allocation", 1, full, summary)
+
+
+def _fit_to_budget(sections: List[_Section], token_budget: int) -> PromptContext:
+    """按优先级从低到高先摘要、再省略，直到总 token 不超过预算（priority 0 永远保留）"""
+    chosen = {s.name: s.full for s in sections}
+    summarized, omitted = [], []
+
+    def _render() -> str:
+        return "\n\n".join(chosen[s.name] for s in sections if s.name in chosen)
+
+    text = _render()
+    tokens = count_tokens(text)
+    for section in sorted(sections, key=lambda s: -s.priority):
+        if tokens <= token_budget or section.priority == 0:
+            break
+        if section.summary is not None:
+            chosen[section.name] = section.summary
+            summarized.append(section.name)
+            text = _render()
+            tokens = count_tokens(text)
+        if tokens > token_budget:
+            del chosen[section.name]
+            omitted.append(section.name)
+            if section.name in summarized:
+                summarized.remove(section.name)
+            text = _render()
+            tokens = count_tokens(text)
+
+    return PromptContext(text=text, tokens=tokens, summarized=summarized, omitted=omitted)
+
+
+# ============================================================
+# 缓存
+# ============================================================
+
+_cache: "OrderedDict[tuple, PromptContext]" = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0}
+
+
+def prompt_cache_stats() -> dict:
+    with _cache_lock:
+        return {**_cache_stats, "entries": len(_cache)}
+
+
+def clear_prompt_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+# ============================================================
+# PUBLIC: build_prompt_context
+# ============================================================
+
+def build_prompt_context(ctx: dict, token_budget: int = PROMPT_TOKEN_BUDGET) -> PromptContext:
+    """
+    ctx → 紧凑快照文本（不含角色 / 指令，由各 agent 自己拼 header）。
+    ctx 带 fingerprint 时按 (fingerprint, token_budget) 缓存。
+    """
+    fingerprint = ctx.get('fingerprint')
+    key = (fingerprint, token_budget)
+    if fingerprint is not None:
+        with _cache_lock:
+            cached = _cache.get(key)
+            if cached is not None:
+                _cache.move_to_end(key)
+                _cache_stats["hits"] += 1
+                return cached
+
+    result = _fit_to_budget([_snapshot_section(ctx), _allocation_section(ctx)], token_budget)
+
+    if fingerprint is not None:
+        with _cache_lock:
+            _cache_stats["misses"] += 1
+            _cache[key] = result
+            while len(_cache) > PROMPT_CACHE_MAX_ENTRIES:
+                _cache.popitem(last=False)
+    return result
@@ -0,0 +1,136 @@
+"""
+risk_attribution.py — 盈余风险的 Euler 分解（仓位 → asset_class / sector / currency）
+
+背景:
+    comp_df 只告诉风险委员会各资产类别的权重，不告诉谁在驱动盈余波动:
+    权重 38% 的股票和权重 42% 的债券对盈余波动的贡献可以差一个数量级，
+    负债（久期 14.5 / 11.2）本身也是主要风险来源。
+
+设计:
+    - 盈余 P&L = Σ_i b_iᵀ f，b_i = 仓位 i 对 利率 / 权益 / 通胀 的单位冲击 P&L（stress_basis），
+      f ~ (0, Σ)，Σ = ctx 里的 EWMA 因子协方差（cov_service，1 日）
+    - σ = √(gᵀ Σ g)，g = Σ_i b_i；σ 是仓位规模的一次齐次函数，Euler 分解:
+          component_i = b_iᵀ Σ g / σ          Σ_i component_i = σ
+          marginal_i  = component_i / mtm_i   （仓位每增加 1 单位市值，σ 的变化）
+      全部仓位一个矩阵表达式: component = B @ (Σ g) / σ，B 为 N×3，不按仓位循环
+    - 按 asset_class / sector / currency 汇总: factorize + bincount（与 var_engine 相同的做法），
+      输出一张长表，每个维度内 risk_share 之和 = 1
+    - 负债行（asset_class = Obligations）照常参与: 它们对盈余波动的贡献往往最大
+
+对外暴露:
+    ATTRIBUTION_DIMENSIONS
+    position_contributions(basis, cov) → dict (sigma, component, marginal)
+    attribution_table(df_day, basis, cov) → DataFrame
+    tool_output(ctx, by, top_n) → dict   (Copilot get_risk_attribution，skills_v2 / agent_logic_gov 共用)
+"""
+
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from var_engine import unit_pnl
+
+
+ATTRIBUTION_DIMENSIONS = ('asset_class', 'sector', 'currency')
+
+_COLUMNS = ['dimension', 'group', 'mtm', 'weight', 'component', 'risk_share', 'marginal']
+
+
+# ============================================================
+# PUBLIC: position_contributions
+# ============================================================
+
+def position_contributions(basis: dict, cov: np.ndarray) -> dict:
+    """
+    每个仓位对盈余波动的 Euler 贡献。
+
+    cov: 因子协方差（期限决定 σ 的期限，贡献占比与期限无关）
+    返回:
+        sigma     : 盈余波动
+        component : (N,) 成分贡献，之和 = sigma
+        marginal  : (N,) 边际贡献（每 1 单位 mtm）；mtm = 0 的仓位为 0
+    """
+    b = unit_pnl(basis)                                           # (N, 3)
+    gradient = b.sum(axis=0)
+    sigma = float(np.sqrt(max(gradient @ cov @ gradient, 0.0)))
+    if sigma == 0.0:
+        zeros = np.zeros(len(b))
+        return {'sigma': 0.0, 'component': zeros, 'marginal': zeros.copy()}
+
+    component = b @ (cov @ gradient) / sigma
+    mtm = np.asarray(basis['mtm'], dtype=float)
+    marginal = np.divide(component, mtm, out=np.zeros_like(component), where=mtm != 0)
+    return {'sigma': sigma, 'component': component, 'marginal': marginal}
+
+
+# ============================================================
+# PUBLIC: attribution_table
+# ============================================================
+
+def attribution_table(df_day: pd.DataFrame, basis: dict, cov: Optional[np.ndarray]) -> pd.DataFrame:
+    """
+    按 ATTRIBUTION_DIMENSIONS 汇总的贡献长表（basis 与 df_day 行顺序一致，都来自 build_context）:
+        dimension | group | mtm | weight | component | risk_share | marginal
+    weight = mtm / 总资产（与 comp_df 同口径，负债为负）；每个维度按 component 降序。
+    cov 为 None（选定日期之前没有历史）时返回空表。
+    """
+    if cov is None:
+        return pd.DataFrame(columns=_COLUMNS)
+
+    contrib = position_contributions(basis, cov)
+    sigma = contrib['sigma']
+    mtm = np.asarray(basis['mtm'], dtype=float)
+    total_assets = mtm[np.asarray(basis['is_asset'], dtype=bool)].sum()
+
+    frames = []
+    for dimension in ATTRIBUTION_DIMENSIONS:
+        codes, groups = pd.factorize(df_day[dimension])
+        group_mtm = np.bincount(codes, weights=mtm, minlength=len(groups))
+        group_component = np.bincount(codes, weights=contrib['component'], minlength=len(groups))
+        frames.append(pd.DataFrame({
+            'dimension':  dimension,
+            'group':      np.asarray(groups, dtype=object),
+            'mtm':        group_mtm,
+            'weight':     group_mtm / total_assets if total_assets else 0.0,
+            'component':  group_component,
+            'risk_share': group_component / sigma if sigma else 0.0,
+            'marginal':   np.divide(group_component, group_mtm,
+                                    out=np.zeros_like(group_component), where=group_mtm != 0),
+        }).sort_values('component', ascending=False))
+    return pd.concat(frames, ignore_index=True)
+
+
+# ============================================================
+# PUBLIC: tool_output
+# ============================================================
+
+def tool_output(ctx: dict, by: str = 'asset_class', top_n: int = 8) -> dict:
+    """ctx['risk_attribution_df'] → Copilot 工具输出（纯 Python 值，可 JSON）"""
+    table = ctx['risk_attribution_df']
+    rows = table[table['dimension'] == by].head(top_n)
+    sigma = float(ctx['surplus_vol_1d'])
+
+    contributors = [
+        {
+            "group":      str(row.group),
+            "weight":     float(row.weight),
+            "risk_share": float(row.risk_share),
+            "component":  float(row.component),
+            "marginal":   float(row.marginal),
+        }
+        for row in rows.itertuples(index=False)
+    ]
+    if not contributors:
+        message = "No factor covariance before the selected date; risk attribution is not available."
+    else:
+        top = contributors[0]
+        message = (f"{top['group']} drives {top['risk_share']:.0%} of 1-day surplus volatility "
+                   f"(${sigma:,.0f}M) with a {top['weight']:.0%} weight")
+
+    return {
+        "by": by,
+        "surplus_vol_1d": sigma,
+        "contributors": contributors,
+        "message": message,
+    }
@@ -12,6 +12,8 @@ skills.py — Risk Engine Skills for AI Agent
 from typing import Optional
 from dataclasses import dataclass
 
+import audit_engine
+
 
 @dataclass
 class RiskMetrics:
@@ -163,30 +165,17 @@ def check_hedge_compliance(
     }
     
     limit_config = LIMITS.get(hedge_type, LIMITS["duration"])
-    max_ratio = limit_config.get("max_hedge_ratio", 1.0)
-    
-    # === 合规检查 ===
-    is_compliant = proposed_hedge_ratio <= max_ratio
-    
-    if is_compliant:
-        return {
-            "status": "PASS",
-            "proposed_ratio": proposed_hedge_ratio,
-            "max_allowed": max_ratio,
-            "message": f"✅ Hedge ratio {proposed_hedge_ratio:.0%} is within limit ({max_ratio:.0%})",
-            "recommendation": None,
-        }
+    
+    # === 合规检查: 操作后的组合对全部限额审计，同时解析求出最大合规比例 ===
+    result = audit_engine.audit_hedge(ctx, proposed_hedge_ratio, hedge_type, limit_config).to_tool_output()
+    
+    if result["status"] == "PASS":
+        result["message"] = f"✅ {result['message']}"
     else:
-        # 计算合规的替代方案
-        compliant_ratio = max_ratio * 0.95  # 留 5% buffer
-        return {
-            "status": "FAIL",
-            "proposed_ratio": proposed_hedge_ratio,
-            "max_allowed": max_ratio,
-            "message": f"❌ Hedge ratio {proposed_hedge_ratio:.0%} exceeds limit ({max_ratio:.0%})",
-            "recommendation": compliant_ratio,
-            "recommendation_message": f"💡 Suggested compliant ratio: {compliant_ratio:.0%}",
-        }
+        result["message"] = f"❌ {result['message']}"
+        if result["recommendation"] is not None:
+            result["recommendation_message"] = f"💡 Suggested compliant ratio: {result['recommendation']:.0%}"
+    return result
 
 
 def get_limit_status(ctx: dict) -> dict:
@@ -9,6 +9,8 @@ skills_v2.py — Risk Toolkit with Tool Calling Support
 架构定位:
     领域层 (Domain Layer) — 封装所有风险计算的业务逻辑
 
+工具输出按 (工具, 参数, ctx 指纹) 缓存（tool_cache），同一个 ctx 上的重复调用直接命中。
+
 使用方式:
     from skills_v2 import get_all_tools
     tools = get_all_tools()
@@ -19,6 +21,12 @@ from typing import Optional, List, Literal
 from pydantic import BaseModel, Field, field_validator
 from langchain_core.tools import tool
 
+import audit_engine
+import cov_service
+import risk_attribution
+import tool_cache
+import var_engine
+
 
 # ============================================================
 # Pydantic 参数模型 (Input Schemas)
@@ -71,6 +79,14 @@ class StressTestInput(BaseModel):
     )
 
 
+class RiskAttributionInput(BaseModel):
+    """Input parameters for surplus risk attribution"""
+    by: Literal["asset_class", "sector", "currency"] = Field(
+        default="asset_class",
+        description="Grouping dimension: asset_class, sector, or currency",
+    )
+
+
 # ============================================================
 # 合规限额定义
 # ============================================================
@@ -97,6 +113,7 @@ COMPLIANCE_LIMITS = {
 # ============================================================
 
 @tool
+@tool_cache.memoize()
 def get_risk_metrics(ctx: dict) -> dict:
     """
     获取当前投资组合的核心风险指标。
@@ -135,6 +152,7 @@ def get_risk_metrics(ctx: dict) -> dict:
 # ============================================================
 
 @tool(args_schema=StressTestInput)
+@tool_cache.memoize()
 def run_stress_test(
     ctx: dict,
     rate_shock_bp: int = 100,
@@ -202,6 +220,9 @@ def run_stress_test(
             "stressed_surplus": stressed_surplus,
             "delta_surplus": stressed_surplus - (base_assets - base_liabilities),
         },
+        # 情景严重度: 1 年期 EWMA 协方差下的标准差倍数（无协方差估计时为 None）
+        "scenario_sigma_1y": cov_service.scenario_sigma(
+            ctx, (rate_shock_bp, equity_shock_pct * 100, inflation_shock_pct * 100)),
     }
 
 
@@ -210,6 +231,7 @@ def run_stress_test(
 # ============================================================
 
 @tool(args_schema=HedgeComplianceInput)
+@tool_cache.memoize()
 def check_hedge_compliance(
     ctx: dict,
     ratio: float,
@@ -224,8 +246,9 @@ def check_hedge_compliance(
         - 用户请求调整 hedge ratio、duration hedge、FX hedge
         - 任何涉及对冲策略调整的请求
     
-    重要: 这是一个需要合规审核的操作。如果建议的比例超出限额，
-    系统会返回 FAIL 状态和建议的合规替代方案。
+    重要: 这是一个需要合规审核的操作。对冲执行后的组合会对全部限额
+    （资产配置区间、FX、funded status、发行人集中度、该对冲类型的限额）检查，
+    任何一项超限都返回 FAIL 状态和建议的合规替代方案。
     
     Args:
         ctx: 风险上下文
@@ -236,37 +259,16 @@ def check_hedge_compliance(
         合规检查结果:
         - status: PASS 或 FAIL
         - proposed_ratio: 建议的比例
-        - max_allowed: 允许的最大比例
-        - recommendation: 如果 FAIL，建议的合规替代方案
+        - max_allowed / min_allowed: 全部限额都满足的比例区间
+        - binding_limit / min_binding_limit: 决定 max_allowed / min_allowed 的限额
+        - recommendation_limit: 建议值贴近的那条限额（提议过高 → 上界，过低 → 下界）
+        - breach_details: 建议比例下超限的限额
+        - recommendation: 如果 FAIL，建议的合规替代方案（保证合规）
         - requires_approval: 是否需要人工审批
     """
     limit_config = COMPLIANCE_LIMITS.get(hedge_type, COMPLIANCE_LIMITS["duration"])
-    max_ratio = limit_config.get("max_hedge_ratio", 1.0)
-    
-    is_compliant = ratio <= max_ratio
-    
-    if is_compliant:
-        return {
-            "status": "PASS",
-            "proposed_ratio": ratio,
-            "max_allowed": max_ratio,
-            "hedge_type": hedge_type,
-            "message": f"Hedge ratio {ratio:.0%} is within limit ({max_ratio:.0%}), compliant",
-            "recommendation": None,
-            "requires_approval": False,
-        }
-    else:
-        compliant_ratio = max_ratio * 0.95  # 5% buffer
-        return {
-            "status": "FAIL",
-            "proposed_ratio": ratio,
-            "max_allowed": max_ratio,
-            "hedge_type": hedge_type,
-            "message": f"Hedge ratio {ratio:.0%} exceeds limit ({max_ratio:.0%}), approval required",
-            "recommendation": compliant_ratio,
-            "recommendation_message": f"Recommended adjustment to {compliant_ratio:.0%} (95% of limit)",
-            "requires_approval": True,
-        }
+    # 操作后的组合对全部限额一次性审计，同时解析求出最大合规比例
+    return audit_engine.audit_hedge(ctx, ratio, hedge_type, limit_config).to_tool_output()
 
 
 # ============================================================
@@ -274,6 +276,7 @@ def check_hedge_compliance(
 # ============================================================
 
 @tool
+@tool_cache.memoize()
 def get_limit_status(ctx: dict) -> dict:
     """
     获取所有风险限额的当前状态，识别 breaches 和 warnings。
@@ -315,6 +318,7 @@ def get_limit_status(ctx: dict) -> dict:
 # ============================================================
 
 @tool
+@tool_cache.memoize()
 def get_asset_allocation(ctx: dict) -> dict:
     """
     获取当前资产配置与政策目标的对比。
@@ -348,6 +352,60 @@ def get_asset_allocation(ctx: dict) -> dict:
     }
 
 
+# ============================================================
+# Tool 6: 盈余 VaR / ES（历史模拟）
+# ============================================================
+
+@tool
+@tool_cache.memoize()
+def get_surplus_var(ctx: dict) -> dict:
+    """
+    获取盈余的 1 日 VaR / ES（历史模拟法，多个置信度）。
+    
+    使用场景:
+        - 用户询问"盈余在险值是多少"、"最坏情况下一天可能亏多少"
+        - 用户想了解 VaR、expected shortfall、tail risk、surplus at risk
+        - 用户请求历史上最差的情景
+    
+    Args:
+        ctx: 风险上下文
+    
+    Returns:
+        VaR / ES 摘要:
+        - levels: 各置信度的 surplus_var / surplus_es / funded_var / funded_es
+        - worst_scenarios: 盈余损失最大的历史情景（日期 + 因子变动）
+        - n_scenarios / small_sample: 情景数，不足时结果只作参考
+    """
+    return var_engine.tool_output(ctx, cov_service.cov_from_ctx(ctx))
+
+
+# ============================================================
+# Tool 7: 盈余风险贡献（Euler 分解）
+# ============================================================
+
+@tool(args_schema=RiskAttributionInput)
+@tool_cache.memoize()
+def get_risk_attribution(ctx: dict, by: str = "asset_class") -> dict:
+    """
+    按 asset_class / sector / currency 分解盈余波动的来源（Euler 风险贡献）。
+    
+    使用场景:
+        - 用户询问"哪些资产类别驱动了盈余风险"
+        - 用户想了解 risk contribution、risk attribution、risk budget
+        - 用户对比权重与风险占比
+    
+    Args:
+        ctx: 风险上下文
+        by: 分组维度 asset_class / sector / currency
+    
+    Returns:
+        风险贡献摘要:
+        - surplus_vol_1d: 盈余 1 日波动
+        - contributors: 各组的 weight / risk_share / component / marginal（按贡献降序）
+    """
+    return risk_attribution.tool_output(ctx, by)
+
+
 # ============================================================
 # 工具注册表
 # ============================================================
@@ -366,6 +424,8 @@ def get_all_tools() -> List:
         check_hedge_compliance,
         get_limit_status,
         get_asset_allocation,
+        get_surplus_var,
+        get_risk_attribution,
     ]
 
 
@@ -379,6 +439,8 @@ def get_tool_descriptions() -> dict:
         "check_hedge_compliance": "🛡️ Check Hedge Compliance",
         "get_limit_status": "⚠️ Get Limit Status",
         "get_asset_allocation": "📈 Get Asset Allocation",
+        "get_surplus_var": "📉 Get Surplus VaR / ES",
+        "get_risk_attribution": "🧩 Get Risk Attribution",
     }
 
 
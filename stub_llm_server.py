@@ -0,0 +1,251 @@
+"""
+stub_llm_server.py — 本地 OpenAI 兼容 stub server (离线压测 / 开发)
+
+背景:
+    三个 Copilot 的压测和本地调试都依赖真实 OpenAI API: 要付费、要联网、延迟不可控，
+    结果也不可复现。
+
+设计:
+    - 只实现 POST /v1/chat/completions（普通 JSON + stream=True 的 SSE），够 llm_client 使用
+    - 脚本化响应:
+        · system prompt 要求 "Respond ONLY with valid JSON" → 工具选择请求，
+          用 intent_router 的规则挑工具与参数；"A and B" 这类复合问题拆开后返回多个 tool_calls
+        · 其他请求 → 固定模板回答，按词切分后逐块流式推送
+    - 延迟可配置: 首 token 延迟 + 每块延迟 + 随机抖动，模拟真实 LLM 的 TTFT / 吞吐
+    - 返回 usage（stream 时在请求 stream_options.include_usage 的最后一块给出）
+    - ThreadingHTTPServer + HTTP/1.1 keep-alive，listen backlog 调大以承受数百并发连接
+
+对外暴露:
+    StubConfig
+    start(config) → (server, base_url)   后台线程启动，server.stats() / server.shutdown()
+    命令行: python stub_llm_server.py --port 8800 --latency-ms 300 --token-ms 20
+            然后 OPENAI_BASE_URL=http://127.0.0.1:8800/v1 streamlit run app.py
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import intent_router
+
+
+# 工具选择请求的标志（agent_logic_gov._TOOL_SELECTION_PROMPT 的最后一句）
+_TOOL_SELECTION_MARKER = "Respond ONLY with valid JSON"
+
+# 复合问题的拆分点: "limit status and stress test" / "a; b"
+_CLAUSE_SPLIT_RE = re.compile(r"\band\b|;|\balso\b", re.IGNORECASE)
+
+_DEFAULT_TOOL = "get_risk_metrics"
+
+_ANSWER_TEMPLATE = (
+    "Funded status is 113.4%, above the 111% target, with a $14.9B surplus. "
+    "The duration gap is -8.5 years and FX exposure of 13.0% is inside the 15% limit. "
+    "No compliance breaches are open. (stub answer to: {query})"
+)
+
+
+# ============================================================
+# 配置
+# ============================================================
+
+@dataclass(frozen=True)
+class StubConfig:
+    latency_ms: float = 200.0        # 首 token / 非流式响应前的延迟
+    token_ms: float = 15.0           # 流式每块之间的延迟
+    jitter: float = 0.2              # 延迟的随机抖动比例 (±)
+    words_per_chunk: int = 2
+    host: str = "127.0.0.1"
+    port: int = 0                    # 0 → 随机空闲端口
+    seed: Optional[int] = None
+
+
+# ============================================================
+# 脚本化响应
+# ============================================================
+
+def _select_tools(query: str) -> dict:
+    """模拟 LLM 的工具选择: 每个子句走一遍 intent_router，合并去重"""
+    calls: List[dict] = []
+    seen = set()
+    for clause in _CLAUSE_SPLIT_RE.split(query):
+        if not clause.strip():
+            continue
+        decision = intent_router.route(clause)
+        if decision.tool is None or decision.tool in seen:
+            continue
+        seen.add(decision.tool)
+        calls.append({"tool": decision.tool, "params": decision.params})
+
+    if not calls:
+        calls = [{"tool": _DEFAULT_TOOL, "params": {}}]
+    if len(calls) == 1:
+        return {"selected_tool": calls[0]["tool"], "tool_params": calls[0]["params"],
+                "reasoning": "stub: single tool"}
+    return {"tool_calls": calls, "reasoning": "stub: compound query"}
+
+
+def _answer(query: str) -> str:
+    return _ANSWER_TEMPLATE.format(query=query[:80])
+
+
+def _usage(messages: List[dict], completion: str) -> dict:
+    """按 4 字符 / token 粗估，只为让调用方的 token 统计有数可用"""
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+    completion_tokens = max(1, len(completion) // 4)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+# ============================================================
+# HTTP server
+# ============================================================
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024        # 默认 5，数百并发建连时会被拒
+
+    def __init__(self, config: StubConfig):
+        super().__init__((config.host, config.port), _Handler)
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "tool_selection": 0, "stream": 0, "in_flight": 0, "max_in_flight": 0}
+
+    def sleep_ms(self, ms: float):
+        if ms <= 0:
+            return
+        with self._lock:
+            factor = 1 + self._rng.uniform(-self.config.jitter, self.config.jitter)
+        time.sleep(ms * factor / 1000)
+
+    def count(self, key: str, delta: int = 1):
+        with self._lock:
+            self._stats[key] += delta
+            self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._stats["in_flight"])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True   # header / body 分开写时避免撞上 delayed-ACK
+    server: _StubServer
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"stub: unknown path {self.path}"}})
+            return
+
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        messages = request.get("messages", [])
+        system = next((m.get("content") or "" for m in messages if m.get("role") == "system"), "")
+        query = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        model = request.get("model", "stub")
+
+        self.server.count("requests")
+        self.server.count("in_flight")
+        try:
+            if _TOOL_SELECTION_MARKER in system:
+                self.server.count("tool_selection")
+                content = json.dumps(_select_tools(query))
+            else:
+                content = _answer(query)
+
+            self.server.sleep_ms(self.server.config.latency_ms)
+            if request.get("stream"):
+                self.server.count("stream")
+                include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+                self._send_stream(model, content, _usage(messages, content) if include_usage else None)
+            else:
+                self._send_json(200, {
+                    "id": "stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": _usage(messages, content),
+                })
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端中途关闭了流（llm_gateway 在消费方放弃时会关掉上游连接）
+            self.close_connection = True
+        finally:
+            self.server.count("in_flight", -1)
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, model: str, content: str, usage: Optional[dict]):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def _event(payload) -> None:
+            data = f"data: {payload}\n\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def _chunk(delta: dict, finish_reason=None, chunk_usage=None) -> str:
+            return json.dumps({
+                "id": "stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if delta is not None else [],
+                "usage": chunk_usage,
+            })
+
+        words = content.split(" ")
+        n = max(1, self.server.config.words_per_chunk)
+        for i in range(0, len(words), n):
+            if i:
+                self.server.sleep_ms(self.server.config.token_ms)
+            piece = " ".join(words[i:i + n]) + (" " if i + n < len(words) else "")
+            _event(_chunk({"content": piece}))
+        _event(_chunk({}, finish_reason="stop"))
+        if usage is not None:
+            _event(_chunk(None, chunk_usage=usage))
+        _event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, *args):
+        pass
+
+
+# ============================================================
+# PUBLIC: start
+# ============================================================
+
+def start(config: StubConfig = StubConfig()):
+    """后台线程启动 stub server，返回 (server, base_url)"""
+    server = _StubServer(config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{config.host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency-ms", type=float, default=StubConfig.latency_ms)
+    parser.add_argument("--token-ms", type=float, default=StubConfig.token_ms)
+    parser.add_argument("--jitter", type=float, default=StubConfig.jitter)
+    args = parser.parse_args()
+
+    server, url = start(StubConfig(latency_ms=args.latency_ms, token_ms=args.token_ms,
+                                   jitter=args.jitter, host=args.host, port=args.port))
+    print(f"stub LLM server on {url}  (export OPENAI_BASE_URL={url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
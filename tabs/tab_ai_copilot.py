@@ -10,7 +10,8 @@ tab_ai_copilot.py — Tab 4: AI Copilot (Decoupled UI Layer)
 """
 
 import streamlit as st
-from ui_components import COLORS, render_section_header
+from ui_components import COLORS, render_section_header, render_chat_history
+from conversation_memory import ConversationMemory
 
 # ============================================================
 # 从 agent_logic 导入核心功能 (解耦的关键)
@@ -44,7 +45,7 @@ def render(ctx: dict):
     
     # ── 初始化 Session State ──
     if 'chat_history' not in st.session_state:
-        st.session_state.chat_history = []
+        st.session_state.chat_history = ConversationMemory()
     if 'thinking_steps' not in st.session_state:
         st.session_state.thinking_steps = []
 
@@ -181,9 +182,7 @@ def _render_chat_section(api_key: str, system_prompt: str, ctx: dict):
                 unsafe_allow_html=True,
             )
         else:
-            for message in st.session_state.chat_history:
-                with st.chat_message(message["role"]):
-                    st.markdown(message["content"])
+            render_chat_history(st.session_state.chat_history)
     
     # 输入区域
     if not api_key:
@@ -195,7 +194,7 @@ def _render_chat_section(api_key: str, system_prompt: str, ctx: dict):
     
     with col_clear:
         if st.button("🗑️", use_container_width=True, help="Clear conversation"):
-            st.session_state.chat_history = []
+            st.session_state.chat_history.clear()
             st.session_state.thinking_steps = []
             st.rerun()
 
@@ -288,6 +287,10 @@ def _render_thinking_step(step: ThinkingStep):
     if step.detail:
         detail_html = f"<div style='font-size: 0.75rem; color: {COLORS['text_tertiary']}; margin-top: 4px; font-style: italic;'>{step.detail}</div>"
     
+    cache_html = ""
+    if step.cache_hit:
+        cache_html = f"<span style='margin-left: auto; font-size: 0.7rem; color: {COLORS['accent']}; background-color: {COLORS['accent']}15; padding: 2px 6px; border-radius: 4px;'>⚡ cached</span>"
+    
     st.markdown(
         f"""
         <div style="
@@ -300,6 +303,7 @@ def _render_thinking_step(step: ThinkingStep):
             <div style="display: flex; align-items: center; gap: 8px;">
                 <span>{config['icon']}</span>
                 <span style="font-size: 0.85rem; font-weight: 600; color: {COLORS['text_primary']};">{step.node}</span>
+                {cache_html}
             </div>
             <div style="font-size: 0.8rem; color: {COLORS['text_secondary']}; margin-top: 4px;">
                 {step.message}
@@ -5,6 +5,9 @@ tab_ai_copilot_gov.py — Tab: AI Copilot (Governance Version)
     1. Tool Calling 透明化: 展示 AI 自主选择的工具
     2. Human-in-the-loop: 审批卡片 UI
     3. 实时节点追踪: st.status 动态更新
+    4. 延迟瀑布图: 每个节点的耗时 / token 用量，可导出 CSV 做跨 session 汇总
+    5. 审批可恢复: session 只保存 thread_id（同时写进 URL 的 ?gov_approval=），
+       图状态在 checkpointer 里；刷新页面 / server 重启后从 URL 恢复审批卡片
 
 与其他版本的区别:
     - tab_ai_copilot.py: 基础版
@@ -16,16 +19,33 @@ tab_ai_copilot_gov.py — Tab: AI Copilot (Governance Version)
 
 import streamlit as st
 import time
-from ui_components import COLORS, render_section_header
+import uuid
+
+import pandas as pd
+import plotly.graph_objects as go
+
+from ui_components import COLORS, render_section_header, render_chat_history, get_chart_layout
+from conversation_memory import ConversationMemory
+import tool_cache
 
 from agent_logic_gov import (
     run_agent,
     run_agent_stream,
     process_approval,
+    pending_approval,
     ThinkingStep,
+    TOKEN_EVENT,
     TOOL_DESCRIPTIONS,
+    step_records,
+    append_metrics_log,
 )
 
+# session 内保留的步骤指标条数上限（导出用）
+METRICS_MAX_RECORDS = 500
+
+# 待审批线程 id 的 URL 参数名
+APPROVAL_QUERY_PARAM = "gov_approval"
+
 
 # ============================================================
 # 节点状态消息映射
@@ -89,11 +109,15 @@ def render(ctx: dict):
     
     # ── 初始化 Session State ──
     if 'gov_chat_history' not in st.session_state:
-        st.session_state.gov_chat_history = []
+        st.session_state.gov_chat_history = ConversationMemory()
     if 'gov_thinking_steps' not in st.session_state:
         st.session_state.gov_thinking_steps = []
     if 'gov_pending_approval' not in st.session_state:
-        st.session_state.gov_pending_approval = None
+        st.session_state.gov_pending_approval = _restore_pending_approval()
+    if 'gov_turn_metrics' not in st.session_state:
+        st.session_state.gov_turn_metrics = []
+        st.session_state.gov_session_id = uuid.uuid4().hex[:12]
+        st.session_state.gov_turn_seq = 0
 
     # ── 检查 API Key ──
     api_key = _get_api_key()
@@ -223,9 +247,7 @@ def _render_chat_section(api_key: str, ctx: dict):
                 unsafe_allow_html=True,
             )
         else:
-            for message in st.session_state.gov_chat_history:
-                with st.chat_message(message["role"]):
-                    st.markdown(message["content"])
+            render_chat_history(st.session_state.gov_chat_history)
         
         # 审批卡片 (如果有待审批任务)
         if st.session_state.gov_pending_approval:
@@ -246,9 +268,9 @@ def _render_chat_section(api_key: str, ctx: dict):
     
     with col_clear:
         if st.button("🗑️", use_container_width=True, help="Clear", key="gov_clear"):
-            st.session_state.gov_chat_history = []
+            st.session_state.gov_chat_history.clear()
             st.session_state.gov_thinking_steps = []
-            st.session_state.gov_pending_approval = None
+            _set_pending_approval(None)
             st.rerun()
 
     user_input = st.chat_input("Ask about risk metrics, stress tests, or hedging...", key="gov_input")
@@ -336,16 +358,22 @@ def _render_approval_card(ctx: dict, api_key: str):
 
 
 def _handle_approval(status: str, ctx: dict, api_key: str):
-    """处理审批结果"""
+    """处理审批结果: 从 checkpointer 里的断点恢复图"""
     pending = st.session_state.gov_pending_approval
     
-    # 调用处理函数
-    response, steps = process_approval(
-        approval_status=status,
-        ctx=ctx,
-        api_key=api_key,
-        pending_state=pending.get("state", {}),
-    )
+    try:
+        response, steps = process_approval(
+            approval_status=status,
+            thread_id=pending["thread_id"],
+        )
+    except LookupError:
+        # 已在其他页面处理，或超过保留期被清理
+        st.session_state.gov_chat_history.append({
+            "role": "assistant",
+            "content": "⚠️ This approval request is no longer pending (already processed or expired).",
+        })
+        _set_pending_approval(None)
+        st.rerun()
     
     # 更新聊天历史
     st.session_state.gov_chat_history.append({
@@ -353,11 +381,12 @@ def _handle_approval(status: str, ctx: dict, api_key: str):
         "content": response,
     })
     
-    # 更新思考步骤
-    st.session_state.gov_thinking_steps.extend(steps)
+    # 更新思考步骤（steps 已包含审批前的全部步骤，只有末尾是本次审批新增的）
+    st.session_state.gov_thinking_steps = list(steps)
+    _record_turn_metrics(steps[pending["n_steps"]:], turn_id=st.session_state.gov_turn_seq)
     
     # 清除待审批状态
-    st.session_state.gov_pending_approval = None
+    _set_pending_approval(None)
     
     st.rerun()
 
@@ -425,10 +454,83 @@ def _render_thinking_panel():
     else:
         for step in st.session_state.gov_thinking_steps:
             _render_thinking_step_enhanced(step)
+        _render_latency_waterfall(st.session_state.gov_thinking_steps)
+    
+    if st.session_state.gov_turn_metrics:
+        st.download_button(
+            "⬇️ Export step metrics (CSV)",
+            data=pd.DataFrame(st.session_state.gov_turn_metrics).to_csv(index=False),
+            file_name=f"gov_step_metrics_{st.session_state.gov_session_id}.csv",
+            mime="text/csv",
+            use_container_width=True,
+            key="gov_export_metrics",
+        )
     
     st.markdown("</div>", unsafe_allow_html=True)
 
 
+def _render_latency_waterfall(steps: list):
+    """本轮各节点的延迟瀑布图: 横轴是相对本轮开始的毫秒数，⚡ 标记缓存命中"""
+    timed = [s for s in steps if s.started_at is not None and s.ended_at is not None]
+    if not timed:
+        return
+    
+    t0 = min(s.started_at for s in timed)
+    labels = [f"{i + 1}. {s.node}" for i, s in enumerate(timed)]
+    offsets = [(s.started_at - t0) * 1000 for s in timed]
+    durations = [max(s.duration_ms, 0.5) for s in timed]   # 0 ms 的节点也画出一条细线
+    texts = [
+        f"{s.duration_ms:.0f} ms"
+        + (f" · {s.prompt_tokens}+{s.completion_tokens} tok" if s.prompt_tokens or s.completion_tokens else "")
+        + (" ⚡" if s.cache_hit else "")
+        for s in timed
+    ]
+    colors = [
+        COLORS['accent'] if s.cache_hit else ("#6c5ce7" if s.prompt_tokens else COLORS['text_tertiary'])
+        for s in timed
+    ]
+    
+    fig = go.Figure(go.Bar(
+        y=labels,
+        x=durations,
+        base=offsets,
+        orientation='h',
+        marker_color=colors,
+        text=texts,
+        textposition='auto',
+        hovertemplate="%{y}<br>start +%{base:.0f} ms<br>%{text}<extra></extra>",
+    ))
+    fig.update_layout(**{
+        **get_chart_layout(height=60 + 32 * len(timed)),
+        'margin': dict(l=10, r=10, t=10, b=30),
+        'showlegend': False,
+    })
+    fig.update_xaxes(title_text="ms since turn start", title_font=dict(size=10, color=COLORS['text_tertiary']))
+    fig.update_yaxes(autorange="reversed", tickfont=dict(size=10, color=COLORS['text_secondary']))
+    
+    render_section_header("Latency Waterfall", "⏱️")
+    st.plotly_chart(fig, use_container_width=True, config={'displayModeBar': False})
+    
+    total_ms = (max(s.ended_at for s in timed) - t0) * 1000
+    prompt_tokens = sum(s.prompt_tokens for s in timed)
+    completion_tokens = sum(s.completion_tokens for s in timed)
+    cache_hits = sum(s.cache_hit for s in timed)
+    tool_stats = tool_cache.get_cache().stats()
+    st.caption(
+        f"Turn {total_ms:,.0f} ms · {prompt_tokens:,} prompt + {completion_tokens:,} completion tokens"
+        f" · {cache_hits} cache hit{'s' if cache_hits != 1 else ''}"
+        f" · tool cache {tool_stats['hit_rate']:.0%} hit rate ({tool_stats['hits']}/{tool_stats['hits'] + tool_stats['misses']})"
+    )
+
+
+def _record_turn_metrics(steps: list, turn_id: int):
+    """把一轮的步骤指标加入 session 导出缓冲区，并追加到 AGENT_METRICS_LOG（如已配置）"""
+    records = step_records(steps, session_id=st.session_state.gov_session_id, turn_id=turn_id)
+    append_metrics_log(records)
+    metrics = st.session_state.gov_turn_metrics + records
+    st.session_state.gov_turn_metrics = metrics[-METRICS_MAX_RECORDS:]
+
+
 def _render_thinking_step_enhanced(step: ThinkingStep):
     """渲染单个思考步骤"""
     
@@ -472,6 +574,10 @@ def _render_thinking_step_enhanced(step: ThinkingStep):
     if step.detail:
         detail_html = f"<div style='font-size: 0.75rem; color: {COLORS['text_tertiary']}; margin-top: 4px;'>{step.detail}</div>"
     
+    cache_html = ""
+    if step.cache_hit:
+        cache_html = f"<span style='margin-left: auto; font-size: 0.7rem; color: {COLORS['accent']}; background-color: {COLORS['accent']}15; padding: 2px 6px; border-radius: 4px;'>⚡ cached</span>"
+    
     st.markdown(
         f"""
         <div style="
@@ -484,6 +590,7 @@ def _render_thinking_step_enhanced(step: ThinkingStep):
             <div style="display: flex; align-items: center; gap: 8px;">
                 <span style="font-size: 1rem;">{config['icon']}</span>
                 <span style="font-size: 0.85rem; font-weight: 600; color: {COLORS['text_primary']};">{step.node}</span>
+                {cache_html}
             </div>
             <div style="font-size: 0.8rem; color: {config['color']}; margin-top: 4px; font-weight: 500;">
                 {step.message}
@@ -507,6 +614,8 @@ def _process_user_input_with_status(user_input: str, ctx: dict, api_key: str):
     st.session_state.gov_thinking_steps = []
     
     status_placeholder = st.empty()
+    answer_placeholder = st.empty()   # respond 节点的 token 流直接写到这里
+    streamed = ""
     
     try:
         with status_placeholder.status("🛡️ Governance Engine running...", expanded=True) as status:
@@ -520,6 +629,13 @@ def _process_user_input_with_status(user_input: str, ctx: dict, api_key: str):
                 ctx=ctx,
                 api_key=api_key,
             ):
+                if node_name == TOKEN_EVENT:
+                    if not streamed:
+                        status.update(label="💬 Streaming response...", expanded=False)
+                    streamed += state["token"]
+                    answer_placeholder.chat_message("assistant").markdown(streamed + "▌")
+                    continue
+                
                 icon, message, label = NODE_STATUS_MESSAGES.get(
                     node_name, 
                     ("🔄", "Processing...", node_name)
@@ -529,10 +645,12 @@ def _process_user_input_with_status(user_input: str, ctx: dict, api_key: str):
                 st.write(f"**Node:** `{node_name}` — {label}")
                 
                 # 检查是否选择了工具
-                if node_name == "analyze" and state.get("selected_tool"):
-                    tool_name = state.get("selected_tool", "")
-                    tool_desc = TOOL_DESCRIPTIONS.get(tool_name, tool_name)
-                    st.success(f"🤖 AI 选择工具: **{tool_desc}**")
+                if node_name == "analyze" and state.get("tool_calls"):
+                    tool_descs = [
+                        TOOL_DESCRIPTIONS.get(call["tool"], call["tool"])
+                        for call in state["tool_calls"]
+                    ]
+                    st.success(f"🤖 AI 选择工具: **{' + '.join(tool_descs)}**")
                 
                 # 检查是否需要审批
                 if state.get("requires_approval"):
@@ -551,26 +669,26 @@ def _process_user_input_with_status(user_input: str, ctx: dict, api_key: str):
             
             status.update(label="✅ Complete", state="complete", expanded=False)
         
+        st.session_state.gov_turn_seq += 1
+        _record_turn_metrics(st.session_state.gov_thinking_steps, turn_id=st.session_state.gov_turn_seq)
+        
         # 添加响应到聊天
         st.session_state.gov_chat_history.append({
             "role": "assistant",
             "content": final_response,
         })
         
-        # 如果需要审批，保存待审批状态
+        # 如果需要审批，只保存卡片数字和 thread_id（图状态在 checkpointer 里）
         if requires_approval:
-            st.session_state.gov_pending_approval = {
-                "proposed_ratio": final_state.get("tool_output", {}).get("proposed_ratio", 0),
-                "max_allowed": final_state.get("tool_output", {}).get("max_allowed", 0),
-                "recommendation": final_state.get("tool_output", {}).get("recommendation", 0),
-                "reason": final_state.get("approval_reason", ""),
-                "state": final_state,
-            }
+            pending = pending_approval(final_state["thread_id"])
+            steps = pending.pop("thinking_steps")
+            _set_pending_approval({**pending, "n_steps": len(steps)})
         
         st.rerun()
 
     except Exception as e:
         status_placeholder.empty()
+        answer_placeholder.empty()
         st.session_state.gov_thinking_steps.append(ThinkingStep(
             node="❌ Error",
             status="error",
@@ -587,6 +705,29 @@ def _process_user_input_with_status(user_input: str, ctx: dict, api_key: str):
 # 辅助函数
 # ============================================================
 
+def _set_pending_approval(pending):
+    """更新待审批状态，并同步 URL 参数（刷新页面后凭它恢复）"""
+    st.session_state.gov_pending_approval = pending
+    if pending is None:
+        st.query_params.pop(APPROVAL_QUERY_PARAM, None)
+    else:
+        st.query_params[APPROVAL_QUERY_PARAM] = pending["thread_id"]
+
+
+def _restore_pending_approval():
+    """新 session（刷新 / 重启）: URL 里有仍在等待的审批线程时恢复审批卡片和思考步骤"""
+    thread_id = st.query_params.get(APPROVAL_QUERY_PARAM)
+    if not thread_id:
+        return None
+    restored = pending_approval(thread_id)
+    if restored is None:
+        st.query_params.pop(APPROVAL_QUERY_PARAM, None)
+        return None
+    steps = restored.pop("thinking_steps")
+    st.session_state.gov_thinking_steps = list(steps)
+    return {**restored, "n_steps": len(steps)}
+
+
 def _get_api_key() -> str:
     try:
         return st.secrets.get("OPENAI_API_KEY", "")
@@ -11,12 +11,14 @@ tab_ai_copilot_lg.py — Tab: AI Copilot (LangGraph Version) - Enhanced UI
 
 import streamlit as st
 import time
-from ui_components import COLORS, render_section_header
+from ui_components import COLORS, render_section_header, render_chat_history
+from conversation_memory import ConversationMemory
 
 from agent_logic_lg import (
     run_agent_stream,
     build_system_prompt,
     ThinkingStep,
+    TOKEN_EVENT,
     COMPLIANCE_LIMITS,
 )
 
@@ -83,7 +85,7 @@ def render(ctx: dict):
     
     # ── 初始化 Session State ──
     if 'lg_chat_history' not in st.session_state:
-        st.session_state.lg_chat_history = []
+        st.session_state.lg_chat_history = ConversationMemory()
     if 'lg_thinking_steps' not in st.session_state:
         st.session_state.lg_thinking_steps = []
 
@@ -214,9 +216,7 @@ def _render_chat_section(api_key: str, system_prompt: str, ctx: dict):
                 unsafe_allow_html=True,
             )
         else:
-            for message in st.session_state.lg_chat_history:
-                with st.chat_message(message["role"]):
-                    st.markdown(message["content"])
+            render_chat_history(st.session_state.lg_chat_history)
     
     if not api_key:
         st.warning("⚠️ OpenAI API key not configured.")
@@ -227,7 +227,7 @@ def _render_chat_section(api_key: str, system_prompt: str, ctx: dict):
     
     with col_clear:
         if st.button("🗑️", use_container_width=True, help="Clear", key="lg_clear"):
-            st.session_state.lg_chat_history = []
+            st.session_state.lg_chat_history.clear()
             st.session_state.lg_thinking_steps = []
             st.rerun()
 
@@ -344,6 +344,10 @@ def _render_thinking_step_enhanced(step: ThinkingStep):
     if step.detail:
         detail_html = f"<div style='font-size: 0.75rem; color: {COLORS['text_tertiary']}; margin-top: 4px;'>{step.detail}</div>"
     
+    cache_html = ""
+    if step.cache_hit:
+        cache_html = f"<span style='margin-left: auto; font-size: 0.7rem; color: {COLORS['accent']}; background-color: {COLORS['accent']}15; padding: 2px 6px; border-radius: 4px;'>⚡ cached</span>"
+    
     st.markdown(
         f"""
         <div style="
@@ -356,6 +360,7 @@ def _render_thinking_step_enhanced(step: ThinkingStep):
             <div style="display: flex; align-items: center; gap: 8px;">
                 <span style="font-size: 1rem;">{config['icon']}</span>
                 <span style="font-size: 0.85rem; font-weight: 600; color: {COLORS['text_primary']};">{step.node}</span>
+                {cache_html}
             </div>
             <div style="font-size: 0.8rem; color: {config['color']}; margin-top: 4px; font-weight: 500;">
                 {step.message}
@@ -387,6 +392,8 @@ def _process_user_input_with_status(user_input: str, system_prompt: str, ctx: di
     
     # 创建状态容器
     status_placeholder = st.empty()
+    answer_placeholder = st.empty()   # respond 节点的 token 流直接写到这里
+    streamed = ""
     
     try:
         with status_placeholder.status("🧠 LangGraph Engine running...", expanded=True) as status:
@@ -398,6 +405,13 @@ def _process_user_input_with_status(user_input: str, system_prompt: str, ctx: di
                 system_prompt=system_prompt,
                 api_key=api_key,
             ):
+                if node_name == TOKEN_EVENT:
+                    if not streamed:
+                        status.update(label="💬 Streaming response...", expanded=False)
+                    streamed += state["token"]
+                    answer_placeholder.chat_message("assistant").markdown(streamed + "▌")
+                    continue
+                
                 # 获取节点信息
                 icon, message, label = NODE_STATUS_MESSAGES.get(
                     node_name, 
@@ -440,6 +454,7 @@ def _process_user_input_with_status(user_input: str, system_prompt: str, ctx: di
 
     except Exception as e:
         status_placeholder.empty()
+        answer_placeholder.empty()
         st.session_state.lg_thinking_steps.append(ThinkingStep(
             node="❌ Error",
             status="error",
@@ -8,6 +8,7 @@ tab_fund_health.py — Tab 1: Fund Health (全基金监控)
     Row 1: 5 个 KPI 卡片
     Row 2: 组合时间序列图（Asset/Liability 柱状 + Funded Status 线）
     Row 3: 左(饼图) + 右(Actual vs Policy 柱状图)
+    Row 4: 盈余风险贡献表（Euler 分解，可切换 asset_class / sector / currency）
 
 数据源: 全部从 ctx dict 获取
 
@@ -27,11 +28,16 @@ from ui_components import (
     CHART_COLORS,
     ASSET_COLORS,
     get_chart_layout,
+    get_cached_figure,
     render_section_header,
     format_number,
     format_percent,
+    restore_widget_state,
+    save_widget_state,
 )
 
+TAB_ID = "funding_status"
+
 
 # ============================================================
 # PUBLIC: render(ctx)
@@ -51,7 +57,7 @@ def render(ctx: dict):
     # Row 2: 组合时间序列图
     # ─────────────────────────────────────────────────────────
     render_section_header("Assets vs Liabilities Trend", "📈")
-    fig_ts = _build_combo_time_series(ctx)
+    fig_ts = get_cached_figure(ctx, TAB_ID, "combo_time_series", _build_combo_time_series)
     st.plotly_chart(fig_ts, use_container_width=True)
     
     st.markdown("<div style='height: 16px'></div>", unsafe_allow_html=True)
@@ -63,14 +69,74 @@ def render(ctx: dict):
     
     with col_left:
         render_section_header("Asset Allocation", "🥧")
-        fig_pie = _build_pie_chart(ctx)
+        fig_pie = get_cached_figure(ctx, TAB_ID, "pie_chart", _build_pie_chart)
         st.plotly_chart(fig_pie, use_container_width=True, config={'displayModeBar': False})
     
     with col_right:
         render_section_header("Actual vs Policy Target", "📊")
-        fig_bar = _build_comparison_bar(ctx)
+        fig_bar = get_cached_figure(ctx, TAB_ID, "comparison_bar", _build_comparison_bar)
         st.plotly_chart(fig_bar, use_container_width=True, config={'displayModeBar': False})
 
+    st.markdown("<div style='height: 16px'></div>", unsafe_allow_html=True)
+
+    # ─────────────────────────────────────────────────────────
+    # Row 4: 风险贡献表
+    # ─────────────────────────────────────────────────────────
+    render_section_header("Surplus Risk Contribution", "🧩")
+    _render_risk_contribution(ctx)
+
+
+# ============================================================
+# PRIVATE: 风险贡献表
+# ============================================================
+
+_ATTRIBUTION_LABELS = {"asset_class": "Asset Class", "sector": "Sector", "currency": "Currency"}
+
+
+@st.fragment
+def _render_risk_contribution(ctx: dict):
+    """权重 vs 风险占比（ctx['risk_attribution_df']，切换维度只重跑这个 fragment）"""
+    table = ctx['risk_attribution_df']
+    if table.empty:
+        st.caption("No factor history before the selected date — risk contribution is not available.")
+        return
+
+    restore_widget_state("risk_contribution_state", {"risk_contribution_by": "asset_class"})
+    by = st.radio(
+        "Group by",
+        options=list(_ATTRIBUTION_LABELS),
+        format_func=_ATTRIBUTION_LABELS.get,
+        horizontal=True,
+        key="risk_contribution_by",
+    )
+    save_widget_state("risk_contribution_state", ["risk_contribution_by"])
+    rows = table[table['dimension'] == by]
+
+    display_df = pd.DataFrame({
+        _ATTRIBUTION_LABELS[by]: rows['group'],
+        "Weight":       rows['weight'].apply(lambda x: f"{x:+.1%}"),
+        "Risk Share":   rows['risk_share'].apply(lambda x: f"{x:+.1%}"),
+        "Contribution": rows['component'].apply(lambda x: f"${x:+,.0f}M"),
+        "Marginal":     rows['marginal'].apply(lambda x: f"{x * 100:+.2f}%"),
+    })
+    st.dataframe(
+        display_df,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            _ATTRIBUTION_LABELS[by]: st.column_config.TextColumn(_ATTRIBUTION_LABELS[by], width="medium"),
+            "Weight": st.column_config.TextColumn("Weight", width="small"),
+            "Risk Share": st.column_config.TextColumn("Risk Share", width="small"),
+            "Contribution": st.column_config.TextColumn("Contribution", width="small"),
+            "Marginal": st.column_config.TextColumn("Marginal", width="small"),
+        },
+    )
+    st.caption(
+        f"Euler decomposition of 1-day surplus volatility (${ctx['surplus_vol_1d']:,.0f}M) under the EWMA "
+        f"factor covariance. Contributions sum to σ; marginal = change in σ per $1 added to the group. "
+        f"Liabilities are included, so asset groups that hedge them show negative shares."
+    )
+
 
 # ============================================================
 # PRIVATE: KPI 卡片
@@ -143,10 +209,10 @@ def _build_combo_time_series(ctx: dict) -> go.Figure:
     - 线图: Funded Status (绿色) 叠加在右 Y 轴
     - 基准线: 111% target (虚线)
     """
-    ts_df = ctx['time_series_df'].copy()
+    ts_df = ctx['time_series_df']
     
-    # 转换日期格式用于显示
-    ts_df['date_str'] = pd.to_datetime(ts_df['date']).dt.strftime('%b %d')
+    # 转换日期格式用于显示（只读 ctx，不 copy）
+    date_str = pd.to_datetime(ts_df['date']).dt.strftime('%b %d')
     
     # 创建双 Y 轴图表
     fig = make_subplots(specs=[[{"secondary_y": True}]])
@@ -155,7 +221,7 @@ def _build_combo_time_series(ctx: dict) -> go.Figure:
     fig.add_trace(
         go.Bar(
             name='Assets',
-            x=ts_df['date_str'],
+            x=date_str,
             y=ts_df['total_assets'] / 1000,
             marker_color=COLORS['accent'],
             opacity=0.9,
@@ -168,7 +234,7 @@ def _build_combo_time_series(ctx: dict) -> go.Figure:
     fig.add_trace(
         go.Bar(
             name='Liabilities',
-            x=ts_df['date_str'],
+            x=date_str,
             y=ts_df['total_liabilities'] / 1000,
             marker_color=COLORS['text_tertiary'],
             opacity=0.7,
@@ -181,7 +247,7 @@ def _build_combo_time_series(ctx: dict) -> go.Figure:
     fig.add_trace(
         go.Scatter(
             name='Funded Status',
-            x=ts_df['date_str'],
+            x=date_str,
             y=ts_df['funded_status'] * 100,
             mode='lines+markers',
             line=dict(color=COLORS['positive'], width=3),
@@ -260,26 +326,23 @@ def _build_pie_chart(ctx: dict) -> go.Figure:
     - 过滤掉负值 (Cash & Funding 是负的)
     - 每个 slice 显示 % 和 $金额
     """
-    mix_df = ctx['mix_df'].copy()
+    mix_df = ctx['mix_df']
     
-    # 过滤掉负值
-    mix_df = mix_df[mix_df['total_mtm'] > 0].copy()
+    # 过滤掉负值，排序让最大的在前面（布尔索引 + sort 已返回新对象，不改 ctx）
+    mix_df = mix_df[mix_df['total_mtm'] > 0].sort_values('total_mtm', ascending=False)
     
     # 计算百分比
-    total = mix_df['total_mtm'].sum()
-    mix_df['pct'] = mix_df['total_mtm'] / total * 100
-    
-    # 排序，让最大的在前面
-    mix_df = mix_df.sort_values('total_mtm', ascending=False)
+    pct = mix_df['total_mtm'] / mix_df['total_mtm'].sum() * 100
     
     # 为每个资产类别分配颜色
-    colors = [ASSET_COLORS.get(ac, COLORS['accent']) for ac in mix_df['asset_class']]
+    colors = mix_df['asset_class'].map(ASSET_COLORS).fillna(COLORS['accent']).tolist()
     
-    # 自定义标签：显示 % 和 $金额
-    custom_text = [
-        f"{row['asset_class']}<br>{row['pct']:.1f}% (${row['total_mtm']/1000:.1f}B)"
-        for _, row in mix_df.iterrows()
-    ]
+    # 自定义标签：显示 % 和 $金额（向量化字符串拼接）
+    custom_text = (
+        mix_df['asset_class'] + "<br>"
+        + pct.map("{:.1f}%".format)
+        + " ($" + (mix_df['total_mtm'] / 1000).map("{:.1f}B)".format)
+    ).tolist()
     
     fig = go.Figure(data=[
         go.Pie(
@@ -317,38 +380,42 @@ def _build_comparison_bar(ctx: dict) -> go.Figure:
     - 每个 asset_class 有两根柱子: Actual + Target
     - 背景带: range_min ~ range_max
     """
-    comp_df = ctx['comp_df'].copy()
+    comp_df = ctx['comp_df']
     
     # 过滤掉 Cash & Funding (负权重)
-    comp_df = comp_df[comp_df['current_weight'] >= 0].copy()
+    comp_df = comp_df[comp_df['current_weight'] >= 0]
     
     # 简化 asset_class 名称
-    comp_df['short_name'] = comp_df['asset_class'].apply(
-        lambda x: x.replace('Private ', 'Priv ').replace('Public ', '')
-    )
+    short_name = (comp_df['asset_class']
+                  .str.replace('Private ', 'Priv ', regex=False)
+                  .str.replace('Public ', '', regex=False))
     
     fig = go.Figure()
     
     # ── Range Band (背景色带) ──
-    for i, row in comp_df.iterrows():
-        fig.add_shape(
+    # 一次性传入 shapes 列表，避免逐个 add_shape 触发的重复校验
+    band_color = f"rgba({int(COLORS['accent'][1:3], 16)}, {int(COLORS['accent'][3:5], 16)}, {int(COLORS['accent'][5:7], 16)}, 0.1)"
+    range_bands = [
+        dict(
             type="rect",
             x0=i - 0.4,
             x1=i + 0.4,
-            y0=row['range_min'] * 100,
-            y1=row['range_max'] * 100,
+            y0=lo * 100,
+            y1=hi * 100,
             xref="x",
             yref="y",
-            fillcolor=f"rgba({int(COLORS['accent'][1:3], 16)}, {int(COLORS['accent'][3:5], 16)}, {int(COLORS['accent'][5:7], 16)}, 0.1)",
+            fillcolor=band_color,
             line=dict(width=0),
             layer="below"
         )
+        for i, lo, hi in zip(range(len(comp_df)), comp_df['range_min'], comp_df['range_max'])
+    ]
     
     # ── Actual 柱 ──
     fig.add_trace(
         go.Bar(
             name='Actual',
-            x=comp_df['short_name'],
+            x=short_name,
             y=comp_df['current_weight'] * 100,
             marker_color=COLORS['accent'],
             text=[f"{v*100:.1f}%" for v in comp_df['current_weight']],
@@ -362,7 +429,7 @@ def _build_comparison_bar(ctx: dict) -> go.Figure:
     fig.add_trace(
         go.Bar(
             name='Target',
-            x=comp_df['short_name'],
+            x=short_name,
             y=comp_df['policy_target'] * 100,
             marker_color=COLORS['warning'],
             opacity=0.7,
@@ -389,6 +456,7 @@ def _build_comparison_bar(ctx: dict) -> go.Figure:
             font=dict(size=11, color=COLORS['text_secondary'])
         ),
         'margin': dict(l=50, r=20, t=40, b=80),
+        'shapes': range_bands,
     }
     fig.update_layout(**layout)
     
@@ -27,10 +27,13 @@ import plotly.graph_objects as go
 from ui_components import (
     COLORS,
     get_chart_layout,
+    get_cached_figure,
     render_section_header,
     format_percent,
 )
 
+TAB_ID = "limit_monitor"
+
 
 def render(ctx: dict):
     """
@@ -42,7 +45,6 @@ def render(ctx: dict):
     limits_df = ctx['limits_df']
     issuer_df = ctx['issuer_df']
     fx_pct = ctx['fx_pct']
-    ts_df = ctx['time_series_df']
 
     # 统计 breach / warn 数量
     n_total = len(limits_df)
@@ -108,11 +110,13 @@ def render(ctx: dict):
 
     with col_gauge:
         render_section_header("FX Exposure Gauge", "🎯")
-        _render_fx_gauge(fx_pct)
+        fig_gauge = get_cached_figure(ctx, TAB_ID, "fx_gauge", _build_fx_gauge)
+        st.plotly_chart(fig_gauge, use_container_width=True)
 
     with col_trend:
         render_section_header("Trend: FX", "📈")
-        _render_time_series(ts_df)
+        fig_trend = get_cached_figure(ctx, TAB_ID, "fx_trend", _build_time_series)
+        st.plotly_chart(fig_trend, use_container_width=True)
 
 
 # ============================================================
@@ -172,12 +176,14 @@ def _render_issuer_table(issuer_df: pd.DataFrame):
     )
 
 
-def _render_fx_gauge(fx_pct: float):
+def _build_fx_gauge(ctx: dict) -> go.Figure:
     """
-    渲染 FX 敞口仪表盘。
+    构建 FX 敞口仪表盘。
     阈值: 15%
     颜色区间: 绿(0-12%), 黄(12-15%), 红(>15%)
     """
+    fx_pct = ctx['fx_pct']
+
     fig = go.Figure(go.Indicator(
         mode="gauge+number",
         value=fx_pct * 100,
@@ -216,25 +222,25 @@ def _render_fx_gauge(fx_pct: float):
         font={'color': COLORS['text_secondary']},
     )
 
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
 
 
-def _render_time_series(ts_df: pd.DataFrame):
+def _build_time_series(ctx: dict) -> go.Figure:
     """
-    渲染 FX 时间序列图:
+    构建 FX 时间序列图:
     - 单轴: FX Exposure (%)
     - 阈值线: 15% (FX)
     """
     fig = go.Figure()
 
-    # 格式化日期
-    ts_df = ts_df.copy()
-    ts_df['date_str'] = pd.to_datetime(ts_df['date']).dt.strftime('%b %d')
+    # 格式化日期（只读 ctx，不 copy）
+    ts_df = ctx['time_series_df']
+    date_str = pd.to_datetime(ts_df['date']).dt.strftime('%b %d')
 
     # ── FX Exposure ──
     fig.add_trace(
         go.Scatter(
-            x=ts_df['date_str'],
+            x=date_str,
             y=ts_df['fx_pct'] * 100,
             name='FX Exposure',
             line=dict(color=COLORS['warning'], width=2),
@@ -287,4 +293,4 @@ def _render_time_series(ts_df: pd.DataFrame):
         tickangle=-45,
     )
 
-    st.plotly_chart(fig, use_container_width=True)
\ No newline at end of file
+    return fig
\ No newline at end of file
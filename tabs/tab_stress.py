@@ -6,17 +6,27 @@ tab_stress.py — Tab 3: Stress Testing
 
 布局:
     Row 1: Scenario Controls
-           [Preset + Current + Reset] | [Sliders] | [KPIs 2x2]
+           [Preset + Curve Shape + Current + Reset] | [Sliders] | [KPIs 2x2]
     Row 2: [P&L Waterfall] | [Top Movers]
+    Row 3: Key-Rate 曲线情景 [资产 / 负债 KRD 分布] | [扭转 / 陡峭化情景表]
+    Row 4: Monte Carlo 分布 [协方差 + 路径数 + Seed + KPIs] | [ΔSurplus 直方图]
+
+Row 1 + Row 2 放在 st.fragment 里，slider 变化只重跑该 fragment；
+Row 3 直接读 ctx['curve_scenarios_df']（build_context 一次矩阵乘法算好全部情景）；
+Row 4 是独立的 fragment，结果由 mc_engine 按 ctx 指纹缓存。
 
 对外暴露: render(ctx)
 """
 
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 
+import cov_service
+import curve_engine
 import engine
+import mc_engine
 
 # ============================================================
 # 导入统一 UI 组件库
@@ -27,6 +37,8 @@ from ui_components import (
     render_section_header,
     format_number,
     format_percent,
+    restore_widget_state,
+    save_widget_state,
 )
 
 # ============================================================
@@ -41,6 +53,14 @@ PRESET_SCENARIOS = {
     "Deflation Scare": {"rate": -50, "equity": -10, "inflation": -2.0},
 }
 
+# 曲线形状: 平行移动之外叠加在各关键期限上的 bp 移动（curve_engine.CURVE_SCENARIOS）
+CURVE_PARALLEL = "Parallel"
+CURVE_OPTIONS = [CURVE_PARALLEL, *curve_engine.CURVE_SCENARIOS]
+
+# 场景控件的 widget key；取值另存在非 widget 的 st.session_state["stress_scenario"]，
+# 切到别的 Tab 再回来时由它回填（app.py 只渲染当前 Tab，没渲染的 widget key 会被清掉）
+SCENARIO_KEYS = ["stress_preset", "stress_curve", "stress_rate", "stress_equity", "stress_inflation"]
+
 
 def render(ctx: dict):
     """Tab 3 主入口。"""
@@ -76,15 +96,6 @@ def render(ctx: dict):
         unsafe_allow_html=True,
     )
 
-    # ─────────────────────────────────────────────────────────
-    # 取 baseline 数据
-    # ─────────────────────────────────────────────────────────
-    df_day = ctx['df_day']
-    baseline_assets = ctx['total_assets']
-    baseline_liabilities = ctx['total_liabilities']
-    baseline_funded = ctx['funded_status']
-    baseline_surplus = ctx['surplus']
-
     # ─────────────────────────────────────────────────────────
     # 标题 + 说明
     # ─────────────────────────────────────────────────────────
@@ -94,8 +105,9 @@ def render(ctx: dict):
         f"""
         <div style="color:{COLORS['text_secondary']}; font-size:1rem; line-height:1.5; margin-bottom:16px;">
             <strong>ℹ️ Methodology note</strong><br/>
-            This demo uses <strong>simplified linear shocks</strong>: parallel moves in rate (bp), equity (%) and inflation (%), 
-            with linear sensitivities (e.g. duration × rate, beta × equity). Suitable for illustration and quick what‑if.
+            This demo uses <strong>simplified linear shocks</strong>: moves in rate (bp), equity (%) and inflation (%), 
+            with linear sensitivities (e.g. key-rate durations × curve moves, beta × equity). The rate slider is a parallel
+            shift; the curve shape adds twist / steepener moves at the 2y–30y key rates. Suitable for illustration and quick what‑if.
             In <strong>production</strong>, institutions typically apply <strong>non‑linear factor models</strong> that capture 
             correlations, tail dependence, volatility regimes and scenario‑dependent behaviour (e.g. credit spread vs rates in stress).
         </div>
@@ -103,69 +115,88 @@ def render(ctx: dict):
         unsafe_allow_html=True,
     )
 
+    # Slider / Preset / Reset 只重跑 fragment，不触发整个 app rerun
+    _render_scenario_fragment(ctx)
+
+    st.markdown("<div style='height: 24px;'></div>", unsafe_allow_html=True)
+    render_section_header("Key-Rate Curve Scenarios", "📐")
+    _render_curve_scenarios(ctx)
+
+    st.markdown("<div style='height: 24px;'></div>", unsafe_allow_html=True)
+    render_section_header("Monte Carlo Surplus Distribution", "🎲")
+    _render_monte_carlo_fragment(ctx)
+
+
+# ============================================================
+# Fragment: Scenario Controls + KPIs + Waterfall + Top Movers
+# ============================================================
+
+@st.fragment
+def _render_scenario_fragment(ctx: dict):
+    """
+    Stress 交互区。slider 变化时 Streamlit 只重跑这个函数:
+    不重新加载数据、不重建 ctx、不执行其他 Tab，
+    stress 数值直接在 ctx['stress_basis'] 上做向量运算。
+    """
+    # ─────────────────────────────────────────────────────────
+    # 取 baseline 数据
+    # ─────────────────────────────────────────────────────────
+    basis = ctx['stress_basis']
+    baseline_assets = ctx['total_assets']
+    baseline_liabilities = ctx['total_liabilities']
+    baseline_funded = ctx['funded_status']
+    baseline_surplus = ctx['surplus']
+
     # ─────────────────────────────────────────────────────────
     # 3 列布局: [左: Preset+Current+Reset] | [中: Sliders] | [右: KPIs 2x2]
-    # 用单一 session_state["stress"] 存预设和三个值，Reset 只改这个 dict，不碰 widget key，避免报错和卡死
+    # Preset / Sliders 都绑 key；Preset 切换和 Reset 通过回调改 widget 值，
+    # 回调在 fragment 重跑前执行，所以不会出现 "widget 实例化后修改 key" 的报错。
+    # widget 创建前从 stress_scenario 回填，创建后写回（拖动 slider 也会保存）
     # ─────────────────────────────────────────────────────────
     options = list(PRESET_SCENARIOS.keys())
-    if "stress" not in st.session_state:
-        st.session_state["stress"] = {"preset": "Custom", "rate": 0, "equity": 0, "inflation": 0.0}
+    restore_widget_state("stress_scenario", _preset_state("Custom"))
 
     col_left, col_mid, col_right = st.columns([2.5, 3.5, 4])
 
     # ── 左列: Preset Dropdown ──
     with col_left:
-        idx = options.index(st.session_state["stress"]["preset"]) if st.session_state["stress"]["preset"] in options else 0
-        preset_name = st.selectbox(
+        st.selectbox(
             "Preset Scenario",
             options=options,
-            index=idx,
+            key="stress_preset",
+            on_change=_on_preset_change,
         )
-        preset = PRESET_SCENARIOS[preset_name]
-        # 预设变了则同步三个值
-        if preset_name != st.session_state["stress"]["preset"]:
-            st.session_state["stress"] = {
-                "preset": preset_name,
-                "rate": preset["rate"],
-                "equity": preset["equity"],
-                "inflation": preset["inflation"],
-            }
-
-    # ── 中列: 3 Sliders（用 stress 里的值，不绑 key） ──
+        curve_name = st.selectbox("Curve Shape", options=CURVE_OPTIONS, key="stress_curve")
+
+    # ── 中列: 3 Sliders ──
     with col_mid:
         s_rate = st.slider(
             "Rate (bp)",
-            min_value=-200, max_value=200,
-            value=st.session_state["stress"]["rate"], step=5,
+            min_value=-200, max_value=200, step=5,
+            key="stress_rate",
         )
         s_equity = st.slider(
             "Equity (%)",
-            min_value=-50, max_value=50,
-            value=st.session_state["stress"]["equity"], step=1,
+            min_value=-50, max_value=50, step=1,
+            key="stress_equity",
         )
         s_inflation = st.slider(
             "Inflation (%)",
-            min_value=-3.0, max_value=3.0,
-            value=st.session_state["stress"]["inflation"], step=0.1, format="%.1f",
+            min_value=-3.0, max_value=3.0, step=0.1, format="%.1f",
+            key="stress_inflation",
         )
-    # 用当前滑块值回写，保证下次 rerun 时保持
-    st.session_state["stress"]["rate"] = s_rate
-    st.session_state["stress"]["equity"] = s_equity
-    st.session_state["stress"]["inflation"] = s_inflation
-    st.session_state["stress"]["preset"] = preset_name
+    save_widget_state("stress_scenario", SCENARIO_KEYS)
 
     # ─────────────────────────────────────────────────────────
-    # 执行压力计算
+    # 执行压力计算（预计算 basis 上的向量运算）
     # ─────────────────────────────────────────────────────────
-    df_stressed = engine.calculate_metrics(df_day, s_rate, s_equity, s_inflation)
+    curve = curve_engine.CURVE_SCENARIOS.get(curve_name)
+    result = engine.apply_stress(basis, s_rate, s_equity, s_inflation, curve=curve)
 
-    assets_stressed = df_stressed[df_stressed['plan_category'] == 'Asset']
-    liabs_stressed = df_stressed[df_stressed['plan_category'] == 'Liability']
-
-    stressed_assets = assets_stressed['mtm_stressed'].sum()
-    stressed_liabilities = abs(liabs_stressed['mtm_stressed'].sum())
-    stressed_funded = stressed_assets / stressed_liabilities if stressed_liabilities != 0 else 0
-    stressed_surplus = stressed_assets - stressed_liabilities
+    stressed_assets = result['stressed_assets']
+    stressed_liabilities = result['stressed_liabilities']
+    stressed_funded = result['stressed_funded']
+    stressed_surplus = result['stressed_surplus']
 
     delta_assets = stressed_assets - baseline_assets
     delta_liabilities = stressed_liabilities - baseline_liabilities
@@ -224,6 +255,7 @@ def render(ctx: dict):
                 </div>
                 <div style="color:{COLORS['text_secondary']}; font-size:0.8rem; line-height:1.6;">
                     Rate: <span style="color:{COLORS['accent']}; font-weight:500;">{s_rate:+d} bp</span><br>
+                    Curve: <span style="color:{COLORS['accent']}; font-weight:500;">{curve_name}</span><br>
                     Equity: <span style="color:{COLORS['accent']}; font-weight:500;">{s_equity:+d}%</span><br>
                     Inflation: <span style="color:{COLORS['accent']}; font-weight:500;">{s_inflation:+.1f}%</span>
                 </div>
@@ -234,10 +266,8 @@ def render(ctx: dict):
 
         st.markdown("<div style='height: 8px;'></div>", unsafe_allow_html=True)
 
-        if st.button("🔄 Reset to Baseline", use_container_width=True):
-            st.session_state["stress"] = dict(PRESET_SCENARIOS["Custom"])
-            st.session_state["stress"]["preset"] = "Custom"
-            st.rerun()
+        # on_click 回调在 fragment 重跑之前执行，不需要额外 st.rerun()
+        st.button("🔄 Reset to Baseline", use_container_width=True, on_click=_reset_scenario)
 
     st.markdown("<div style='height: 24px;'></div>", unsafe_allow_html=True)
 
@@ -248,28 +278,125 @@ def render(ctx: dict):
 
     with col_waterfall:
         render_section_header("P&L Waterfall (Assets)", "📊")
-        _render_waterfall(df_day, assets_stressed, baseline_assets, s_rate, s_equity, s_inflation)
+        _render_waterfall(result, baseline_assets)
 
     with col_movers:
         render_section_header("Top Movers", "📋")
-        _render_top_movers(df_day, assets_stressed)
+        _render_top_movers(basis, result['position_pnl'])
+
+
+# ============================================================
+# Fragment: Monte Carlo 分布
+# ============================================================
+
+MC_PATH_OPTIONS = [100_000, 1_000_000]
+
+# 协方差来源: 假设值（mc_engine 默认）或 ctx 里的 EWMA 估计，都换算到 1 年期
+MC_COV_OPTIONS = ["Assumed (1y)", "EWMA estimate (1y)"]
+
+# Monte Carlo 控件的 widget key 与默认值，取值另存在 st.session_state["mc_settings"]
+MC_DEFAULTS = {
+    "mc_cov_source": MC_COV_OPTIONS[0],
+    "mc_paths": MC_PATH_OPTIONS[-1],
+    "mc_seed": mc_engine.MC_SEED,
+}
+
+
+@st.fragment
+def _render_monte_carlo_fragment(ctx: dict):
+    """
+    选定日期组合在相关因子冲击下的 ΔSurplus 分布（1 年期协方差）。
+    协方差 / 路径数 / Seed 变化只重跑这个 fragment；同一 ctx + 参数直接命中 mc_engine 的缓存。
+    """
+    col_controls, col_chart = st.columns([3, 7])
+    estimated_cov = cov_service.cov_from_ctx(ctx, cov_service.COV_ANNUALIZATION_DAYS)
+    cov_options = MC_COV_OPTIONS if estimated_cov is not None else MC_COV_OPTIONS[:1]
+
+    # 默认值由 restore_widget_state 写入 widget key，widget 本身不再传 index / value
+    restore_widget_state("mc_settings", MC_DEFAULTS)
+    if st.session_state["mc_cov_source"] not in cov_options:
+        st.session_state["mc_cov_source"] = cov_options[0]   # 新日期没有 EWMA 估计
+
+    with col_controls:
+        cov_source = st.radio(
+            "Covariance",
+            options=cov_options,
+            horizontal=True,
+            key="mc_cov_source",
+        )
+        n_paths = st.selectbox(
+            "Paths",
+            options=MC_PATH_OPTIONS,
+            format_func=lambda n: f"{n:,}",
+            key="mc_paths",
+        )
+        seed = st.number_input("Seed", min_value=0, step=1, key="mc_seed")
+    save_widget_state("mc_settings", MC_DEFAULTS)
+
+    with st.spinner("Simulating..."):
+        cov = estimated_cov if cov_source == MC_COV_OPTIONS[1] else None
+        result = mc_engine.simulate_context(ctx, cov=cov, n_paths=int(n_paths), seed=int(seed))
+    summary = result.summary_df()
+    var_99 = summary.iloc[-1]
+
+    with col_controls:
+        r1c1, r1c2 = st.columns(2)
+        with r1c1:
+            st.metric("99% VaR", f"${var_99['surplus_var']/1000:.1f}B")
+        with r1c2:
+            st.metric("99% ES", f"${var_99['surplus_es']/1000:.1f}B")
+        r2c1, r2c2 = st.columns(2)
+        with r2c1:
+            st.metric("σ ΔSurplus", f"${result.std_pnl/1000:.1f}B")
+        with r2c2:
+            st.metric("P(Funded < 100%)", format_percent(result.prob_underfunded))
+        st.caption(
+            f"{result.n_paths:,} paths · {result.n_chunks} chunks · {result.workers} worker{'s' if result.workers > 1 else ''} · {result.elapsed_s:.2f}s"
+        )
+
+    with col_chart:
+        _render_mc_histogram(result, summary)
 
 
 # ============================================================
 # 私有渲染函数
 # ============================================================
 
-def _render_waterfall(df_day, assets_stressed, baseline_assets, s_rate, s_equity, s_inflation):
-    """渲染 P&L 瀑布图"""
-    assets_baseline = df_day[df_day['plan_category'] == 'Asset']
+def _preset_state(preset_name: str) -> dict:
+    """预设场景 → 各场景控件 widget key 的取值"""
+    preset = PRESET_SCENARIOS[preset_name]
+    return {
+        "stress_preset": preset_name,
+        "stress_curve": preset.get("curve", CURVE_PARALLEL),
+        "stress_rate": preset["rate"],
+        "stress_equity": preset["equity"],
+        "stress_inflation": preset["inflation"],
+    }
+
+
+def _load_preset(preset_name: str):
+    """把预设场景写入 Preset / 曲线 / 3 个 Slider 的 widget state，并写回 stress_scenario"""
+    state = _preset_state(preset_name)
+    st.session_state.update(state)
+    st.session_state["stress_scenario"] = state
+
+
+def _on_preset_change():
+    """Preset 下拉回调: 同步三个 Slider 和曲线形状"""
+    _load_preset(st.session_state["stress_preset"])
+
 
-    rate_pnl = (assets_baseline['market_exposure_cad'] * 
-                (-assets_baseline['duration'] * s_rate / 10000)).sum()
-    equity_pnl = (assets_baseline['market_exposure_cad'] * 
-                  (assets_baseline['equity_beta'] * s_equity / 100)).sum()
-    inflation_pnl = (assets_baseline['market_exposure_cad'] * 
-                     (assets_baseline['inflation_beta'] * s_inflation / 100)).sum()
-    final_assets = assets_stressed['mtm_stressed'].sum()
+def _reset_scenario():
+    """Reset 按钮回调: 恢复 Custom 预设（三个冲击全 0，平行曲线）"""
+    _load_preset("Custom")
+
+
+def _render_waterfall(result: dict, baseline_assets: float):
+    """渲染 P&L 瀑布图（因子拆分已在 engine.apply_stress 中算好）"""
+    rate_pnl = result['rate_pnl']
+    equity_pnl = result['equity_pnl']
+    inflation_pnl = result['inflation_pnl']
+    final_assets = result['stressed_assets']
 
     stages = ['Baseline', 'Rate', 'Equity', 'Inflation', 'Final']
     values = [baseline_assets, rate_pnl, equity_pnl, inflation_pnl, final_assets]
@@ -300,18 +427,25 @@ def _render_waterfall(df_day, assets_stressed, baseline_assets, s_rate, s_equity
     st.plotly_chart(fig, use_container_width=True)
 
 
-def _render_top_movers(df_day, assets_stressed):
-    """渲染 Top Movers 表"""
-    baseline_assets = df_day[df_day['plan_category'] == 'Asset'][['asset_name', 'asset_class', 'mtm_cad']].copy()
-    stressed_mtm = assets_stressed[['asset_name', 'mtm_stressed']].copy()
+def _render_top_movers(basis: dict, position_pnl: np.ndarray):
+    """渲染 Top Movers 表（直接在 basis 数组上取资产行 P&L 前 5 / 后 5）"""
+    is_asset = basis['is_asset']
+    pnl = position_pnl[is_asset]
+    mtm = basis['mtm'][is_asset]
 
-    merged = pd.merge(baseline_assets, stressed_mtm, on='asset_name')
-    merged['pnl'] = merged['mtm_stressed'] - merged['mtm_cad']
-    merged['pnl_pct'] = merged['pnl'] / merged['mtm_cad'].abs() * 100
+    n = min(5, len(pnl))
+    order = np.argsort(pnl)
+    idx = np.concatenate([order[-n:], order[:n]])
 
-    top_gains = merged.nlargest(5, 'pnl')
-    top_losses = merged.nsmallest(5, 'pnl')
-    top_movers = pd.concat([top_gains, top_losses]).sort_values('pnl', ascending=False)
+    top_movers = pd.DataFrame({
+        'asset_name':   basis['asset_name'][is_asset][idx],
+        'asset_class':  basis['asset_class'][is_asset][idx],
+        'mtm_cad':      mtm[idx],
+        'mtm_stressed': mtm[idx] + pnl[idx],
+        'pnl':          pnl[idx],
+    })
+    top_movers['pnl_pct'] = top_movers['pnl'] / top_movers['mtm_cad'].abs() * 100
+    top_movers = top_movers.sort_values('pnl', ascending=False)
 
     display_df = top_movers[['asset_name', 'asset_class', 'mtm_cad', 'mtm_stressed', 'pnl', 'pnl_pct']].copy()
     display_df.columns = ['Asset', 'Class', 'Baseline', 'Stressed', 'P&L', 'P&L %']
@@ -334,4 +468,86 @@ def _render_top_movers(df_day, assets_stressed):
             "P&L": st.column_config.TextColumn("P&L", width="small"),
             "P&L %": st.column_config.TextColumn("P&L %", width="small"),
         },
-    )
\ No newline at end of file
+    )
+
+
+def _render_curve_scenarios(ctx: dict):
+    """左: 资产 / 负债在各关键期限上的 DV01；右: ctx['curve_scenarios_df'] 情景表"""
+    col_profile, col_table = st.columns([4, 6])
+
+    with col_profile:
+        # 利率下降 1bp 的价值变化（正数 = 多头久期），负债取绝对口径
+        dv01 = -curve_engine.key_rate_sensitivities(ctx['stress_basis'])
+        tenors = [f"{t}y" for t in curve_engine.KEY_RATE_TENORS]
+        fig = go.Figure([
+            go.Bar(name="Assets", x=tenors, y=dv01[:, 0], marker={"color": COLORS['accent']},
+                   hovertemplate="%{x}: $%{y:,.2f}M / bp<extra>Assets</extra>"),
+            go.Bar(name="Liabilities", x=tenors, y=-dv01[:, 1], marker={"color": COLORS['negative']},
+                   hovertemplate="%{x}: $%{y:,.2f}M / bp<extra>Liabilities</extra>"),
+        ])
+        base_layout = get_chart_layout(height=300)
+        base_layout["margin"] = dict(l=20, r=20, t=20, b=40)
+        fig.update_layout(**base_layout, barmode="group")
+        fig.update_xaxes(tickfont=dict(size=10, color=COLORS['text_tertiary']), gridcolor=COLORS['bg_border'])
+        fig.update_yaxes(title_text="DV01 ($M / bp)", tickfont=dict(size=9, color=COLORS['text_tertiary']),
+                         gridcolor=COLORS['bg_border'])
+        st.plotly_chart(fig, use_container_width=True)
+
+    with col_table:
+        table = ctx['curve_scenarios_df']
+        shift_cols = [f"shift_{t}y" for t in curve_engine.KEY_RATE_TENORS]
+        display_df = pd.DataFrame({
+            "Scenario":    table['scenario'],
+            "Shifts (bp)": table[shift_cols].apply(lambda r: " / ".join(f"{v:+.0f}" for v in r), axis=1),
+            "Asset Δ":     table['asset_pnl'].apply(lambda x: f"${x:+,.0f}M"),
+            "Liability Δ": table['liability_change'].apply(lambda x: f"${x:+,.0f}M"),
+            "Surplus Δ":   table['surplus_pnl'].apply(lambda x: f"${x:+,.0f}M"),
+            "Funded":      table['funded_status'].apply(format_percent),
+        })
+        st.dataframe(
+            display_df,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                "Scenario": st.column_config.TextColumn("Scenario", width="medium"),
+                "Shifts (bp)": st.column_config.TextColumn("Shifts (bp)", width="medium"),
+                "Asset Δ": st.column_config.TextColumn("Asset Δ", width="small"),
+                "Liability Δ": st.column_config.TextColumn("Liability Δ", width="small"),
+                "Surplus Δ": st.column_config.TextColumn("Surplus Δ", width="small"),
+                "Funded": st.column_config.TextColumn("Funded", width="small"),
+            },
+        )
+        st.caption(
+            f"Shifts at {' / '.join(f'{t}y' for t in curve_engine.KEY_RATE_TENORS)} on top of today's curve, "
+            f"no parallel move. Liabilities sit further out the curve than assets, so long-end moves dominate ΔSurplus."
+        )
+
+
+def _render_mc_histogram(result: "mc_engine.MonteCarloResult", summary: pd.DataFrame):
+    """ΔSurplus 直方图 + 95% / 99% VaR 竖线"""
+    hist = result.histogram_df()
+
+    fig = go.Figure(go.Bar(
+        x=hist['surplus_pnl'],
+        y=hist['probability'],
+        marker={"color": np.where(hist['surplus_pnl'] < 0, COLORS['negative'], COLORS['accent'])},
+        hovertemplate="ΔSurplus $%{x:,.0f}M<br>%{y:.2%}<extra></extra>",
+    ))
+    for _, row in summary[summary['confidence'].isin([0.95, 0.99])].iterrows():
+        fig.add_vline(
+            x=-row['surplus_var'],
+            line={"color": COLORS['text_secondary'], "width": 1, "dash": "dash"},
+            annotation_text=f"VaR {row['confidence']:.0%}",
+            annotation_font={"size": 10, "color": COLORS['text_secondary']},
+        )
+
+    base_layout = get_chart_layout(height=320)
+    base_layout["showlegend"] = False
+    base_layout["margin"] = dict(l=20, r=20, t=20, b=40)
+    fig.update_layout(**base_layout, bargap=0)
+    fig.update_xaxes(title_text="ΔSurplus", tickformat="$,.0f", ticksuffix="M",
+                     tickfont=dict(size=9, color=COLORS['text_tertiary']), gridcolor=COLORS['bg_border'])
+    fig.update_yaxes(tickformat=".1%", tickfont=dict(size=9, color=COLORS['text_tertiary']),
+                     gridcolor=COLORS['bg_border'])
+
+    st.plotly_chart(fig, use_container_width=True)
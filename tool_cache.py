@@ -0,0 +1,203 @@
+"""
+tool_cache.py — 工具输出缓存 (按 工具 + 规范化参数 + ctx 指纹)
+
+背景:
+    分析师经常换个说法问同一个问题: 一个 session 里 run_stress_test(100bp, -15%)、
+    get_limit_status() 会对同一个 ctx 重复执行好几次。工具只是 ctx 的纯函数，
+    但 limits / allocation / 对冲审计都要走 pandas，每次都从头算。
+
+设计:
+    - @memoize 装饰 skills_v2 的工具函数和 agent_logic_gov 的 _execute_* 镜像
+      （第一个参数是 ctx，其余是工具参数）
+    - key = (工具名, 规范化参数, ctx 指纹):
+        参数按函数签名绑定并补上默认值（省略默认值和显式传默认值是同一个 key），
+        数值统一成 float（100 和 100.0 是同一个 key），JSON sort_keys
+    - 按 ctx 指纹分桶: 换日期 / 数据更新 / ENGINE_VERSION 升级 → 指纹变化，旧输出不会被命中；
+      桶按 LRU 淘汰（TOOL_CACHE_MAX_CONTEXTS），整桶淘汰计入 invalidations
+    - 进程级单例，所有 session 共享（输出只取决于 ctx + 参数，与 session 无关）
+    - 存入和命中都 deepcopy，调用方修改返回值不会污染缓存
+    - 没有指纹的 ctx（手工拼的测试 dict）直接执行，计入 bypass
+
+对外暴露:
+    TOOL_CACHE_MAX_CONTEXTS / TOOL_CACHE_MAX_ENTRIES
+    ToolOutputCache (get / put / stats / clear)
+    get_cache() → 进程级单例
+    memoize(name=None) → 装饰器；被装饰函数多一个 .lookup(ctx, ...) → (output, cache_hit)
+"""
+
+import copy
+import functools
+import inspect
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+
+# 同时保留输出的 ctx 数（日期）上限，和每个 ctx 内的条目上限
+TOOL_CACHE_MAX_CONTEXTS = int(os.environ.get("TOOL_CACHE_MAX_CONTEXTS", 8))
+TOOL_CACHE_MAX_ENTRIES = int(os.environ.get("TOOL_CACHE_MAX_ENTRIES", 256))
+
+
+# ============================================================
+# Key
+# ============================================================
+
+def _canonical(value):
+    """参数值规范化: 数值 → float，numpy 标量 → Python 值，容器递归"""
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def _params_key(signature: inspect.Signature, args: tuple, kwargs: dict) -> str:
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    params = {name: _canonical(value) for name, value in list(bound.arguments.items())[1:]}
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+def _ctx_fingerprint(args: tuple, kwargs: dict) -> Optional[str]:
+    ctx = kwargs["ctx"] if "ctx" in kwargs else (args[0] if args else None)
+    try:
+        fingerprint = ctx.get("fingerprint")
+    except AttributeError:
+        return None
+    return fingerprint if isinstance(fingerprint, str) else None
+
+
+# ============================================================
+# ToolOutputCache
+# ============================================================
+
+class ToolOutputCache:
+    """线程安全的工具输出缓存: ctx 指纹 → {(工具, 参数) → 输出}，两层都是 LRU"""
+
+    def __init__(self,
+                 max_contexts: int = TOOL_CACHE_MAX_CONTEXTS,
+                 max_entries: int = TOOL_CACHE_MAX_ENTRIES):
+        self.max_contexts = max_contexts
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, OrderedDict]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "bypass": 0, "evictions": 0, "invalidations": 0}
+        self._per_tool: dict = {}    # tool → {"hits", "misses"}
+
+    def get(self, fingerprint: str, tool: str, params_key: str) -> Tuple[bool, object]:
+        """命中返回 (True, 输出副本)，否则 (False, None)"""
+        with self._lock:
+            bucket = self._buckets.get(fingerprint)
+            key = (tool, params_key)
+            counts = self._per_tool.setdefault(tool, {"hits": 0, "misses": 0})
+            if bucket is None or key not in bucket:
+                self._stats["misses"] += 1
+                counts["misses"] += 1
+                return False, None
+            self._buckets.move_to_end(fingerprint)
+            bucket.move_to_end(key)
+            self._stats["hits"] += 1
+            counts["hits"] += 1
+            output = bucket[key]
+        return True, copy.deepcopy(output)
+
+    def put(self, fingerprint: str, tool: str, params_key: str, output):
+        output = copy.deepcopy(output)
+        with self._lock:
+            bucket = self._buckets.get(fingerprint)
+            if bucket is None:
+                bucket = self._buckets[fingerprint] = OrderedDict()
+            self._buckets.move_to_end(fingerprint)
+            bucket[(tool, params_key)] = output
+            while len(bucket) > self.max_entries:
+                bucket.popitem(last=False)
+                self._stats["evictions"] += 1
+            # 整个 ctx 的输出一起失效（最久没用的日期）
+            while len(self._buckets) > self.max_contexts:
+                self._buckets.popitem(last=False)
+                self._stats["invalidations"] += 1
+
+    def record_bypass(self):
+        with self._lock:
+            self._stats["bypass"] += 1
+
+    def invalidate(self, fingerprint: str) -> bool:
+        """手动丢弃某个 ctx 的全部输出"""
+        with self._lock:
+            dropped = self._buckets.pop(fingerprint, None) is not None
+            if dropped:
+                self._stats["invalidations"] += 1
+            return dropped
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                "contexts": len(self._buckets),
+                "entries": sum(len(b) for b in self._buckets.values()),
+                "per_tool": {
+                    tool: {**c, "hit_rate": c["hits"] / (c["hits"] + c["misses"]) if c["hits"] + c["misses"] else 0.0}
+                    for tool, c in self._per_tool.items()
+                },
+            }
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# 进程级单例
+_cache = ToolOutputCache()
+
+
+def get_cache() -> ToolOutputCache:
+    return _cache
+
+
+# ============================================================
+# PUBLIC: memoize
+# ============================================================
+
+def memoize(name: Optional[str] = None) -> Callable:
+    """
+    工具函数装饰器（第一个参数必须是 ctx）。
+
+    name: 统计里显示的工具名，默认 "模块.函数名"；同名工具的不同实现要用不同的 name。
+    被装饰的函数照常调用；.lookup(...) 额外返回是否命中缓存（思考步骤的 ⚡ 标记用）。
+    """
+    def decorator(fn: Callable) -> Callable:
+        tool = name or f"{fn.__module__}.{fn.__name__}"
+        signature = inspect.signature(fn)
+
+        def lookup(*args, **kwargs) -> Tuple[object, bool]:
+            fingerprint = _ctx_fingerprint(args, kwargs)
+            if fingerprint is None:
+                _cache.record_bypass()
+                return fn(*args, **kwargs), False
+            params_key = _params_key(signature, args, kwargs)
+            hit, output = _cache.get(fingerprint, tool, params_key)
+            if hit:
+                return output, True
+            output = fn(*args, **kwargs)
+            _cache.put(fingerprint, tool, params_key, output)
+            return output, False
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return lookup(*args, **kwargs)[0]
+
+        wrapper.lookup = lookup
+        wrapper.tool_name = tool
+        return wrapper
+
+    return decorator
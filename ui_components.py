@@ -12,8 +12,16 @@ ui_components.py — HOOPP Risk Navigator UI 组件库
     - render_section_header(): 区块标题
     - get_chart_layout(): Plotly 图表通用布局
     - format_number(), format_percent(): 格式化函数
+    - get_cached_figure(): 按 (ctx 指纹, chart, 主题) 缓存 Plotly 图表（跨 session 共享）
+    - render_chat_history(): 渲染 ConversationMemory（折叠摘要 + 最近几轮原文）
+    - restore_widget_state() / save_widget_state(): 带 key 的 widget 在切换 Tab 后保留取值
 """
 
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
 import streamlit as st
 
 # ============================================================
@@ -548,6 +556,23 @@ def render_section_header(title: str, icon: str = "📊"):
     )
 
 
+def render_chat_history(memory):
+    """
+    渲染 Copilot 聊天记录 (conversation_memory.ConversationMemory)。
+    已折叠的轮次放在顶部的摘要 expander 里，最后一行显示历史占用的 token。
+    """
+    if memory.summary:
+        with st.expander(f"🗂️ Earlier conversation · {memory.folded_turns} turns summarized"):
+            st.text(memory.summary)
+
+    for message in memory:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+
+    stats = memory.stats()
+    st.caption(f"History: {stats['turns']} recent turns · ~{stats['tokens']:,} tokens")
+
+
 def get_chart_layout(height: int = 300) -> dict:
     """
     返回 Plotly 图表的通用布局配置 (浅色主题)。
@@ -585,6 +610,70 @@ def get_chart_layout(height: int = 300) -> dict:
     }
 
 
+# ============================================================
+# Widget state 持久化 - 切换 Tab 后保留取值
+# ============================================================
+# app.py 只渲染当前 Tab；一次 run 里没有渲染的 widget，Streamlit 会删掉它的 key，
+# 切回来时 widget 回到默认值。带 key 的 widget 把取值另存一份到非 widget 的 store_key（dict），
+# widget 创建前用它回填，创建后再写回。
+
+def restore_widget_state(store_key: str, defaults: dict) -> None:
+    """
+    widget 创建之前调用: 被清理掉的 widget key 从 st.session_state[store_key] 回填，
+    第一次进入时用 defaults。已存在的 key（本 Tab 上一次 run 留下的）不动。
+    """
+    saved = st.session_state.get(store_key, {})
+    for key, default in defaults.items():
+        if key not in st.session_state:
+            st.session_state[key] = saved.get(key, default)
+
+
+def save_widget_state(store_key: str, keys) -> None:
+    """widget 创建之后调用: 把这些 widget key 的当前值写回 st.session_state[store_key]"""
+    st.session_state[store_key] = {key: st.session_state[key] for key in keys}
+
+
+# ============================================================
+# 图表缓存 - 进程级，跨 rerun / 跨 session 共享
+# ============================================================
+
+# 主题指纹: 颜色常量变了，所有缓存的图表自动失效
+THEME_KEY = hashlib.md5(
+    json.dumps([COLORS, ASSET_COLORS, CHART_COLORS], sort_keys=True).encode()
+).hexdigest()[:8]
+
+FIGURE_CACHE_MAX_ENTRIES = 256
+
+_figure_cache: "OrderedDict[tuple, str]" = OrderedDict()
+_figure_cache_lock = threading.Lock()
+
+
+def get_cached_figure(ctx: dict, tab: str, chart_id: str, builder) -> dict:
+    """
+    按 (ctx['fingerprint'], tab, chart_id, THEME_KEY) 缓存 Plotly 图表。
+
+    缓存值是 fig.to_json() 序列化后的字符串，放在进程级 LRU 里，
+    同一天的图表在所有 rerun 和所有用户 session 之间共享；
+    命中时直接返回 figure dict（st.plotly_chart 可直接渲染），不再跑 builder(ctx)。
+    """
+    key = (ctx['fingerprint'], tab, chart_id, THEME_KEY)
+
+    with _figure_cache_lock:
+        fig_json = _figure_cache.get(key)
+        if fig_json is not None:
+            _figure_cache.move_to_end(key)
+
+    if fig_json is None:
+        fig_json = builder(ctx).to_json()
+        with _figure_cache_lock:
+            _figure_cache[key] = fig_json
+            _figure_cache.move_to_end(key)
+            while len(_figure_cache) > FIGURE_CACHE_MAX_ENTRIES:
+                _figure_cache.popitem(last=False)
+
+    return json.loads(fig_json)
+
+
 def format_number(value: float, prefix: str = "", suffix: str = "", decimals: int = 1) -> str:
     """
     格式化数字，自动选择 B/M/K 单位。
@@ -0,0 +1,321 @@
+"""
+var_engine.py — 盈余 VaR / ES（历史模拟法，按时间序列整体向量化）
+
+背景:
+    Navigator 只有点状压力测试（Tab3 slider / run_stress_test），没有任何分布型风险指标:
+    "正常市场下盈余一天可能亏多少" 回答不了。
+    df_all 里已经有每天的仓位快照，足够反推每天的因子变动，作为历史情景。
+
+设计:
+    - 因子 = Scheme A 的三个: 利率 (bp)、权益 (%)、通胀 (%)，单位与 calculate_metrics 一致
+    - 因子变动反推: 资产按 sub_asset_class 聚成 sleeve（asset_name 每天都变，仓位无法跨日对应），
+      对每个日期 t 做一次加权最小二乘:
+          R_k,t = M_k,t / M_k,t-1 − 1  ≈  x_k,t-1 · f_t
+          x_k,t-1 = [−Σexp·dur / 1e4, Σexp·β / 100, Σexp·infl / 100] / M_k,t-1
+      （dur = 关键期限久期之和，利率因子按平行移动处理）
+      权重 |M_k,t-1|；全部日期用 bincount 聚合 + einsum 法方程 + 批量 np.linalg.solve 一次解完，
+      不按日期循环。负债不逐日估值，不参与反推
+    - 情景 P&L: 线性模型下仓位 P&L 可以先按资产 / 负债汇总敏感度（N×3 → 3×2），
+      再用一次矩阵乘 F (T×3) @ S (3×2) 得到全部情景的资产 / 负债 P&L，
+      不展开 T×N 的仓位级矩阵 → 10 万仓位 × 多年历史仍在毫秒级
+    - 只用 selected_date 及之前的因子变动（不偷看未来）
+    - VaR = 损失分布的经验分位数（inverted CDF，不插值），ES = 不低于 VaR 的尾部均值；
+      多个置信度一次排序、尾部累积和一起算
+    - 因子变动只依赖 df_all，按 data_fp 缓存，切换日期不重算
+
+对外暴露:
+    VAR_CONFIDENCES / VAR_MIN_SCENARIOS
+    FACTOR_COLUMNS
+    factor_moves(df_all, data_fp) → DataFrame
+    unit_pnl(basis) → ndarray (N, 3)
+    factor_sensitivities(basis) → ndarray (3, 2)
+    scenario_pnl(basis, moves) → (asset_pnl, liability_pnl)
+    historical_var(basis, moves_df, as_of, confidences) → (var_df, scenarios_df)
+    parametric_var(basis, cov, confidences) → dict   (delta-normal，协方差来自 cov_service)
+    tool_output(ctx, cov, worst_n) → dict   (Copilot get_surplus_var 的输出，skills_v2 / agent_logic_gov 共用)
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from statistics import NormalDist
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+import curve_engine
+
+
+VAR_CONFIDENCES = tuple(
+    float(c) for c in os.environ.get("VAR_CONFIDENCES", "0.95,0.975,0.99").split(",")
+)
+
+# 情景数少于该值时结果只作参考（监管口径通常要求 ≥ 1 年日度数据）
+VAR_MIN_SCENARIOS = int(os.environ.get("VAR_MIN_SCENARIOS", 250))
+
+# 因子列顺序即敏感度矩阵的行顺序
+FACTOR_COLUMNS = ['rate_bp', 'equity_pct', 'inflation_pct']
+
+# 法方程的相对 ridge: 某个因子当天没有任何敞口时解为 0，而不是奇异矩阵
+_RIDGE = 1e-9
+
+# 按 data_fp 缓存的因子变动表个数
+_MOVES_CACHE_SIZE = 4
+_moves_cache: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+_moves_lock = threading.Lock()
+
+
+# ============================================================
+# PUBLIC: factor_moves
+# ============================================================
+
+def factor_moves(df_all: pd.DataFrame, data_fp: Optional[str] = None) -> pd.DataFrame:
+    """
+    从仓位历史反推每日因子变动。
+
+    返回 (按日期升序，第一天没有前一日，不出现):
+        date | rate_bp | equity_pct | inflation_pct | n_sleeves
+    data_fp: 可选，data_fingerprint；给了就按它缓存
+    """
+    if data_fp is not None:
+        with _moves_lock:
+            cached = _moves_cache.get(data_fp)
+            if cached is not None:
+                _moves_cache.move_to_end(data_fp)
+                return cached
+
+    moves = _implied_moves(df_all)
+
+    if data_fp is not None:
+        with _moves_lock:
+            _moves_cache[data_fp] = moves
+            while len(_moves_cache) > _MOVES_CACHE_SIZE:
+                _moves_cache.popitem(last=False)
+    return moves
+
+
+def _implied_moves(df_all: pd.DataFrame) -> pd.DataFrame:
+    assets = df_all[(df_all['plan_category'] == 'Asset').to_numpy()]
+    date_idx, dates = pd.factorize(assets['timestamp'], sort=True)
+    sleeve_idx, sleeves = pd.factorize(assets['sub_asset_class'])
+    n_dates, n_sleeves = len(dates), len(sleeves)
+    if n_dates < 2:
+        return pd.DataFrame(columns=['date', *FACTOR_COLUMNS, 'n_sleeves'])
+
+    # ① (日期, sleeve) 聚合: 市值 + 三个因子的敞口
+    cell = date_idx * n_sleeves + sleeve_idx
+    size = n_dates * n_sleeves
+    exposure = assets['market_exposure_cad'].to_numpy(dtype=float)
+
+    def _sum(weights: np.ndarray) -> np.ndarray:
+        return np.bincount(cell, weights=weights, minlength=size).reshape(n_dates, n_sleeves)
+
+    mtm = _sum(assets['mtm_cad'].to_numpy(dtype=float))
+    sens = np.stack([
+        _sum(-exposure * curve_engine.krd_matrix(assets).sum(axis=1)) / 10_000,
+        _sum(exposure * assets['equity_beta'].to_numpy(dtype=float)) / 100,
+        _sum(exposure * assets['inflation_beta'].to_numpy(dtype=float)) / 100,
+    ], axis=-1)                                                   # (T, K, 3)
+
+    # ② sleeve 日收益 ≈ 前一日单位市值敏感度 · 因子变动
+    prev = mtm[:-1]
+    valid = np.abs(prev) > 0
+    safe_prev = np.where(valid, prev, 1.0)
+    returns = np.where(valid, mtm[1:] / safe_prev - 1.0, 0.0)     # (T-1, K)
+    x = sens[:-1] / safe_prev[..., None]                          # (T-1, K, 3)
+    w = np.where(valid, np.abs(prev), 0.0)                        # (T-1, K)
+
+    # ③ 全部日期的加权最小二乘一次解完: (Xᵀ W X + λI) f = Xᵀ W r
+    normal = np.einsum('tk,tki,tkj->tij', w, x, x)
+    rhs = np.einsum('tk,tki,tk->ti', w, x, returns)
+    ridge = _RIDGE * np.trace(normal, axis1=1, axis2=2) / 3 + np.finfo(float).tiny
+    normal[:, np.arange(3), np.arange(3)] += ridge[:, None]
+    solved = np.linalg.solve(normal, rhs[..., None])[..., 0]      # (T-1, 3)
+
+    moves = pd.DataFrame(solved, columns=FACTOR_COLUMNS)
+    moves.insert(0, 'date', dates[1:])
+    moves['n_sleeves'] = valid.sum(axis=1)
+    return moves
+
+
+# ============================================================
+# PUBLIC: unit_pnl / factor_sensitivities / scenario_pnl / historical_var
+# ============================================================
+
+def unit_pnl(basis: dict) -> np.ndarray:
+    """仓位 × 因子的单位冲击 P&L 矩阵 (N, 3)，列顺序同 FACTOR_COLUMNS"""
+    return np.column_stack([
+        basis['rate_pnl_1bp'], basis['equity_pnl_1pct'], basis['infl_pnl_1pct'],
+    ])
+
+
+def factor_sensitivities(basis: dict) -> np.ndarray:
+    """
+    build_stress_basis 的仓位敏感度按 资产 / 负债 汇总: (3, 2)，
+    行 = FACTOR_COLUMNS（每 1bp / 1% 的 P&L），列 = [资产, 负债]。
+    线性模型下任何因子情景的 P&L 都只需要这 6 个数。
+    """
+    is_asset = np.asarray(basis['is_asset'], dtype=bool)
+    side = np.column_stack([is_asset, ~is_asset]).astype(float)   # (N, 2)
+    return unit_pnl(basis).T @ side
+
+
+def scenario_pnl(basis: dict, moves: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    在 build_stress_basis 的敏感度上批量执行情景。
+
+    moves: (T, 3) 因子变动，列顺序同 FACTOR_COLUMNS
+    返回: (资产 P&L, 负债 P&L)，各 (T,)；负债 P&L 为正表示负债现值下降
+    """
+    pnl = np.asarray(moves, dtype=float).reshape(-1, 3) @ factor_sensitivities(basis)   # (T, 2)
+    return pnl[:, 0], pnl[:, 1]
+
+
+def historical_var(basis: dict,
+                   moves_df: pd.DataFrame,
+                   as_of=None,
+                   confidences: Sequence[float] = VAR_CONFIDENCES) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    盈余 VaR / ES。
+
+    as_of: 只用该日期及之前的因子变动；None → 全部
+    返回:
+        var_df       : confidence | surplus_var | surplus_es | funded_var | funded_es | n_scenarios
+                       （盈余单位同 mtm_cad；funded_* 是融资比率的下降幅度，0.02 = 2 个百分点）
+        scenarios_df : date | rate_bp | equity_pct | inflation_pct |
+                       asset_pnl | liability_pnl | surplus_pnl | funded_status
+    """
+    if as_of is not None and len(moves_df):
+        moves_df = moves_df[moves_df['date'] <= pd.Timestamp(as_of)]
+
+    asset_pnl, liability_pnl = scenario_pnl(basis, moves_df[FACTOR_COLUMNS].to_numpy(dtype=float))
+
+    is_asset = np.asarray(basis['is_asset'], dtype=bool)
+    total_assets = basis['mtm'][is_asset].sum()
+    total_liabilities = abs(basis['mtm'][~is_asset].sum())
+    base_funded = total_assets / total_liabilities if total_liabilities != 0 else 0.0
+    stressed_liabilities = total_liabilities - liability_pnl
+    funded = np.divide(total_assets + asset_pnl, stressed_liabilities,
+                       out=np.zeros_like(asset_pnl), where=stressed_liabilities != 0)
+
+    surplus_pnl = asset_pnl + liability_pnl
+    scenarios_df = moves_df[['date', *FACTOR_COLUMNS]].reset_index(drop=True)
+    scenarios_df['asset_pnl'] = asset_pnl
+    scenarios_df['liability_pnl'] = liability_pnl
+    scenarios_df['surplus_pnl'] = surplus_pnl
+    scenarios_df['funded_status'] = funded
+
+    levels = np.asarray(confidences, dtype=float)
+    surplus_var, surplus_es = _tail_stats(-surplus_pnl, levels)
+    funded_var, funded_es = _tail_stats(base_funded - funded, levels)
+    var_df = pd.DataFrame({
+        'confidence':  levels,
+        'surplus_var': surplus_var,
+        'surplus_es':  surplus_es,
+        'funded_var':  funded_var,
+        'funded_es':   funded_es,
+        'n_scenarios': len(surplus_pnl),
+    })
+    return var_df, scenarios_df
+
+
+def parametric_var(basis: dict,
+                   cov: np.ndarray,
+                   confidences: Sequence[float] = VAR_CONFIDENCES) -> dict:
+    """
+    Delta-normal 盈余 VaR / ES: σ = √(gᵀ Σ g)，g = 盈余对三个因子的敏感度。
+
+    cov: 因子协方差（期限由调用方决定，cov_service.cov_from_ctx 默认 1 日）
+    """
+    gradient = factor_sensitivities(basis).sum(axis=1)
+    sigma = float(np.sqrt(max(gradient @ cov @ gradient, 0.0)))
+    normal = NormalDist()
+    levels = []
+    for confidence in confidences:
+        z = normal.inv_cdf(confidence)
+        levels.append({
+            "confidence":  float(confidence),
+            "surplus_var": z * sigma,
+            "surplus_es":  sigma * normal.pdf(z) / (1.0 - confidence),
+        })
+    return {"surplus_sigma": sigma, "levels": levels}
+
+
+def _tail_stats(losses: np.ndarray, levels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """经验 VaR（inverted CDF）和 ES（VaR 及更差情景的均值）；没有情景时为 NaN"""
+    n = len(losses)
+    if n == 0:
+        nan = np.full(len(levels), np.nan)
+        return nan, nan.copy()
+    ordered = np.sort(losses)
+    idx = np.clip(np.ceil(levels * n).astype(int) - 1, 0, n - 1)
+    tail_sum = np.cumsum(ordered[::-1])[::-1]                     # tail_sum[i] = Σ ordered[i:]
+    return ordered[idx], tail_sum[idx] / (n - idx)
+
+
+# ============================================================
+# PUBLIC: tool_output
+# ============================================================
+
+def _number(value) -> Optional[float]:
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def tool_output(ctx: dict, cov: Optional[np.ndarray] = None, worst_n: int = 3) -> dict:
+    """
+    ctx 里的 surplus_var_df / var_scenarios_df → Copilot 工具输出（纯 Python 值，可 JSON）。
+
+    cov: 1 日因子协方差（cov_service.cov_from_ctx）；给了就附带参数法结果
+    """
+    var_df = ctx['surplus_var_df']
+    scenarios_df = ctx['var_scenarios_df']
+    n_scenarios = len(scenarios_df)
+
+    levels = [
+        {
+            "confidence":  float(row.confidence),
+            "surplus_var": _number(row.surplus_var),
+            "surplus_es":  _number(row.surplus_es),
+            "funded_var":  _number(row.funded_var),
+            "funded_es":   _number(row.funded_es),
+        }
+        for row in var_df.itertuples(index=False)
+    ]
+    worst = scenarios_df.nsmallest(worst_n, 'surplus_pnl')
+    worst_scenarios = [
+        {
+            "date":          str(pd.Timestamp(row.date).date()),
+            "rate_bp":       float(row.rate_bp),
+            "equity_pct":    float(row.equity_pct),
+            "inflation_pct": float(row.inflation_pct),
+            "surplus_pnl":   float(row.surplus_pnl),
+            "funded_status": float(row.funded_status),
+        }
+        for row in worst.itertuples(index=False)
+    ]
+
+    if n_scenarios == 0:
+        message = "No history before the selected date; VaR is not available."
+    else:
+        top = levels[-1]
+        message = (f"{top['confidence']:.1%} 1-day surplus VaR ${top['surplus_var']:,.0f}M, "
+                   f"ES ${top['surplus_es']:,.0f}M from {n_scenarios} historical scenarios")
+        if n_scenarios < VAR_MIN_SCENARIOS:
+            message += f" (fewer than {VAR_MIN_SCENARIOS}; indicative only)"
+
+    return {
+        "method": "historical_simulation",
+        "horizon_days": 1,
+        "n_scenarios": n_scenarios,
+        "history_start": str(pd.Timestamp(scenarios_df['date'].min()).date()) if n_scenarios else None,
+        "history_end": str(pd.Timestamp(scenarios_df['date'].max()).date()) if n_scenarios else None,
+        "surplus": float(ctx['surplus']),
+        "funded_status": float(ctx['funded_status']),
+        "levels": levels,
+        "worst_scenarios": worst_scenarios,
+        "small_sample": n_scenarios < VAR_MIN_SCENARIOS,
+        "parametric": parametric_var(ctx['stress_basis'], cov) if cov is not None else None,
+        "message": message,
+    }